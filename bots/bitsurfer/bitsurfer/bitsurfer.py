@@ -1,4 +1,6 @@
 from binance_client.client import BinanceClient
+from binance_client.ring import TradeRing
+import numpy as np
 import pandas as pd
 import threading
 import time
@@ -8,9 +10,10 @@ from wallet import WalletManager
 from streams import StreamsManager
 from decisions import DecisionsManager
 from orders import OrdersManager
-from math import floor
 import logging
 
+KEYS_FILE = "/home/lavin/.binance/keys.json"
+
 pd.set_option("display.float_format", "{:.10f}".format)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -25,10 +28,16 @@ logger.addHandler(ch)
 
 
 class Bitsurfer(threading.Thread):
-    def __init__(self):
+    # With a stream_factory, e.g. to replay recorded trades, or a
+    # record_directory to record the trades received, see StreamsManager.
+    # binance replaces the BinanceClient, e.g. a ReplayBinanceClient on the
+    # clock of the replay to run offline.
+    def __init__(self, stream_factory=None, record_directory=None, binance=None):
         threading.Thread.__init__(self)
         self._test_net = False
-        self.binance = BinanceClient("/home/lavin/.binance/keys.json", self._test_net)
+        if binance is None:
+            binance = BinanceClient(KEYS_FILE, self._test_net)
+        self.binance = binance
         self._ops_frequency = 1
         self._ops_time_unit = "T"
         self._future_periods = 1
@@ -45,7 +54,7 @@ class Bitsurfer(threading.Thread):
         self._pairs_df = pd.DataFrame(columns=["pair", "growth"])
         # Encapsulate the state dataframes in a dictionary so that they
         # can be shared among the managers
-        self._messages = []
+        self._messages = TradeRing()  # written by the streams thread only
         self._max_pair_prices_vols = {}
         self._balances = {}
         self.states = {
@@ -66,7 +75,11 @@ class Bitsurfer(threading.Thread):
         )
         self.wallet_manager = WalletManager(client=self.binance, states=self.states)
         self.streams_manager = StreamsManager(
-            binance=self.binance, states=self.states, test=self._test_net
+            binance=self.binance,
+            states=self.states,
+            test=self._test_net,
+            stream_factory=stream_factory,
+            record_directory=record_directory,
         )
         self.decisions_manager = DecisionsManager(states=self.states)
         self.orders_manager = OrdersManager(binance=self.binance, states=self.states)
@@ -79,7 +92,6 @@ class Bitsurfer(threading.Thread):
             drop=True
         )
         self.states["pred_errors"] = self.states["pred_errors"].dropna()
-        self.states["messages"] = self.states["messages"][-2000:]
 
     def _get_old_periods(self):
         return self._ops_frequency * 4
@@ -112,21 +124,20 @@ class Bitsurfer(threading.Thread):
             self.orders_manager.test_order(decision)
 
     def crunch_messages(self):
-        buffer_df = pd.DataFrame(columns=["ts", "price", "vol", "pair"])
-        crunch = self.states["messages"][:]
+        messages = self.states["messages"]
+        crunch = messages.drain()
         logger.info(f"Crunching {len(crunch)} messages.")
-        for i, m in enumerate(crunch):
-            try:
-                ts = float(floor(m["E"] / 1000))
-                price = float(m["p"])
-                vol = float(m["q"])
-                pair = m["s"]
-                buffer_df.loc[i] = [ts, price, vol, pair]
-            except KeyError as e:
-                logger.error(f"Key error for message {m}")
-        self.states["messages"] = [
-            m for m in self.states["messages"] if m not in crunch
-        ]
+        if messages.overflows > 0:
+            logger.warning(f"{messages.overflows} trades dropped so far, buffer full")
+        pairs = np.array(messages.symbols(), dtype=object)
+        buffer_df = pd.DataFrame(
+            {
+                "ts": np.floor(crunch["time"] / 1000),
+                "price": crunch["price"],
+                "vol": crunch["quantity"],
+                "pair": pairs[crunch["symbol"]],
+            }
+        )
         for pair in buffer_df.pair.unique():
             pair_df = buffer_df[buffer_df["pair"] == pair].drop(columns="pair")
             pair_df["datetime"] = pd.to_datetime(pair_df["ts"], unit="s")
@@ -3,52 +3,74 @@ from math import floor
 import logging
 import binance_client.constants as cts
 from datetime import datetime as dtt
-from binance_client.stream import BinanceStreamClient
-import json
+from binance_client.events import Trade
+from binance_client.supervisor import StreamSupervisor
+from typing import Callable, List, Optional
 
 MAX_TICKERS_TO_TRACK = 10
 
+# Trades are passed in batches, handled once per batch instead of per trade
+TRADES_BATCH_SIZE = 500
+TRADES_BATCH_INTERVAL = 0.25  # seconds
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
 class StreamsManager:
-    def __init__(self, binance, states: dict, test: bool = False):
+    # stream_factory(streams, on_message) replaces the supervisor if given,
+    # e.g. a ReplayStreamClient passing batches of records to run offline.
+    #
+    # With a record_directory, the trades received are recorded there to see
+    # later what the bot saw, see StreamSupervisor.
+    def __init__(
+        self,
+        binance,
+        states: dict,
+        test: bool = False,
+        stream_factory: Optional[Callable] = None,
+        record_directory: Optional[str] = None,
+    ):
         self.binance = binance
         self.states = states
+        self._stream_factory = stream_factory
+        self._record_directory = record_directory
         self.streams = []
         self._test_net = test
         self.trades_stream = None
 
-    def _handle_trade_message(self, msg):
-        m = json.loads(msg)
-        if "result" in m.keys():
-            return
-        if "stream" in m.keys() and "data" in m.keys():
-            self.states["messages"].append(m["data"])
-            return
-        self.states["messages"].append(m)
+    def _handle_trade_message(self, trades: List[Trade]):
+        self.states["messages"].push_many(trades)
 
     def _create_streams(self):
+        # The connection is kept across refreshes, only the streams of the
+        # pairs that changed are subscribed or unsubscribed
         self.streams = []
         # logger.info(f"Pairs in Streams: {self.states["pairs"]}")
         for pair in self.states["pairs"]["pair"]:
             self.streams.append(f"{pair.lower()}@trade")
-        self.trades_stream = BinanceStreamClient(
+        if self.trades_stream is not None and self.trades_stream.is_alive():
+            self.trades_stream.set_streams(self.streams)
+            return
+        if self._stream_factory is not None:
+            self.trades_stream = self._stream_factory(
+                self.streams, self._handle_trade_message
+            )
+            self.trades_stream.start()
+            return
+        self.trades_stream = StreamSupervisor(
             streams=self.streams,
             on_message=self._handle_trade_message,
             test_net=self._test_net,
+            market_data=self.binance.market_data,
+            batch_size=TRADES_BATCH_SIZE,
+            batch_interval=TRADES_BATCH_INTERVAL,
+            record_directory=self._record_directory,
         )
         self.trades_stream.start()
 
-    def _unsub_old_streams(self):
-        if self.trades_stream is None:
-            return
-        self.trades_stream.stop()
-
     def refresh(self):
         self._acquire_targets()
-        self._unsub_old_streams()
         self._create_streams()
 
     def stop(self):
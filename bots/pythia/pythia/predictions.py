@@ -6,10 +6,21 @@ from math import floor
 import numpy as np
 import binance_client.constants as cts
 import pandas as pd
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+KLINE_INTERVALS = {  # operation frequency in minutes -> kline interval
+    1: cts.KLINE_INTERVAL_MINUTES_1,
+    3: cts.KLINE_INTERVAL_MINUTES_3,
+    5: cts.KLINE_INTERVAL_MINUTES_5,
+    15: cts.KLINE_INTERVAL_MINUTES_15,
+    30: cts.KLINE_INTERVAL_MINUTES_30,
+    60: cts.KLINE_INTERVAL_HOURS_1,
+    120: cts.KLINE_INTERVAL_HOURS_2,
+}
+
 
 class PredictionsManager:
     def __init__(self, binance, ops_freq, future_periods, ops_time_unit, states):
@@ -48,53 +59,55 @@ class PredictionsManager:
                 predict_df = pair_df
         return predict_df
 
-    def kline_prediction(self, pair: str) -> pd.DataFrame:
-        pair_df = pd.DataFrame(columns=["ts", "price", "vol", "pair"])
-        interval_dict = {
-            1: cts.KLINE_INTERVAL_MINUTES_1,
-            3: cts.KLINE_INTERVAL_MINUTES_3,
-            5: cts.KLINE_INTERVAL_MINUTES_5,
-            15: cts.KLINE_INTERVAL_MINUTES_15,
-            30: cts.KLINE_INTERVAL_MINUTES_30,
-            60: cts.KLINE_INTERVAL_HOURS_1,
-            120: cts.KLINE_INTERVAL_HOURS_2,
-        }
-        if self._ops_frequency not in interval_dict.keys():
+    def kline_interval(self) -> Optional[str]:
+        return KLINE_INTERVALS.get(self._ops_frequency)
+
+    def kline_predictions(self, pairs: List[str]) -> Dict[str, pd.DataFrame]:
+        # From the klines streamed to states["klines"], including the open one
+        interval = self.kline_interval()
+        if interval is None:
             logger.error(
                 f"Cannot perform auxiliary kline predictions: \
                 operation frequency ({self._ops_frequency}m) is not a valid kline interval."
             )
+            return {}
         start_time = (
             floor(dtt.now().timestamp() - (self._ops_frequency * 3 * 60)) * 1000
         )
-        kline_data = self.binance.market_data.kline_candlestick_data(
-            symbol=pair,
-            interval=interval_dict[self._ops_frequency],
-            start_time=start_time,
-            end_time=floor(dtt.now().timestamp()) * 1000,
-            limit=1000,
-        )["content"]
-        for i, kline in enumerate(kline_data):
-            # close_time = kline[6] / 1000 # close_time
-            close_time = kline[0] / 1000  # open_time
-            average_price = (float(kline[2]) + float(kline[3])) / 2
-            volume = float(kline[5])
-            pair_df.loc[i] = [close_time, average_price, volume, pair]
-        # logger.info(f"KLINE PAIR DF: \n{pair_df.head(10)}")
-        return pair_df
+        predict_dfs = {}
+        for pair in pairs:
+            klines = self.states["klines"].klines(pair, interval, include_open=True)
+            predict_dfs[pair] = self._klines_to_df(
+                pair, klines[klines["open_time"] >= start_time]
+            )
+        return predict_dfs
+
+    def _klines_to_df(self, pair: str, klines: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "ts": klines["open_time"] / 1000,  # open_time
+                "price": (klines["high"] + klines["low"]) / 2,
+                "vol": klines["volume"],
+                "pair": pair,
+            }
+        )
 
     def run_prediction(self):
+        predict_dfs = {}
         for pair in self.states["pairs"]["pair"]:
-            predict_df = self.build_realtime_prediction_df(pair)
-            if predict_df is None:
-                logger.info(
-                    f"Not enough realtime data for {pair}.\
-                    Attempting to predict from klines..."
-                )
-                predict_df = self.kline_prediction(pair)
-                if predict_df is None or predict_df.empty:
-                    logger.error(f"Failed to kline-predict for {pair}")
-                    continue
+            predict_dfs[pair] = self.build_realtime_prediction_df(pair)
+        kline_pairs = [pair for pair, df in predict_dfs.items() if df is None]
+        if len(kline_pairs) != 0:
+            logger.info(
+                f"Not enough realtime data for {kline_pairs}.\
+                Attempting to predict from klines..."
+            )
+            predict_dfs.update(self.kline_predictions(kline_pairs))
+        for pair in self.states["pairs"]["pair"]:
+            predict_df = predict_dfs[pair]
+            if predict_df is None or predict_df.empty:
+                logger.error(f"Failed to kline-predict for {pair}")
+                continue
             logging.info(f"Performing prediction for pair {pair}")
             results = self.predictor.predict(
                 df_test=predict_df,
@@ -1,16 +1,20 @@
 from binance_client.client import BinanceClient
+from binance_client.kline_cache import KlineCache
+from binance_client.ring import TradeRing
+import numpy as np
 import pandas as pd
 import threading
 import time
 import schedule
 import logging
-from math import floor
 
 from predictions import PredictionsManager
 from wallet import WalletManager
 from streams import StreamsManager
 from reports import ReportManager
 
+KEYS_FILE = "/home/lavin/.binance/keys.json"
+
 pd.set_option("display.float_format", "{:.10f}".format)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -25,9 +29,19 @@ logger.addHandler(ch)
 
 
 class Pythia(threading.Thread):
-    def __init__(self):
+    # With a stream_factory, e.g. to replay recorded trades, or a
+    # record_directory to record the trades received, see StreamsManager.
+    # binance replaces the BinanceClient, e.g. a ReplayBinanceClient on the
+    # clock of the replay to run offline, and its asynchronous() the async
+    # client of the streams manager.
+    def __init__(self, stream_factory=None, record_directory=None, binance=None):
         threading.Thread.__init__(self)
-        self.binance = BinanceClient("/home/lavin/.binance/keys.json")
+        async_binance = None
+        if binance is None:
+            binance = BinanceClient(KEYS_FILE)
+        else:
+            async_binance = binance.asynchronous()
+        self.binance = binance
         self._ops_frequency = 60
         self._ops_time_unit = "T"
         self._future_periods = 1
@@ -44,7 +58,8 @@ class Pythia(threading.Thread):
         self._prediction_errors_df = pd.DataFrame(columns=["rmse", "mae"])
         self._pairs_df = pd.DataFrame(columns=["pair", "growth"])
         self._trade_rules = {}
-        self._messages = []
+        self._messages = TradeRing()  # written by the streams thread only
+        self._klines = KlineCache()
         self._max_pair_prices_vols = {}
         self._balances = {}
         self.states = {
@@ -53,6 +68,7 @@ class Pythia(threading.Thread):
             "pred_errors": self._prediction_errors_df,
             "pairs": self._pairs_df,
             "messages": self._messages,
+            "klines": self._klines,
             "max_prices_vols": self._max_pair_prices_vols,
             "balances": self._balances,
             "trade_rules": self._trade_rules,
@@ -66,7 +82,15 @@ class Pythia(threading.Thread):
             states=self.states,
         )
         self.wallet_manager = WalletManager(client=self.binance, states=self.states)
-        self.streams_manager = StreamsManager(binance=self.binance, states=self.states)
+        self.streams_manager = StreamsManager(
+            binance=self.binance,
+            keys_file=KEYS_FILE,
+            states=self.states,
+            async_binance=async_binance,
+            stream_factory=stream_factory,
+            record_directory=record_directory,
+            kline_interval=self.predictions_manager.kline_interval(),
+        )
         self.report_manager = ReportManager(states=self.states)
         logger.info("Start-up complete.")
 
@@ -77,7 +101,6 @@ class Pythia(threading.Thread):
             drop=True
         )
         self.states["pred_errors"] = self.states["pred_errors"].dropna()
-        self.states["messages"] = self.states["messages"][-2000:]
 
     def _get_old_periods(self):
         return self._ops_frequency * 4
@@ -93,6 +116,7 @@ class Pythia(threading.Thread):
         schedule.every(1).minutes.do(self.crunch_messages)
         schedule.every(self._ops_frequency).minutes.do(self.execution_cycle)
         schedule.every(10).minutes.do(self.streams_manager.refresh)
+        schedule.every(1).minutes.do(self.streams_manager.fill_kline_gaps)
         schedule.every(self._get_old_periods()).minutes.do(self._drop_old_entries)
         while not self._should_terminate:
             schedule.run_pending()
@@ -109,21 +133,20 @@ class Pythia(threading.Thread):
         self.report_manager.report()
 
     def crunch_messages(self):
-        buffer_df = pd.DataFrame(columns=["ts", "price", "vol", "pair"])
-        crunch = self.states["messages"][:]
+        messages = self.states["messages"]
+        crunch = messages.drain()
         logger.info(f"Crunching {len(crunch)} messages.")
-        for i, m in enumerate(crunch):
-            try:
-                ts = float(floor(m["E"] / 1000))
-                price = float(m["p"])
-                vol = float(m["q"])
-                pair = m["s"]
-                buffer_df.loc[i] = [ts, price, vol, pair]
-            except KeyError as e:
-                logger.error(f"Key error for message {m}")
-        self.states["messages"] = [
-            m for m in self.states["messages"] if m not in crunch
-        ]
+        if messages.overflows > 0:
+            logger.warning(f"{messages.overflows} trades dropped so far, buffer full")
+        pairs = np.array(messages.symbols(), dtype=object)
+        buffer_df = pd.DataFrame(
+            {
+                "ts": np.floor(crunch["time"] / 1000),
+                "price": crunch["price"],
+                "vol": crunch["quantity"],
+                "pair": pairs[crunch["symbol"]],
+            }
+        )
         for pair in buffer_df.pair.unique():
             pair_df = buffer_df[buffer_df["pair"] == pair].drop(columns="pair")
             pair_df["datetime"] = pd.to_datetime(pair_df["ts"], unit="s")
@@ -3,78 +3,219 @@ from math import floor
 import logging
 import binance_client.constants as cts
 from datetime import datetime as dtt
-from binance_client.stream import BinanceStreamClient
-import json
-from typing import List
+from binance_client.events import Kline
+from binance_client.supervisor import StreamSupervisor
+from binance_client.async_client import AsyncBinanceClient
+from binance_client.klines import parse_klines
+import asyncio
+from typing import Callable, List, Optional
 
 MAX_TICKERS_TO_TRACK = 15
 WORKING_QUOTE_ASSET = "BTC"
 
+# Trades are passed in batches, handled once per batch instead of per trade
+TRADES_BATCH_SIZE = 500
+TRADES_BATCH_INTERVAL = 0.25  # seconds
+# Klines looked up for a pair when its kline stream is subscribed, the newer
+# ones come from the stream
+KLINES_SEEDED = 50
+KLINES_FILLED = 1000  # per gap, the maximum allowed by the API
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
 class StreamsManager:
-    def __init__(self, binance, states: dict):
+    # stream_factory(streams, on_message) replaces the supervisor if given,
+    # e.g. a ReplayStreamClient passing batches of records to run offline.
+    # The klines then come from the streams only, the REST API has the
+    # current klines, not the ones of the replay, unless an async_binance is
+    # given too, e.g. the AsyncReplayBinanceClient of the replay.
+    #
+    # async_binance makes the async requests, an AsyncBinanceClient sharing
+    # the limits of binance is created from keys_file without it.
+    #
+    # With a kline_interval, the klines of the pairs are streamed too and kept
+    # in states["klines"], a KlineCache.
+    #
+    # With a record_directory, the trades received are recorded there to see
+    # later what the bot saw, see StreamSupervisor.
+    def __init__(
+        self,
+        binance,
+        keys_file: str,
+        states: dict,
+        stream_factory: Optional[Callable] = None,
+        kline_interval: Optional[str] = None,
+        record_directory: Optional[str] = None,
+        async_binance=None,
+    ):
         self.binance = binance
+        self._keys_file = keys_file
         self.states = states
+        self._stream_factory = stream_factory
+        self._kline_interval = kline_interval
+        self._record_directory = record_directory
+        self._kline_pairs = set()
         self.streams = []
         self.trades_stream = None
+        self._loop = asyncio.new_event_loop()
+        self._async_binance = async_binance
+        self._rest_klines = stream_factory is None or async_binance is not None
 
-    def _handle_trade_message(self, msg):
-        m = json.loads(msg)
-        if "result" in m.keys():
-            return
-        if "stream" in m.keys() and "data" in m.keys():
-            self.states["messages"].append(m["data"])
-            return
-        self.states["messages"].append(m)
+    def _handle_trade_message(self, records: list):
+        trades = []
+        for record in records:
+            if isinstance(record, Kline):
+                self.states["klines"].update(record)
+            else:
+                trades.append(record)
+        self.states["messages"].push_many(trades)
 
     def create_streams(self):
+        # The connection is kept across refreshes, only the streams of the
+        # pairs that changed are subscribed or unsubscribed
         self.streams = []
         # logger.info(f"Pairs in Streams: {self.states["pairs"]}")
         for pair in self.states["pairs"]["pair"]:
             self.streams.append(f"{pair.lower()}@trade")
-        self.trades_stream = BinanceStreamClient(
-            streams=self.streams, on_message=self._handle_trade_message
+        if self._kline_interval is not None:
+            self._update_kline_pairs(list(self.states["pairs"]["pair"]))
+        if self.trades_stream is not None and self.trades_stream.is_alive():
+            self.trades_stream.set_streams(self.streams)
+            return
+        if self._stream_factory is not None:
+            self.trades_stream = self._stream_factory(
+                self.streams, self._handle_trade_message
+            )
+            self.trades_stream.start()
+            return
+        self.trades_stream = StreamSupervisor(
+            streams=self.streams,
+            on_message=self._handle_trade_message,
+            market_data=self.binance.market_data,
+            batch_size=TRADES_BATCH_SIZE,
+            batch_interval=TRADES_BATCH_INTERVAL,
+            record_directory=self._record_directory,
         )
         self.trades_stream.start()
 
+    def _update_kline_pairs(self, pairs: List[str]):
+        for pair in pairs:
+            self.streams.append(f"{pair.lower()}@kline_{self._kline_interval}")
+        for pair in self._kline_pairs - set(pairs):
+            self.states["klines"].discard(pair)
+        added = [pair for pair in pairs if pair not in self._kline_pairs]
+        self._kline_pairs = set(pairs)
+        if len(added) == 0 or not self._rest_klines:
+            return
+        # Once per pair, the predictions read the klines from the cache only
+        now_ms = floor(dtt.now().timestamp() * 1000)
+        for pair, r in zip(added, self._fetch_recent_klines(added)):
+            if r["http_code"] == 200:
+                self.states["klines"].seed(
+                    pair, self._kline_interval, r["content"], now_ms
+                )
+            else:
+                logger.error(f"Could not look up recent klines of {pair}")
+
+    def fill_kline_gaps(self):
+        # Looks up the klines whose close was missed by the stream, e.g. while
+        # reconnecting, see KlineCache.gaps
+        gaps = self.states["klines"].gaps()
+        if len(gaps) == 0 or not self._rest_klines:
+            return
+        market_data = self._async_market_data()
+        results = self._gather(
+            [
+                market_data.kline_candlestick_data(
+                    symbol=pair,
+                    interval=interval,
+                    start_time=first,
+                    end_time=last,
+                    limit=KLINES_FILLED,
+                    as_array=True,
+                )
+                for pair, interval, first, last in gaps
+            ]
+        )
+        now_ms = floor(dtt.now().timestamp() * 1000)
+        for (pair, interval, first, last), r in zip(gaps, results):
+            if r["http_code"] == 200:
+                logger.info(f"Filling {pair} klines missed from {first} to {last}")
+                self.states["klines"].fill(pair, interval, r["content"], now_ms)
+            else:
+                logger.error(f"Could not look up the klines missed of {pair}")
+
+    def _fetch_recent_klines(self, pairs: List[str]) -> List[dict]:
+        market_data = self._async_market_data()
+        return self._gather(
+            [
+                market_data.kline_candlestick_data(
+                    symbol=pair,
+                    interval=self._kline_interval,
+                    start_time=None,
+                    end_time=None,
+                    limit=KLINES_SEEDED,
+                    as_array=True,
+                )
+                for pair in pairs
+            ]
+        )
+
+    def _gather(self, requests: list) -> List[dict]:
+        # Gathered within the loop, asyncio.gather would take the default loop
+        # outside of it
+        async def gather():
+            return await asyncio.gather(*requests)
+
+        return self._loop.run_until_complete(gather())
+
+    def _async_market_data(self):
+        # A single async client for the lifetime of the manager, run on a loop
+        # of its own. It shares the rate limits, hosts and server clock of
+        # self.binance, so the requests of both count against the same limits.
+        if self._async_binance is None:
+            self._async_binance = AsyncBinanceClient(
+                self._keys_file, shared=self.binance.transport()
+            )
+        return self._async_binance.market_data
+
     def refresh(self):
         self.acquire_targets()
-        self._unsub_old_streams()
         self.create_streams()
 
-    def _unsub_old_streams(self):
-        if self.trades_stream is None:
-            return
-        self.trades_stream.stop()
-
     def stop(self):
         self.trades_stream.stop()  # i.e. stop
+        if self._async_binance is not None:
+            self._loop.run_until_complete(self._async_binance.close())
+        self._loop.close()
+
+    def _fetch_monthly_klines(self, targets: List[str]) -> List[dict]:
+        market_data = self._async_market_data()
+        return self._gather(
+            [
+                market_data.kline_candlestick_data(
+                    symbol=pair,
+                    interval=cts.KLINE_INTERVAL_MONTHS_1,
+                    start_time=floor(dtt.timestamp(dtt(2010, 1, 1))) * 1000,
+                    end_time=floor(dtt.timestamp(dtt.now())) * 1000,
+                    limit=500,
+                    as_array=True,
+                )
+                for pair in targets
+            ]
+        )
 
     def get_max_pair_prices(self, targets: List[str]) -> List[str]:
         logger.info(f"Fetching max prices and volumes for {targets}")
         ignore = []
-        for pair in targets:
+        for pair, r in zip(targets, self._fetch_monthly_klines(targets)):
             self.states["max_prices_vols"][pair] = {}
-            max_price = 0
-            max_vol = 0
-            earliest_data = 2000000000
-            data = self.binance.market_data.kline_candlestick_data(
-                symbol=pair,
-                interval=cts.KLINE_INTERVAL_MONTHS_1,
-                start_time=floor(dtt.timestamp(dtt(2010, 1, 1))) * 1000,
-                end_time=floor(dtt.timestamp(dtt.now())) * 1000,
-                limit=500,
-            )["content"]
-            for kline in data:
-                if floor(kline[0] / 1000) < earliest_data:
-                    earliest_data = floor(kline[0] / 1000)
-                if float(kline[2]) > max_price:
-                    max_price = float(kline[2])
-                if float(kline[5]) > max_vol:
-                    max_vol = float(kline[5])
+            klines = r["content"] if r["http_code"] == 200 else parse_klines([])
+            max_price = float(klines["high"].max(initial=0))
+            max_vol = float(klines["volume"].max(initial=0))
+            earliest_data = floor(klines["open_time"].min(initial=2000000000000) / 1000)
             pair_age_hours = (dtt.now().timestamp() - earliest_data) / 3600
             if pair_age_hours < 24:
                 logger.info(f"Pair {pair} is younger than 24 hours. Ignoring...")
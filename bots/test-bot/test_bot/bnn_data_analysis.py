@@ -24,7 +24,7 @@ df["spread"] = df["high"] - df["low"]
 df["avg_price"] = (df["open"] + df["close"] + df["low"] + df["high"]) / 4
 
 reg = SGDPredictor(
-    batch_size_mins=15 * 484, train_data_path="./bnndata/", ops_time_unit="T"
+    batch_size_mins=15 * 484, train_data_path="./bnnstore/", ops_time_unit="T"
 )
 
 res = reg.predict(
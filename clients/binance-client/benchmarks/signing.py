@@ -0,0 +1,57 @@
+# Compares the old signing path, which prepared a throwaway request to encode
+# the params and keyed a new HMAC on every call, with the Signer.
+# Run with: python -m benchmarks.signing
+import timeit
+from requests import Request
+from binance_client.signatures import Signer, sign
+
+SECRET_KEY = "NhqPtmdSJYdKjVHjA7PZj4Mge3R5YNiP1e3UZjInClVN65XAbvqqM6A7H5fATj0j"
+URL = "https://api.binance.com/api/v3/order"
+NUMBER = 20000
+
+
+def order_params() -> dict:
+    return {
+        "symbol": "LTCBTC",
+        "side": "BUY",
+        "type": "LIMIT",
+        "timeInForce": "GTC",
+        "quantity": "1.00000000",
+        "price": 0.1,
+        "recvWindow": 5000,
+        "timestamp": 1499827319559,
+    }
+
+
+def old_sign() -> dict:
+    params = order_params()
+    prep = Request("", "http://ayy.lmao.com", data=params).prepare()
+    params["signature"] = sign(SECRET_KEY, prep.body)
+    return params
+
+
+def old_path():
+    Request("POST", URL, params=old_sign()).prepare()
+
+
+signer = Signer(SECRET_KEY)
+
+
+def new_sign() -> str:
+    return signer.signed_query(order_params())
+
+
+def new_path():
+    Request("POST", f"{URL}?{new_sign()}").prepare()
+
+
+def report(name: str, old, new):
+    old_us = min(timeit.repeat(old, number=NUMBER, repeat=5)) / NUMBER * 1e6
+    new_us = min(timeit.repeat(new, number=NUMBER, repeat=5)) / NUMBER * 1e6
+    print(f"{name}: {old_us:.1f}us -> {new_us:.1f}us ({old_us / new_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    assert old_sign()["signature"] == new_sign().rsplit("=", 1)[1]
+    report("signing", old_sign, new_sign)
+    report("signing and preparing", old_path, new_path)
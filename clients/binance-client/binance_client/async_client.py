@@ -0,0 +1,192 @@
+import aiohttp
+import asyncio
+import logging
+import orjson
+import time
+import yarl
+from requests import Request
+from typing import Callable, Optional
+from .retry import retry_policy
+from .transport import Transport
+from .clock import CLOCK_SAMPLES
+from .endpoints import endpoints_config
+from .cache import DEFAULT_CACHE_DIR, ResponseCache
+from .client import (
+    BaseClient,
+    BinanceClient,
+    MarketDataClient,
+    SpotAccountTradeClient,
+    UserDataClient,
+    WalletClient,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_POOL_SIZE = 100
+
+
+class AsyncTransport(Transport):
+    # The aiohttp session is created lazily because it has to be bound to
+    # the running event loop
+    def _create_session(self) -> Optional[aiohttp.ClientSession]:
+        return None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+class AsyncBaseClient(BaseClient):
+    async def _forge_request_and_send(
+        self, endpoint: str, params: dict, parser: Optional[Callable] = None
+    ) -> dict:
+        key = self._cache_key(endpoint, params)
+        cached = self._transport.cache.get(key) if key is not None else None
+        if cached is not None:
+            return self._parse_result(cached, parser)
+        if self._needs_clock_sync(endpoint):
+            await self.sync_server_clock()
+        r = self._forge_request(endpoint, params)
+        if r is None:
+            return self._request_result(69, {})  # dummy http code
+        result = await self._send(r, self.endpoints_config[endpoint])
+        self._check_timestamp_rejection(result)
+        self._cache_result(key, endpoint, result)
+        return self._parse_result(result, parser)
+
+    async def sync_server_clock(self, samples: int = CLOCK_SAMPLES):
+        cfg = endpoints_config["market_data"]["check_server_time"]
+        measures = []
+        for _ in range(samples):
+            sent = time.time()
+            res = await self._send(Request(method=cfg["method"], url=cfg["path"]), cfg)
+            received = time.time()
+            if res["http_code"] == 200 and "serverTime" in res["content"]:
+                measures.append((sent, res["content"]["serverTime"] / 1000, received))
+        self._transport.server_clock.update(measures)
+
+    async def _send(self, req: Request, endpoint_config: dict) -> dict:
+        policy = retry_policy(endpoint_config)
+        deadline = time.monotonic() + policy.deadline
+        result = self._request_result(0, {})  # no response received
+        attempt = 0
+        while True:
+            attempt += 1
+            reserved = self._reserve(endpoint_config, deadline)
+            if reserved is None:
+                logger.error(f"Giving up on {req.url} after {attempt - 1} attempts")
+                return result
+            host, delay = reserved
+            if delay > 0:
+                await asyncio.sleep(delay)
+            logger.info(f"Reaching {host}{req.url}")
+            prep = self._prepare(req, host, endpoint_config)
+            start = time.monotonic()
+            try:
+                # Encoded already, quoting it again would change the signed query
+                async with self._transport.get_session().request(
+                    prep.method,
+                    yarl.URL(prep.url, encoded=True),
+                    headers=prep.headers,
+                    data=prep.body,
+                    timeout=aiohttp.ClientTimeout(total=policy.timeout(deadline)),
+                ) as response:
+                    code = response.status
+                    headers = response.headers
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Error when reaching {host} - {e}")
+                self._transport.endpoint_pool.report_failure(host)
+                sent = not isinstance(e, aiohttp.ClientConnectorError)
+                retry_delay = policy.next_delay(attempt, sent=sent)
+            else:
+                self._report_host_health(host, code, time.monotonic() - start)
+                self._track_rate_limits(code, headers)
+                try:
+                    result = self._request_result(code, orjson.loads(body))
+                except ValueError as e:
+                    logger.error(f"Error when decoding json - {e}")
+                    result = self._request_result(code, {})
+                retry_delay = policy.next_delay(attempt, code=code)
+            if retry_delay is None:
+                return result
+            await asyncio.sleep(min(retry_delay, max(deadline - time.monotonic(), 0)))
+
+
+class AsyncWalletClient(AsyncBaseClient, WalletClient):
+    pass
+
+
+class AsyncMarketDataClient(AsyncBaseClient, MarketDataClient):
+    pass
+
+
+class AsyncSpotAccountTradeClient(AsyncBaseClient, SpotAccountTradeClient):
+    pass
+
+
+class AsyncUserDataClient(AsyncBaseClient, UserDataClient):
+    pass
+
+
+class AsyncBinanceClient(BinanceClient):
+    def __init__(
+        self,
+        keys_file: str,
+        test_net: bool = False,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        shared: Optional[Transport] = None,
+    ):
+        # With a shared transport, e.g. BinanceClient.transport(), its rate
+        # limits, hosts, cache and server clock are used instead of new ones,
+        # only the connections are of this client
+        logger.info("Initializing async Binance Client...")
+        if shared is None:
+            self._transport = AsyncTransport(
+                keys_file, test_net, pool_size=pool_size, cache=ResponseCache(cache_dir)
+            )
+        else:
+            self._transport = AsyncTransport(
+                keys_file,
+                test_net,
+                pool_size=pool_size,
+                rate_limiter=shared.rate_limiter,
+                endpoint_pool=shared.endpoint_pool,
+                cache=shared.cache,
+                server_clock=shared.server_clock,
+            )
+        self.wallet = AsyncWalletClient(self._transport)
+        self.market_data = AsyncMarketDataClient(self._transport)
+        self.spot_account_trade = AsyncSpotAccountTradeClient(self._transport)
+        self.user_data = AsyncUserDataClient(self._transport)
+
+    async def __aenter__(self) -> "AsyncBinanceClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        await self.update_rate_limits()
+        logger.info("Client is ready to go!")
+
+    async def close(self):
+        logger.info("Closing async Binance Client...")
+        await self._transport.close()
+
+    async def update_rate_limits(self):
+        res = await self.market_data.exchange_information()
+        if res["http_code"] != 200:
+            logger.error(f"Could not update the rate limits: HTTP {res['http_code']}")
+            return
+        self._transport.rate_limiter.set_limits(res["content"]["rateLimits"])
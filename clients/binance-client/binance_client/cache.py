@@ -0,0 +1,95 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "binance_client")
+
+
+def cache_key(namespace: str, endpoint: str, params: dict) -> str:
+    params = {k: v for k, v in params.items() if v is not None}
+    return f"{namespace}/{endpoint}?{urlencode(sorted(params.items()))}"
+
+
+class ResponseCache:
+    # Keeps successful responses of the endpoints that have a "cache_ttl" for
+    # that many seconds. Entries live in memory and, when a cache_dir is given,
+    # on disk as well, so that a restarted process does not fetch them again.
+    # Entries are copies of the results put and got, so callers can change
+    # their results without changing the entries.
+    def __init__(
+        self, cache_dir: Optional[str] = None, clock: Callable[[], float] = time.time
+    ):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._cache_dir = cache_dir
+        self._entries: Dict[str, Tuple[float, dict]] = {}  # key -> (expiry, result)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[dict]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._read(key)
+                if entry is not None:
+                    self._entries[key] = entry
+            if entry is None or entry[0] <= now:
+                return None
+        logger.debug(f"Cache hit for {key}")
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, result: dict, ttl: float):
+        entry = (self._clock() + ttl, copy.deepcopy(result))
+        with self._lock:
+            self._entries[key] = entry
+            self._write(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            if self._cache_dir is None:
+                return
+            for name in os.listdir(self._cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self._cache_dir, name))
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self._cache_dir, f"{name}.json")
+
+    def _read(self, key: str) -> Optional[Tuple[float, dict]]:
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error when reading cached {key} - {e}")
+            return None
+        if stored.get("key") != key:  # hash collision
+            return None
+        return stored["expiry"], stored["result"]
+
+    def _write(self, key: str, entry: Tuple[float, dict]):
+        if self._cache_dir is None:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"key": key, "expiry": entry[0], "result": entry[1]}, f)
+            os.replace(tmp, path)  # readers never see a partial file
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error when caching {key} - {e}")
@@ -1,12 +1,16 @@
-from requests import Request, Session, Response  # noqa: F401
-import json
+from requests import PreparedRequest, Request, Session, Response  # noqa: F401
+from requests.exceptions import ConnectTimeout, RequestException
+from urllib3.exceptions import NewConnectionError
 from . import constants
-from datetime import datetime as dtt
-import math
-from .signatures import sign
 from .endpoints import endpoints_config
+from .retry import retry_policy
+from .cache import DEFAULT_CACHE_DIR, ResponseCache, cache_key
+from .transport import DEFAULT_POOL_SIZE, Transport
+from .clock import CLOCK_SAMPLES
+from .klines import parse_klines
 import logging
-from typing import Optional, List
+import orjson
+from typing import Callable, Dict, Optional, List, Tuple
 import time
 
 logger = logging.getLogger(__name__)
@@ -14,58 +18,120 @@ logger.setLevel(logging.DEBUG)
 
 
 class BaseClient:
-    def __init__(
-        self, keys_file: str, client_name: str, weight_manager, test_net: bool = False
-    ):
+    def __init__(self, transport: Transport, client_name: str):
         self.endpoints_config = endpoints_config[client_name]
-        with open(keys_file) as f:
-            keys = json.load(f)
-            accessor = "REAL" if not test_net else "TEST"
-            self._api_key = keys[accessor]["API_KEY"]
-            self._secret_key = keys[accessor]["SECRET_KEY"]
-        self._session = Session()
-        self._test_net = test_net
-        self._base_url = (
-            constants.BASE_ENDPOINT if not test_net else constants.BASE_TEST_ENDPOINT
-        )
-        self._weight_manager = weight_manager
-
-    def _forge_request_and_send(self, endpoint: str, params: dict) -> Request:
+        self._transport = transport
+
+    def _forge_request(self, endpoint: str, params: dict) -> Optional[Request]:
         cfg = self.endpoints_config[endpoint]
-        url = self._forge_url(cfg)
-        if url is None:  # nonexistant endpoint in the test api
-            return self._request_result(69, {})  # dummy http code
+        path = self._forge_path(cfg)
+        if path is None:  # nonexistant endpoint in the test api
+            return None
         method = cfg["method"]
-        security_headers, params = self._check_security(cfg, params)
-        r = Request(method=method, url=url, params=params, headers=security_headers)
-        return self._send(r)
+        security_headers = self._security_headers(cfg)
+        # The host is only chosen when sending, so that retries can fail over,
+        # and signed params are only stamped and signed then, see _prepare
+        return Request(method=method, url=path, params=params, headers=security_headers)
+
+    def _forge_request_and_send(
+        self, endpoint: str, params: dict, parser: Optional[Callable] = None
+    ) -> dict:
+        key = self._cache_key(endpoint, params)
+        cached = self._transport.cache.get(key) if key is not None else None
+        if cached is not None:
+            return self._parse_result(cached, parser)
+        if self._needs_clock_sync(endpoint):
+            self.sync_server_clock()
+        r = self._forge_request(endpoint, params)
+        if r is None:
+            return self._request_result(69, {})  # dummy http code
+        result = self._send(r, self.endpoints_config[endpoint])
+        self._check_timestamp_rejection(result)
+        self._cache_result(key, endpoint, result)
+        return self._parse_result(result, parser)
+
+    def sync_server_clock(self, samples: int = CLOCK_SAMPLES):
+        cfg = endpoints_config["market_data"]["check_server_time"]
+        measures = []
+        for _ in range(samples):
+            sent = time.time()
+            res = self._send(Request(method=cfg["method"], url=cfg["path"]), cfg)
+            received = time.time()
+            if res["http_code"] == 200 and "serverTime" in res["content"]:
+                measures.append((sent, res["content"]["serverTime"] / 1000, received))
+        self._transport.server_clock.update(measures)
+
+    def _needs_clock_sync(self, endpoint: str) -> bool:
+        security = self.endpoints_config[endpoint].get("security")
+        return (
+            security is not None
+            and security["requires_signature"]
+            and self._transport.server_clock.needs_sync()
+        )
+
+    def _check_timestamp_rejection(self, result: dict):
+        content = result["content"]
+        if (
+            isinstance(content, dict)
+            and content.get("code") == constants.ERROR_CODE_INVALID_TIMESTAMP
+        ):
+            logger.warning("Timestamp outside of the recvWindow, resyncing the clock")
+            self._transport.server_clock.invalidate()
+
+    # Only unsigned endpoints with a "cache_ttl" are cached, signed requests
+    # carry a timestamp and private data
+    def _cache_key(self, endpoint: str, params: dict) -> Optional[str]:
+        cfg = self.endpoints_config[endpoint]
+        if cfg.get("cache_ttl") is None or cfg["security"]["requires_signature"]:
+            return None
+        return cache_key(
+            "test" if self._transport.test_net else "real", endpoint, params
+        )
+
+    def _cache_result(self, key: Optional[str], endpoint: str, result: dict):
+        if key is not None and result["http_code"] == 200:
+            self._transport.cache.put(
+                key, result, self.endpoints_config[endpoint]["cache_ttl"]
+            )
 
-    def _check_security(self, endpoint_config: dict, params: dict) -> dict:
+    def _security_headers(self, endpoint_config: dict) -> dict:
         security_headers = {}
-        security = endpoint_config["security"]
-        if security["requires_api_key"]:
-            security_headers["X-MBX-APIKEY"] = self._api_key
-        if security["requires_signature"]:
-            params = self._add_signature(params)
-        return security_headers, params
-
-    def _add_signature(self, total_params: dict) -> dict:
-        r = Request("", "http://ayy.lmao.com", data=total_params)
-        prep = r.prepare()
-        signature = sign(self._secret_key, prep.body)
-        total_params["signature"] = signature
-        return total_params
+        if endpoint_config["security"]["requires_api_key"]:
+            security_headers["X-MBX-APIKEY"] = self._transport.api_key
+        return security_headers
 
     def _timestamp(self) -> int:
-        return int(math.floor(dtt.now().timestamp() * 1000))
+        return self._transport.server_clock.now_ms()
 
-    def _forge_url(self, endpoint_config: dict) -> str:
+    def _forge_path(self, endpoint_config: dict) -> Optional[str]:
         path = endpoint_config["path"]
-        if self._test_net:
+        if self._transport.test_net:
             path = path.replace("v1", "v3")
             if "wapi" in path or "sapi" in path:
                 return None  # endpoints with wapi and sapi do not exist in the test api
-        return self._base_url + path
+        return path
+
+    def _prepare(
+        self, req: Request, host: str, endpoint_config: dict
+    ) -> PreparedRequest:
+        # Called for every attempt, after waiting for it: signed requests get
+        # a fresh timestamp so that delays and retries do not make them fall
+        # out of their recvWindow. The signed query string is sent as is.
+        security = endpoint_config.get("security")
+        if security is not None and security["requires_signature"]:
+            params = req.params
+            if "timestamp" in params:
+                params = dict(params, timestamp=self._timestamp())
+            query = self._transport.signer.signed_query(params)
+            return Request(
+                method=req.method, url=f"{host}{req.url}?{query}", headers=req.headers
+            ).prepare()
+        return Request(
+            method=req.method,
+            url=host + req.url,
+            params=req.params,
+            headers=req.headers,
+        ).prepare()
 
     def _resolve_optional_arguments(self, params: dict, **kwargs) -> dict:
         for arg, val in kwargs.items():
@@ -75,52 +141,98 @@ class BaseClient:
                 params[arg] = val
         return params
 
-    def _send(self, req: Request) -> dict:
-        logger.info(f"Reaching {req.url}")
-        try:
-            response = self._session.send(req.prepare())
-        except Exception as e:
-            time.sleep(2)
-            return self._send(req)
-        if self._parse_weight_response(response):
-            return self._send(req)
-        try:
-            result = self._request_result(response.status_code, response.json())
-        except ValueError as e:
-            logger.error(f"Error when decoding json - {e}")
-            result = self._request_result(response.status_code, {})
-        return result
+    def _send(self, req: Request, endpoint_config: dict) -> dict:
+        policy = retry_policy(endpoint_config)
+        deadline = time.monotonic() + policy.deadline
+        result = self._request_result(0, {})  # no response received
+        attempt = 0
+        while True:
+            attempt += 1
+            reserved = self._reserve(endpoint_config, deadline)
+            if reserved is None:
+                logger.error(f"Giving up on {req.url} after {attempt - 1} attempts")
+                return result
+            host, delay = reserved
+            if delay > 0:
+                time.sleep(delay)
+            logger.info(f"Reaching {host}{req.url}")
+            start = time.monotonic()
+            try:
+                response = self._transport.session.send(
+                    self._prepare(req, host, endpoint_config),
+                    timeout=policy.timeout(deadline),
+                )
+            except RequestException as e:
+                logger.error(f"Error when reaching {host} - {e}")
+                self._transport.endpoint_pool.report_failure(host)
+                retry_delay = policy.next_delay(attempt, sent=_reached_server(e))
+            else:
+                code = response.status_code
+                self._report_host_health(host, code, time.monotonic() - start)
+                self._track_rate_limits(code, response.headers)
+                try:
+                    result = self._request_result(code, orjson.loads(response.content))
+                except ValueError as e:
+                    logger.error(f"Error when decoding json - {e}")
+                    result = self._request_result(code, {})
+                retry_delay = policy.next_delay(attempt, code=code)
+            if retry_delay is None:
+                return result
+            time.sleep(min(retry_delay, max(deadline - time.monotonic(), 0)))
+
+    # Returns the host to send the next attempt to and the seconds to wait for it,
+    # or None when the attempt could not be sent before the deadline, in which
+    # case nothing is reserved
+    def _reserve(
+        self, endpoint_config: dict, deadline: float
+    ) -> Optional[Tuple[str, float]]:
+        host, wait = self._transport.endpoint_pool.pick()
+        max_delay = deadline - time.monotonic()
+        if wait > max_delay:
+            return None
+        delay = self._transport.rate_limiter.reserve(
+            weight=endpoint_config["weight"],
+            orders=endpoint_config.get("orders", 0),
+            max_delay=max_delay,
+        )
+        if delay is None:
+            return None
+        return host, max(delay, wait)
+
+    def _report_host_health(self, host: str, code: int, latency: float):
+        if code >= 500:
+            self._transport.endpoint_pool.report_failure(host)
+        else:
+            self._transport.endpoint_pool.report_success(host, latency)
+
+    def _parse_result(self, result: dict, parser: Optional[Callable]) -> dict:
+        if parser is None or result["http_code"] != 200:
+            return result
+        return self._request_result(result["http_code"], parser(result["content"]))
 
     def _request_result(self, http_code, content):
         return {"http_code": http_code, "content": content}
 
-    def _parse_weight_response(self, response):
-        code = response.status_code
+    def _track_rate_limits(self, code: int, headers):
         if code == 429 or code == 418:
             logger.info(f"HTTP {code} received: {constants.HTTP_RESPONSE_CODES[code]}")
-            sleep_time = int(response.headers["Retry-After"])
-            time.sleep(sleep_time)
-            return True
-        # TODO: implement weight management
-        else:
-            weight = 0
-            for h in response.headers:
-                if "used-weight-" in h:
-                    weight = int(response.headers[h])
-                    break
-            else:
-                return
-            self._weight_manager(method="update", weight=weight)
+            self._transport.rate_limiter.pause(int(headers["Retry-After"]))
+            return
+        self._transport.rate_limiter.update(headers)
+
+
+# Whether the request may have been processed, connection failures happen
+# before anything is sent
+def _reached_server(error: RequestException) -> bool:
+    if isinstance(error, ConnectTimeout):
+        return False
+    reason = getattr(error.args[0], "reason", None) if len(error.args) else None
+    return not isinstance(reason, NewConnectionError)
 
 
 class WalletClient(BaseClient):
-    def __init__(self, keys_file: str, weight_manager, test_net: bool = False):
-        super().__init__(
-            keys_file=keys_file,
-            client_name="wallet",
-            weight_manager=weight_manager,
-            test_net=test_net,
-        )
+    def __init__(self, transport: Transport):
+        super().__init__(transport=transport, client_name="wallet")
 
     def system_status(self) -> dict:
         return self._forge_request_and_send("system_status", {})
@@ -366,13 +478,8 @@ class WalletClient(BaseClient):
 
 
 class MarketDataClient(BaseClient):
-    def __init__(self, keys_file: str, weight_manager, test_net: bool = False):
-        super().__init__(
-            keys_file=keys_file,
-            client_name="market_data",
-            weight_manager=weight_manager,
-            test_net=test_net,
-        )
+    def __init__(self, transport: Transport):
+        super().__init__(transport=transport, client_name="market_data")
 
     def test_connectivity(self) -> dict:
         return self._forge_request_and_send("test_connectivity", params={})
@@ -421,12 +528,18 @@ class MarketDataClient(BaseClient):
         start_time: Optional[int],
         end_time: Optional[int],
         limit: Optional[int],
+        as_array: bool = False,
     ) -> dict:
         params = {"symbol": symbol, "interval": interval}
         params = self._resolve_optional_arguments(
             params, limit=limit, startTime=start_time, endTime=end_time
         )
-        return self._forge_request_and_send("kline_candlestick_data", params)
+        # as_array returns the content as a numpy array of KLINE_DTYPE
+        return self._forge_request_and_send(
+            "kline_candlestick_data",
+            params,
+            parser=parse_klines if as_array else None,
+        )
 
     def current_average_price(self, symbol: str) -> dict:
         params = {"symbol": symbol}
@@ -451,13 +564,8 @@ class MarketDataClient(BaseClient):
 
 
 class SpotAccountTradeClient(BaseClient):
-    def __init__(self, keys_file: str, weight_manager, test_net: bool = False):
-        super().__init__(
-            keys_file=keys_file,
-            client_name="spot_account_trade",
-            weight_manager=weight_manager,
-            test_net=test_net,
-        )
+    def __init__(self, transport: Transport):
+        super().__init__(transport=transport, client_name="spot_account_trade")
 
     def test_new_order(
         self,
@@ -721,13 +829,8 @@ class SpotAccountTradeClient(BaseClient):
 
 
 class UserDataClient(BaseClient):
-    def __init__(self, keys_file: str, weight_manager, test_net: bool = False):
-        super().__init__(
-            keys_file=keys_file,
-            client_name="user_data",
-            weight_manager=weight_manager,
-            test_net=test_net,
-        )
+    def __init__(self, transport: Transport):
+        super().__init__(transport=transport, client_name="user_data")
 
     def create_listen_key(self) -> dict:
         return self._forge_request_and_send("create_listen_key", params={})
@@ -742,41 +845,47 @@ class UserDataClient(BaseClient):
 
 
 class BinanceClient(BaseClient):
-    def __init__(self, keys_file: str, test_net: bool = False):
+    def __init__(
+        self,
+        keys_file: str,
+        test_net: bool = False,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ):
         logger.info("Initializing Binance Client...")
-        self.wallet = WalletClient(
-            keys_file=keys_file, weight_manager=self._weight_manager, test_net=test_net
-        )
-        self.market_data = MarketDataClient(
-            keys_file=keys_file, weight_manager=self._weight_manager, test_net=test_net
+        self._transport = Transport(
+            keys_file, test_net, pool_size=pool_size, cache=ResponseCache(cache_dir)
         )
-        self.spot_account_trade = SpotAccountTradeClient(
-            keys_file=keys_file, weight_manager=self._weight_manager, test_net=test_net
-        )
-        self.user_data = UserDataClient(
-            keys_file=keys_file, weight_manager=self._weight_manager, test_net=test_net
-        )
-        self._request_weight_limit = 3000000  # only for initialization
-        self._order_limit = 0  # unused
+        self.wallet = WalletClient(self._transport)
+        self.market_data = MarketDataClient(self._transport)
+        self.spot_account_trade = SpotAccountTradeClient(self._transport)
+        self.user_data = UserDataClient(self._transport)
         self.update_rate_limits()
         logger.info("Client is ready to go!")
 
+    # TODO: make sure you update weight limits at least once every 1000 requests
     def update_rate_limits(self):
         res = self.market_data.exchange_information()
-        for limit in res["content"]["rateLimits"]:
-            if limit["rateLimitType"] == constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT:
-                self._weight_manager(method="set_limit", weight=limit["limit"])
+        if res["http_code"] != 200:
+            logger.error(f"Could not update the rate limits: HTTP {res['http_code']}")
+            return
+        self._transport.rate_limiter.set_limits(res["content"]["rateLimits"])
 
-    # Currently only tracks the "REQUEST_WEIGHT" limit, not "ORDERS" nor "RAW_REQUESTS"
-    # TODO: make sure you update weight limits at least once every 1000 requests
-    def _weight_manager(self, method: str, **kwargs):
-        if method == "set_limit":
-            self._request_weight_limit = kwargs["weight"]
-        if method == "update":
-            self._used_weight = kwargs["weight"]
-        if self._used_weight > self._request_weight_limit * 0.9:
-            logger.warning("Used weight reaching limit. Taking a rest...")
-            time.sleep(30)
-        logger.warning(
-            f"Used weight: {self._used_weight}, limit: {self._request_weight_limit}"
-        )
+    # To share with other clients of this process, e.g. an AsyncBinanceClient,
+    # so that they all respect the same limits
+    def transport(self) -> Transport:
+        return self._transport
+
+    # Remaining usage per (rate limit type, interval in seconds) window
+    def rate_limits_headroom(self) -> Dict[Tuple[str, int], int]:
+        return self._transport.rate_limiter.headroom()
+
+    # Latency and error rate of every REST host
+    def endpoints_health(self) -> Dict[str, dict]:
+        return self._transport.endpoint_pool.stats()
+
+    def clear_cache(self):
+        self._transport.cache.clear()
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,61 @@
+import logging
+import math
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+CLOCK_SAMPLES = 5
+CLOCK_REFRESH_INTERVAL = 600  # seconds between synchronizations
+
+
+class ServerClock:
+    # Estimates the offset between the local and the server clocks, NTP style:
+    # the server is assumed to read its time halfway through the round trip,
+    # and the sample with the shortest round trip is the most precise one
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.time,
+        refresh_interval: float = CLOCK_REFRESH_INTERVAL,
+    ):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._refresh_interval = refresh_interval
+        self._synced_at: Optional[float] = None
+        self.offset = 0.0  # seconds to add to the local clock
+        self.round_trip: Optional[float] = None
+
+    def needs_sync(self) -> bool:
+        with self._lock:
+            return (
+                self._synced_at is None
+                or self._clock() - self._synced_at > self._refresh_interval
+            )
+
+    def update(self, samples: List[Tuple[float, float, float]]):
+        # Each sample is (local time sent, server time, local time received)
+        with self._lock:
+            # Failed synchronizations are not retried before the next refresh
+            self._synced_at = self._clock()
+            if len(samples) == 0:
+                logger.error("Could not synchronize with the server clock")
+                return
+            sent, server_time, received = min(samples, key=lambda s: s[2] - s[0])
+            self.offset = server_time - (sent + received) / 2
+            self.round_trip = received - sent
+        logger.info(
+            f"Server clock offset: {self.offset * 1000:.1f}ms, "
+            f"round trip: {self.round_trip * 1000:.1f}ms"
+        )
+
+    def invalidate(self):
+        with self._lock:
+            self._synced_at = None
+
+    def now(self) -> float:
+        return self._clock() + self.offset
+
+    def now_ms(self) -> int:
+        return int(math.floor(self.now() * 1000))
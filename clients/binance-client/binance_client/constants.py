@@ -32,6 +32,12 @@ RATE_LIMIT_INTERVAL_SECOND = "SECOND"
 RATE_LIMIT_INTERVAL_MINUTE = "MINUTE"
 RATE_LIMIT_INTERVAL_DAY = "DAY"
 
+RATE_LIMIT_INTERVAL_SECONDS = {
+    RATE_LIMIT_INTERVAL_SECOND: 1,
+    RATE_LIMIT_INTERVAL_MINUTE: 60,
+    RATE_LIMIT_INTERVAL_DAY: 86400,
+}
+
 CONTINGENCY_TYPE_OCO = "OCO"
 
 FILTER_TYPE_PRICE_FILTER = "PRICE_FILTER"
@@ -99,6 +105,8 @@ HTTP_RESPONSE_CODES = {
     429: "Request rate limit exceeded",
 }
 
+ERROR_CODE_INVALID_TIMESTAMP = -1021  # outside of the recvWindow
+
 SECURITY_TYPE_NONE = "NONE"
 SECURITY_TYPE_TRADE = "TRADE"
 SECURITY_TYPE_MARGIN = "MARGIN"
@@ -106,6 +114,9 @@ SECURITY_TYPE_USER_DATA = "USER_DATA"
 SECURITY_TYPE_USER_STREAM = "USER_STREAM"
 SECURITY_TYPE_MARKET_DATA = "MARKET_DATA"
 
+RETRY_POLICY_IDEMPOTENT = "IDEMPOTENT"
+RETRY_POLICY_NON_IDEMPOTENT = "NON_IDEMPOTENT"
+
 SECURITY_TYPES = {
     SECURITY_TYPE_NONE: {"requires_api_key": False, "requires_signature": False},
     SECURITY_TYPE_TRADE: {"requires_api_key": True, "requires_signature": True},
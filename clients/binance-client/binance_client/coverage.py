@@ -0,0 +1,106 @@
+import numpy as np
+from typing import List, Optional, Tuple
+from . import constants
+
+MINUTE = 60000
+
+# Months have no fixed length, 1M klines are not tracked
+INTERVAL_MS = {
+    constants.KLINE_INTERVAL_MINUTES_1: MINUTE,
+    constants.KLINE_INTERVAL_MINUTES_3: 3 * MINUTE,
+    constants.KLINE_INTERVAL_MINUTES_5: 5 * MINUTE,
+    constants.KLINE_INTERVAL_MINUTES_15: 15 * MINUTE,
+    constants.KLINE_INTERVAL_MINUTES_30: 30 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_1: 60 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_2: 120 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_4: 240 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_6: 360 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_8: 480 * MINUTE,
+    constants.KLINE_INTERVAL_HOURS_12: 720 * MINUTE,
+    constants.KLINE_INTERVAL_DAYS_1: 1440 * MINUTE,
+    constants.KLINE_INTERVAL_DAYS_3: 3 * 1440 * MINUTE,
+    constants.KLINE_INTERVAL_WEEKS_1: 7 * 1440 * MINUTE,
+}
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    # Union of [start, end) ranges, sorted and with touching ranges joined
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class Coverage:
+    # Which open times of a symbol are stored, for klines spaced by period ms.
+    # ranges are the contiguous runs of stored klines as [start, end), start
+    # being the first open time and end the open time after the last one.
+    # checked are the ranges known to have no more klines than the stored ones,
+    # e.g. already requested from Binance, which has no klines while the
+    # exchange was down. duplicates counts the klines written more than once.
+    def __init__(
+        self,
+        period: int,
+        ranges: Optional[List[List[int]]] = None,
+        checked: Optional[List[List[int]]] = None,
+        duplicates: int = 0,
+    ):
+        self.period = period
+        self.ranges = ranges or []
+        self.checked = checked or []
+        self.duplicates = duplicates
+
+    @classmethod
+    def from_dict(cls, period: int, d: dict) -> "Coverage":
+        return cls(period, d["ranges"], d["checked"], d["duplicates"])
+
+    def to_dict(self) -> dict:
+        return {
+            "ranges": self.ranges,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+        }
+
+    def add(self, open_times: np.ndarray) -> int:
+        # Records the open times as stored, returns how many were already
+        unique = np.unique(open_times)
+        duplicates = len(open_times) - len(unique)
+        for start, end in self.ranges:
+            first, last = np.searchsorted(unique, [start, end])
+            duplicates += int(last - first)
+        if len(unique) > 0:
+            breaks = np.flatnonzero(np.diff(unique) != self.period) + 1
+            starts = unique[np.r_[0, breaks]]
+            ends = unique[np.r_[breaks - 1, len(unique) - 1]] + self.period
+            added = [[int(s), int(e)] for s, e in zip(starts, ends)]
+            self.ranges = merge_ranges(self.ranges + added)
+        self.duplicates += duplicates
+        return duplicates
+
+    def check(self, start: int, end: int):
+        if start < end:
+            self.checked = merge_ranges(self.checked + [[start, end]])
+
+    def gaps(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        # [start, end) ranges of open times neither stored nor checked, by
+        # default between the first and the last stored klines
+        known = merge_ranges(self.ranges + self.checked)
+        if start is None:
+            start = self.ranges[0][0] if len(self.ranges) > 0 else 0
+        if end is None:
+            end = self.ranges[-1][1] if len(self.ranges) > 0 else 0
+        gaps = []
+        for known_start, known_end in known:
+            if known_start > start:
+                gaps.append((start, min(known_start, end)))
+            start = max(start, known_end)
+            if start >= end:
+                break
+        if start < end:
+            gaps.append((start, end))
+        return [(s, e) for s, e in gaps if s < e]
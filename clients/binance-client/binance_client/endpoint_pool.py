@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from . import constants
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+EWMA_ALPHA = 0.2
+ERROR_PENALTY = 10  # a host failing every request scores 11 times its latency
+PROBE_INTERVAL = 60  # hosts unused for this long are measured again
+MIN_COOLDOWN = 0.5
+MAX_COOLDOWN = 30
+
+
+def default_hosts(test_net: bool = False) -> List[str]:
+    if test_net:
+        return [constants.BASE_TEST_ENDPOINT]
+    return [constants.BASE_ENDPOINT] + constants.FALLBACK_ENDPOINTS
+
+
+class HostStats:
+    def __init__(self):
+        self.latency: Optional[float] = None  # EWMA of the round trip in seconds
+        self.error_rate = 0.0  # EWMA of failed requests
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.last_used = 0.0
+
+    def score(self, now: float) -> float:
+        # Lower is healthier, unmeasured or stale hosts go first to be measured
+        if self.latency is None or now - self.last_used > PROBE_INTERVAL:
+            return 0.0
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def as_dict(self) -> dict:
+        return {
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "consecutive_failures": self.consecutive_failures,
+            "down_until": self.down_until,
+        }
+
+
+class EndpointPool:
+    # Routes every request to the healthiest REST host. Latency and error rate
+    # are tracked per host and a host that fails to connect is put on an
+    # exponential cooldown, so the next attempt goes to another host at once.
+    def __init__(self, hosts: List[str], clock: Callable[[], float] = time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._hosts = list(hosts)
+        self._stats = {host: HostStats() for host in self._hosts}
+
+    def pick(self) -> Tuple[str, float]:
+        # Returns the host to use and the seconds to wait before using it,
+        # which is only above zero when every host is cooling down
+        with self._lock:
+            now = self._clock()
+            available = [h for h in self._hosts if self._stats[h].down_until <= now]
+            if len(available) == 0:
+                host = min(self._hosts, key=lambda h: self._stats[h].down_until)
+                return host, self._stats[host].down_until - now
+            # min() keeps the configured order among ties, main host first
+            host = min(available, key=lambda h: self._stats[h].score(now))
+            self._stats[host].last_used = now
+            return host, 0.0
+
+    def report_success(self, host: str, latency: float):
+        with self._lock:
+            stats = self._stats[host]
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += EWMA_ALPHA * (latency - stats.latency)
+            stats.error_rate -= EWMA_ALPHA * stats.error_rate
+            stats.consecutive_failures = 0
+            stats.down_until = 0.0
+
+    def report_failure(self, host: str):
+        with self._lock:
+            stats = self._stats[host]
+            stats.error_rate += EWMA_ALPHA * (1 - stats.error_rate)
+            stats.consecutive_failures += 1
+            cooldown = min(
+                MIN_COOLDOWN * 2 ** (stats.consecutive_failures - 1), MAX_COOLDOWN
+            )
+            stats.down_until = self._clock() + cooldown
+        logger.warning(f"Host {host} failed, cooling down for {cooldown}s")
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {host: self._stats[host].as_dict() for host in self._hosts}
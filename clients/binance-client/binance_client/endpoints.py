@@ -5,6 +5,8 @@ from .constants import (
     SECURITY_TYPE_USER_DATA,
     SECURITY_TYPE_TRADE,
     SECURITY_TYPE_USER_STREAM,
+    RETRY_POLICY_IDEMPOTENT,
+    RETRY_POLICY_NON_IDEMPOTENT,
 )
 
 endpoints_config = {
@@ -32,24 +34,28 @@ endpoints_config = {
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_USER_DATA],
             "weight": 0,
+            "retry": RETRY_POLICY_IDEMPOTENT,
         },
         "enable_fast_withdraw_switch": {
             "path": "/sapi/v1/account/enableFastWithdrawSwitch",
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_USER_DATA],
             "weight": 0,
+            "retry": RETRY_POLICY_IDEMPOTENT,
         },
         "withdraw_sapi": {
             "path": "/sapi/v1/capital/withdraw/apply",
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_USER_DATA],
             "weight": 1,
+            "retry": RETRY_POLICY_NON_IDEMPOTENT,
         },
         "withdraw_wapi": {
             "path": "/wapi/v3/withdraw.html",
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_USER_DATA],
             "weight": 1,
+            "retry": RETRY_POLICY_NON_IDEMPOTENT,
         },
         "deposit_history_sapi": {
             "path": "/sapi/v1/capital/deposit/hisrec",
@@ -145,6 +151,7 @@ endpoints_config = {
             "method": "GET",
             "security": SECURITY_TYPES[SECURITY_TYPE_NONE],
             "weight": 1,
+            "cache_ttl": 3600,  # seconds, trading rules and limits rarely change
         },
         "order_book": {
             "path": "/api/v3/depth",
@@ -207,12 +214,15 @@ endpoints_config = {
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_TRADE],
             "weight": 1,
+            "retry": RETRY_POLICY_IDEMPOTENT,
         },
         "new_order": {
             "path": "/api/v3/order",
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_TRADE],
             "weight": 1,
+            "orders": 1,
+            "retry": RETRY_POLICY_NON_IDEMPOTENT,
         },
         "cancel_order": {
             "path": "/api/v3/order",
@@ -249,6 +259,8 @@ endpoints_config = {
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_TRADE],
             "weight": 1,
+            "orders": 2,
+            "retry": RETRY_POLICY_NON_IDEMPOTENT,
         },
         "cancel_oco": {
             "path": "/api/v3/orderList",
@@ -293,6 +305,7 @@ endpoints_config = {
             "method": "POST",
             "security": SECURITY_TYPES[SECURITY_TYPE_USER_STREAM],
             "weight": 1,
+            "retry": RETRY_POLICY_IDEMPOTENT,
         },
         "ping_listen_key": {
             "path": "/api/v3/userDataStream",
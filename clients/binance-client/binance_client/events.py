@@ -0,0 +1,141 @@
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+# Stream payloads as records with their numbers parsed, prices and quantities
+# come as strings from Binance. Payloads of other streams are left as decoded.
+
+
+class Trade(NamedTuple):
+    symbol: str
+    trade_id: int
+    price: float
+    quantity: float
+    time: int
+    event_time: int
+    buyer_is_maker: bool
+
+
+class AggTrade(NamedTuple):
+    symbol: str
+    aggregate_id: int
+    price: float
+    quantity: float
+    first_trade_id: int
+    last_trade_id: int
+    time: int
+    event_time: int
+    buyer_is_maker: bool
+
+
+class Kline(NamedTuple):
+    symbol: str
+    interval: str
+    open_time: int
+    close_time: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    quote_volume: float
+    trades: int
+    closed: bool  # False while the kline is still open
+    event_time: int
+
+
+class BookTicker(NamedTuple):
+    symbol: str
+    update_id: int
+    bid_price: float
+    bid_quantity: float
+    ask_price: float
+    ask_quantity: float
+
+
+class Depth(NamedTuple):
+    # Both the diff depth updates and the partial book depth snapshots, which
+    # have neither a first update id nor an event time
+    symbol: str
+    first_update_id: Optional[int]
+    last_update_id: int
+    bids: List[Tuple[float, float]]
+    asks: List[Tuple[float, float]]
+    event_time: Optional[int]
+
+
+def _levels(levels: list) -> List[Tuple[float, float]]:
+    return [(float(price), float(quantity)) for price, quantity in levels]
+
+
+def parse_trade(p: dict) -> Trade:
+    return Trade(p["s"], p["t"], float(p["p"]), float(p["q"]), p["T"], p["E"], p["m"])
+
+
+def parse_agg_trade(p: dict) -> AggTrade:
+    return AggTrade(
+        p["s"],
+        p["a"],
+        float(p["p"]),
+        float(p["q"]),
+        p["f"],
+        p["l"],
+        p["T"],
+        p["E"],
+        p["m"],
+    )
+
+
+def parse_kline(p: dict) -> Kline:
+    k = p["k"]
+    return Kline(
+        p["s"],
+        k["i"],
+        k["t"],
+        k["T"],
+        float(k["o"]),
+        float(k["h"]),
+        float(k["l"]),
+        float(k["c"]),
+        float(k["v"]),
+        float(k["q"]),
+        k["n"],
+        k["x"],
+        p["E"],
+    )
+
+
+def parse_book_ticker(p: dict) -> BookTicker:
+    return BookTicker(
+        p["s"], p["u"], float(p["b"]), float(p["B"]), float(p["a"]), float(p["A"])
+    )
+
+
+def parse_depth_update(p: dict) -> Depth:
+    return Depth(p["s"], p["U"], p["u"], _levels(p["b"]), _levels(p["a"]), p["E"])
+
+
+def parse_partial_depth(p: dict, symbol: str) -> Depth:
+    return Depth(
+        symbol, None, p["lastUpdateId"], _levels(p["bids"]), _levels(p["asks"]), None
+    )
+
+
+EVENT_PARSERS = {
+    "trade": parse_trade,
+    "aggTrade": parse_agg_trade,
+    "kline": parse_kline,
+    "depthUpdate": parse_depth_update,
+}
+
+
+def parse_event(payload: Any, stream: Optional[str] = None) -> Any:
+    # The record of a stream payload, given the name of its stream when combined
+    if not isinstance(payload, dict):
+        return payload
+    parser = EVENT_PARSERS.get(payload.get("e"))
+    if parser is not None:
+        return parser(payload)
+    if "e" not in payload and "u" in payload and "b" in payload:
+        return parse_book_ticker(payload)
+    if "lastUpdateId" in payload and stream is not None:
+        return parse_partial_depth(payload, stream.split("@")[0].upper())
+    return payload
@@ -0,0 +1,410 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from numpy.lib.recfunctions import repack_fields
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+from . import constants
+from .async_client import AsyncBinanceClient
+from .coverage import INTERVAL_MS
+from .klines import KLINE_DTYPE, parse_klines
+from .store import KlineStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_CONCURRENCY = 8
+KLINES_PER_REQUEST = 1000  # maximum allowed by the API
+KLINE_FIELDS = KLINE_DTYPE.names
+OPEN_TIME = KLINE_FIELDS.index("open_time")
+CLOSE_TIME = KLINE_FIELDS.index("close_time")
+MAX_ROW_BYTES = 4096
+
+
+def trading_symbols(
+    exchange_info: dict, quote_asset: Optional[str] = None
+) -> List[str]:
+    # Symbols currently trading according to exchange_information
+    return [
+        symbol["symbol"]
+        for symbol in exchange_info["symbols"]
+        if symbol["status"] == constants.SYMBOL_STATUS_TRADING
+        and (quote_asset is None or symbol["quoteAsset"] == quote_asset)
+    ]
+
+
+class CsvWriter:
+    def __init__(self, path: str, columns: List[int], size: int):
+        self._path = path
+        self._columns = columns
+        self._f = open(path, "ab")
+        self._f.truncate(size)  # drop rows written after the last save
+        self._f.seek(size)
+
+    def write(self, klines: list):
+        # The fields are written as sent, numeric strings keep their precision
+        columns = self._columns
+        lines = [",".join([str(kline[i]) for i in columns]) for kline in klines]
+        self._f.write(("\n".join(lines) + "\n").encode())
+        self._f.flush()
+
+    def check(self, start: int, end: int):
+        pass
+
+    def drop_last_row(self, open_time: int) -> bool:
+        # Only when the last row is the kline opened at open_time, rows of csvs
+        # written before the index may be out of order
+        if OPEN_TIME not in self._columns:
+            return False
+        size = self._f.tell()
+        with open(self._path, "rb") as f:
+            f.seek(max(size - MAX_ROW_BYTES, 0))
+            tail = f.read(size - f.tell())
+        # After the newline ending the row before the last, if any
+        start = tail.rfind(b"\n", 0, len(tail) - 1) + 1
+        row = tail[start:].split(b",")
+        if int(row[self._columns.index(OPEN_TIME)]) != open_time:
+            return False
+        kept = size - len(tail) + start
+        self._f.truncate(kept)
+        self._f.seek(kept)
+        return True
+
+    def size(self) -> int:
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+class StoreWriter:
+    def __init__(self, store: KlineStore, symbol: str, fields: List[str]):
+        self._store = store
+        self._symbol = symbol
+        self._fields = fields
+
+    def write(self, klines: list):
+        self._store.write(
+            self._symbol, repack_fields(parse_klines(klines)[self._fields])
+        )
+
+    def drop_last_row(self, open_time: int) -> bool:
+        return True  # rewritten klines replace the stored ones
+
+    def check(self, start: int, end: int):
+        # Binance has no klines for the times the exchange was down, a range
+        # already requested is not requested again when backfilling
+        if self._store.period() is not None:
+            self._store.check(self._symbol, start, end)
+
+    def size(self) -> int:
+        return 0
+
+    def close(self):
+        pass
+
+
+class HistoryDownloader:
+    # Pages kline_candlestick_data forward in time for many symbols and
+    # intervals at once, appending every page to a headerless csv per symbol
+    # and interval. All the downloads share the rate limiter of the client, so
+    # the only limit on the speed is the request weight budget.
+    #
+    # With columnar the klines go to a KlineStore per interval in out_dir
+    # instead, see store.py. The coverage the stores keep lets backfill fetch
+    # only the klines missing between the stored ones.
+    #
+    # The progress of each download is saved to an index after every page, a
+    # new download of the same symbol and interval resumes where the last one
+    # stopped. The index is a json file per download in index_dir, by default
+    # next to out_dir so that out_dir only contains the klines.
+    def __init__(
+        self,
+        binance: AsyncBinanceClient,
+        out_dir: str,
+        index_dir: Optional[str] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        fields: Sequence[str] = KLINE_FIELDS,
+        file_name: str = "{symbol}_{interval}.csv",
+        columnar: bool = False,
+    ):
+        self._binance = binance
+        self._out_dir = out_dir
+        self._index_dir = index_dir or f"{out_dir.rstrip('/')}.progress"
+        self._concurrency = concurrency
+        self._fields = list(fields)
+        self._columns = [KLINE_FIELDS.index(field) for field in fields]
+        self._file_name = file_name
+        self._columnar = columnar
+        self._stores: Dict[str, KlineStore] = {}
+        if columnar and "open_time" not in self._fields:
+            raise ValueError("The open_time field is needed to partition klines")
+        os.makedirs(self._out_dir, exist_ok=True)
+        os.makedirs(self._index_dir, exist_ok=True)
+
+    async def download(
+        self,
+        symbols: List[str],
+        intervals: List[str],
+        start_time: int = 1,  # a start time of 0 is not sent, as any falsy argument
+        end_time: Optional[int] = None,
+        refresh_last: bool = False,
+    ) -> Dict[Tuple[str, str], int]:
+        # Returns the klines written per (symbol, interval). With refresh_last,
+        # downloads resume from the last kline written, which is written again.
+        if end_time is None:
+            end_time = int(time.time() * 1000)
+        return await self._gather(
+            self.download_one, symbols, intervals, start_time, end_time, refresh_last
+        )
+
+    async def sync(
+        self,
+        symbols: List[str],
+        intervals: List[str],
+        start_time: int = 1,
+        end_time: Optional[int] = None,
+    ) -> Dict[Tuple[str, str], int]:
+        # Brings the csvs of the given symbols up to date: only klines newer than
+        # the indexed ones are fetched and newly listed symbols are downloaded
+        # from start_time. Indexed symbols missing from symbols are marked as
+        # delisted, their csvs are kept but no longer requested. The last
+        # kline of each csv is fetched again, it may have been written while
+        # still open by versions that did not skip open klines.
+        listed = set(symbols)
+        for entry in self.index().values():
+            if entry["symbol"] not in listed and not entry["delisted"]:
+                logger.info(f"{entry['symbol']} is no longer listed")
+                self._save_entry(dict(entry, delisted=True))
+        return await self.download(symbols, intervals, start_time, end_time, True)
+
+    async def download_one(
+        self,
+        symbol: str,
+        interval: str,
+        start_time: int,
+        end_time: int,
+        refresh_last: bool = False,
+    ) -> int:
+        entry, writer = self._open(symbol, interval)
+        if entry is None:
+            logger.warning(f"{symbol} {interval} klines cannot be indexed, skipping")
+            return 0
+        entry["delisted"] = False
+        next_start = max(start_time, entry["next_start"])
+        last_open_time = entry["last_open_time"]
+        if (
+            refresh_last
+            and last_open_time is not None
+            and next_start > last_open_time
+            and writer.drop_last_row(last_open_time)
+        ):
+            next_start = last_open_time
+        written = 0
+        try:
+            async for klines, page_end in self._pages(
+                symbol, interval, next_start, end_time
+            ):
+                if len(klines) > 0:
+                    writer.write(klines)
+                    written += len(klines)
+                    entry["last_open_time"] = klines[-1][0]
+                writer.check(next_start, page_end)
+                next_start = page_end
+                entry["next_start"] = next_start
+                entry["size"] = writer.size()
+                self._save_entry(entry)
+        finally:
+            writer.close()
+        logger.info(f"Downloaded {written} {interval} klines of {symbol}")
+        return written
+
+    async def backfill(
+        self,
+        symbols: List[str],
+        intervals: List[str],
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> Dict[Tuple[str, str], int]:
+        # Fetches only the klines missing from the stores of a columnar
+        # download, by default between the first and the last stored ones.
+        # Returns the klines written per (symbol, interval).
+        if not self._columnar:
+            raise ValueError("Only columnar downloads keep the coverage of klines")
+        return await self._gather(
+            self.backfill_one, symbols, intervals, start_time, end_time
+        )
+
+    async def backfill_one(
+        self,
+        symbol: str,
+        interval: str,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> int:
+        store = self.store(interval)
+        writer = StoreWriter(store, symbol, self._fields)
+        end = end_time + 1 if end_time is not None else None
+        written = 0
+        for gap_start, gap_end in store.gaps(symbol, start_time, end):
+            next_start = gap_start
+            async for klines, page_end in self._pages(
+                symbol, interval, gap_start, gap_end - 1
+            ):
+                writer.write(klines)
+                written += len(klines)
+                writer.check(next_start, page_end)
+                next_start = page_end
+        logger.info(f"Backfilled {written} {interval} klines of {symbol}")
+        return written
+
+    async def _gather(
+        self, run: Callable, symbols: List[str], intervals: List[str], *args
+    ) -> Dict[Tuple[str, str], int]:
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def bounded(symbol: str, interval: str) -> int:
+            async with semaphore:
+                return await run(symbol, interval, *args)
+
+        jobs = [(symbol, interval) for symbol in symbols for interval in intervals]
+        written = await asyncio.gather(*[bounded(*job) for job in jobs])
+        return dict(zip(jobs, written))
+
+    async def _pages(
+        self, symbol: str, interval: str, start_time: int, end_time: int
+    ) -> AsyncIterator[Tuple[list, int]]:
+        # Yields every page of klines from start_time to end_time with the open
+        # time to request next, until the first error. A kline still open when
+        # requested is not yielded, the download stops before it so that it is
+        # fetched again once closed.
+        next_start = start_time
+        while next_start <= end_time:
+            requested_at = int(time.time() * 1000)
+            r = await self._binance.market_data.kline_candlestick_data(
+                symbol=symbol,
+                interval=interval,
+                start_time=next_start,
+                end_time=end_time,
+                limit=KLINES_PER_REQUEST,
+            )
+            if r["http_code"] != 200:
+                logger.error(
+                    f"Stopping {symbol} {interval} download at {next_start}: "
+                    f"{r['http_code']} {r['content']}"
+                )
+                return
+            klines = r["content"]
+            if len(klines) > 0 and klines[-1][CLOSE_TIME] >= requested_at:
+                yield klines[:-1], klines[-1][0]
+                return
+            if len(klines) > 0:
+                next_start = klines[-1][0] + 1
+            if len(klines) < KLINES_PER_REQUEST:
+                next_start = max(next_start, end_time + 1)  # up to date
+            yield klines, next_start
+
+    def store(self, interval: str) -> KlineStore:
+        if interval not in self._stores:
+            self._stores[interval] = KlineStore(
+                os.path.join(self._out_dir, interval), INTERVAL_MS.get(interval)
+            )
+        return self._stores[interval]
+
+    def _open(self, symbol: str, interval: str) -> Tuple[Optional[dict], object]:
+        if self._columnar:
+            store = self.store(interval)
+            entry = self._read_entry(self._entry_path(symbol, interval))
+            if entry is None:
+                entry = self._index_store(store, symbol, interval)
+            return entry, StoreWriter(store, symbol, self._fields)
+        path = self.path(symbol, interval)
+        entry = self._load_entry(symbol, interval, path)
+        if entry is None:
+            return None, None
+        return entry, CsvWriter(path, self._columns, entry["size"])
+
+    def index(self) -> Dict[Tuple[str, str], dict]:
+        # Progress of every download: the next open time to fetch, the bytes
+        # written, the last open time written and whether it was delisted
+        entries = {}
+        for name in os.listdir(self._index_dir):
+            if not name.endswith(".json"):
+                continue
+            entry = self._read_entry(os.path.join(self._index_dir, name))
+            if entry is not None:
+                entries[(entry["symbol"], entry["interval"])] = entry
+        return entries
+
+    def path(self, symbol: str, interval: str) -> str:
+        name = self._file_name.format(symbol=symbol, interval=interval)
+        return os.path.join(self._out_dir, name)
+
+    def _entry_path(self, symbol: str, interval: str) -> str:
+        return os.path.join(self._index_dir, f"{symbol}_{interval}.json")
+
+    def _new_entry(self, symbol: str, interval: str) -> dict:
+        return {
+            "symbol": symbol,
+            "interval": interval,
+            "next_start": 0,
+            "size": 0,
+            "last_open_time": None,
+            "delisted": False,
+        }
+
+    def _load_entry(self, symbol: str, interval: str, path: str) -> Optional[dict]:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return self._new_entry(symbol, interval)
+        entry = self._read_entry(self._entry_path(symbol, interval))
+        if entry is None or os.path.getsize(path) < entry["size"]:
+            return self._index_csv(symbol, interval, path)
+        return entry
+
+    def _read_entry(self, path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error when reading {path} - {e}")
+            return None
+
+    def _index_csv(self, symbol: str, interval: str, path: str) -> Optional[dict]:
+        # Indexes a csv that has no entry, e.g. written before the index existed,
+        # from the largest open time it contains
+        if "open_time" not in self._fields:
+            return None
+        column = self._fields.index("open_time")
+        entry = self._new_entry(symbol, interval)
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written row
+                open_time = int(line.split(b",")[column])
+                if (
+                    entry["last_open_time"] is None
+                    or open_time > entry["last_open_time"]
+                ):
+                    entry["last_open_time"] = open_time
+                entry["size"] += len(line)
+        if entry["last_open_time"] is not None:
+            entry["next_start"] = entry["last_open_time"] + 1
+        logger.info(f"Indexed {path} up to {entry['last_open_time']}")
+        return entry
+
+    def _index_store(self, store: KlineStore, symbol: str, interval: str) -> dict:
+        entry = self._new_entry(symbol, interval)
+        partitions = store.partitions(symbol).values()
+        if len(partitions) > 0:
+            entry["last_open_time"] = max(p["last_open_time"] for p in partitions)
+            entry["next_start"] = entry["last_open_time"] + 1
+        return entry
+
+    def _save_entry(self, entry: dict):
+        path = self._entry_path(entry["symbol"], entry["interval"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,150 @@
+import threading
+import numpy as np
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from .coverage import INTERVAL_MS
+from .events import Kline
+from .klines import KLINE_DTYPE
+
+DEFAULT_CAPACITY = 500  # closed klines kept per symbol and interval
+
+# The fields of KLINE_DTYPE sent in kline streams
+CACHE_FIELDS = [
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "close_time",
+    "quote_volume",
+    "trades",
+]
+CACHE_DTYPE = np.dtype([(field, KLINE_DTYPE[field]) for field in CACHE_FIELDS])
+
+
+def _row(kline: Kline) -> tuple:
+    return (
+        kline.open_time,
+        kline.open,
+        kline.high,
+        kline.low,
+        kline.close,
+        kline.volume,
+        kline.close_time,
+        kline.quote_volume,
+        kline.trades,
+    )
+
+
+class KlineCache:
+    # The latest klines of each symbol and interval, kept up to date by the
+    # <symbol>@kline_<interval> streams. Closed klines are final, the open one
+    # is replaced by every update until it closes. Updated by the stream
+    # thread and read by any other, each series is a deque of the last
+    # capacity closed klines plus the open one.
+    #
+    # A kline opening more than an interval after the last closed one means
+    # that closes were missed, e.g. while reconnecting. The open times missed
+    # are listed by gaps until they are filled from the REST API.
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        # (symbol, interval) -> (closed klines, open kline)
+        self._series: Dict[Tuple[str, str], Tuple[deque, Optional[tuple]]] = {}
+        # (symbol, interval) -> (first, last) open times missed
+        self._gaps: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._filled: Dict[Tuple[str, str], int] = {}  # -> last open time filled
+
+    def update(self, kline: Kline):
+        key = (kline.symbol, kline.interval)
+        with self._lock:
+            closed, open_kline = self._series.get(key, (None, None))
+            if closed is None:
+                closed = deque(maxlen=self._capacity)
+            elif len(closed) > 0 and kline.open_time <= closed[-1][0]:
+                return  # finalized already
+            elif len(closed) > 0:
+                self._track_gap(key, closed[-1][0], kline.open_time)
+            if kline.closed:
+                closed.append(_row(kline))
+                open_kline = None
+            else:
+                open_kline = _row(kline)
+            self._series[key] = (closed, open_kline)
+
+    def seed(self, symbol: str, interval: str, klines: np.ndarray, now_ms: int):
+        # Klines from the REST API, older than the ones streamed already. The
+        # ones closing after now_ms are still open, the last one is kept.
+        key = (symbol, interval)
+        with self._lock:
+            closed, open_kline = self._series.get(key, (None, None))
+            if closed is None:
+                closed = deque(maxlen=self._capacity)
+            first = closed[0][0] if len(closed) > 0 else None
+            rows = klines[CACHE_FIELDS].tolist()
+            older = [
+                row
+                for row in rows
+                if row[6] < now_ms and (first is None or row[0] < first)
+            ]
+            skipped = max(len(older) - (closed.maxlen - len(closed)), 0)
+            closed.extendleft(reversed(older[skipped:]))
+            if open_kline is None and first is None and len(rows) > 0:
+                if rows[-1][6] >= now_ms:
+                    open_kline = rows[-1]
+            self._series[key] = (closed, open_kline)
+
+    def gaps(self) -> List[Tuple[str, str, int, int]]:
+        # (symbol, interval, first, last) open times of the klines missed
+        with self._lock:
+            return [key + gap for key, gap in self._gaps.items()]
+
+    def fill(self, symbol: str, interval: str, klines: np.ndarray, now_ms: int):
+        # Klines from the REST API for a gap. The ones closing after now_ms are
+        # still open and left out. Open times of the gap without klines, e.g.
+        # while the exchange was down, are not asked for again.
+        key = (symbol, interval)
+        with self._lock:
+            gap = self._gaps.pop(key, None)
+            if gap is None or key not in self._series:
+                return
+            closed, open_kline = self._series[key]
+            first, last = gap
+            self._filled[key] = last
+            rows = {row[0]: row for row in closed}
+            for row in klines[CACHE_FIELDS].tolist():
+                if first <= row[0] <= last and row[6] < now_ms:
+                    rows[row[0]] = row
+            merged = deque(maxlen=self._capacity)
+            merged.extend(sorted(rows.values()))
+            self._series[key] = (merged, open_kline)
+
+    def _track_gap(self, key: Tuple[str, str], last_closed: int, open_time: int):
+        step = INTERVAL_MS[key[1]]
+        last_closed = max(last_closed, self._filled.get(key, last_closed))
+        if open_time - last_closed <= step:
+            return
+        first, last = last_closed + step, open_time - step
+        gap = self._gaps.get(key)
+        if gap is not None:
+            first, last = min(first, gap[0]), max(last, gap[1])
+        self._gaps[key] = (first, last)
+
+    def klines(
+        self, symbol: str, interval: str, include_open: bool = False
+    ) -> np.ndarray:
+        # Oldest first, with the open kline last if included
+        with self._lock:
+            closed, open_kline = self._series.get((symbol, interval), ([], None))
+            rows = list(closed)
+        if include_open and open_kline is not None:
+            rows.append(open_kline)
+        return np.array(rows, dtype=CACHE_DTYPE)
+
+    def discard(self, symbol: str):
+        with self._lock:
+            for key in [key for key in self._series if key[0] == symbol]:
+                del self._series[key]
+                self._gaps.pop(key, None)
+                self._filled.pop(key, None)
@@ -0,0 +1,29 @@
+import numpy as np
+
+KLINE_DTYPE = np.dtype(
+    [
+        ("open_time", "i8"),
+        ("open", "f8"),
+        ("high", "f8"),
+        ("low", "f8"),
+        ("close", "f8"),
+        ("volume", "f8"),
+        ("close_time", "i8"),
+        ("quote_volume", "f8"),
+        ("trades", "i8"),
+        ("taker_buy_base_volume", "f8"),
+        ("taker_buy_quote_volume", "f8"),
+    ]
+)
+
+
+def parse_klines(klines: list) -> np.ndarray:
+    # Converts the klines as sent by Binance, lists of numbers and numeric
+    # strings, into a structured array with one conversion per field
+    parsed = np.empty(len(klines), dtype=KLINE_DTYPE)
+    if len(klines) == 0:
+        return parsed
+    columns = list(zip(*klines))  # the trailing "ignore" field is not used
+    for i, field in enumerate(KLINE_DTYPE.names):
+        parsed[field] = np.array(columns[i], dtype=KLINE_DTYPE[field])
+    return parsed
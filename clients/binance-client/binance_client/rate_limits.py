@@ -0,0 +1,248 @@
+import logging
+import math
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from . import constants
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Used until the limits are read from exchange_information
+DEFAULT_RATE_LIMITS = [
+    {
+        "rateLimitType": constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT,
+        "interval": constants.RATE_LIMIT_INTERVAL_MINUTE,
+        "intervalNum": 1,
+        "limit": 1200,
+    },
+    {
+        "rateLimitType": constants.RATE_LIMIT_TYPE_ORDERS,
+        "interval": constants.RATE_LIMIT_INTERVAL_SECOND,
+        "intervalNum": 10,
+        "limit": 50,
+    },
+    {
+        "rateLimitType": constants.RATE_LIMIT_TYPE_ORDERS,
+        "interval": constants.RATE_LIMIT_INTERVAL_DAY,
+        "intervalNum": 1,
+        "limit": 160000,
+    },
+    {
+        "rateLimitType": constants.RATE_LIMIT_TYPE_RAW_REQUESTS,
+        "interval": constants.RATE_LIMIT_INTERVAL_MINUTE,
+        "intervalNum": 5,
+        "limit": 6100,
+    },
+]
+
+WINDOW_BUCKETS = 100
+
+# e.g. x-mbx-used-weight-1m, x-mbx-order-count-10s, x-mbx-order-count-1d
+USAGE_HEADER = re.compile(r"^x-mbx-(used-weight|order-count)-(\d+)([smhd])$")
+USAGE_HEADER_TYPES = {
+    "used-weight": constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT,
+    "order-count": constants.RATE_LIMIT_TYPE_ORDERS,
+}
+USAGE_HEADER_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def interval_seconds(rate_limit: dict) -> int:
+    return (
+        constants.RATE_LIMIT_INTERVAL_SECONDS[rate_limit["interval"]]
+        * rate_limit["intervalNum"]
+    )
+
+
+class TokenBucket:
+    # Paces consumption at capacity/interval, allowing bursts of up to capacity
+    def __init__(self, capacity: int, interval: int, now: float):
+        self.capacity = capacity
+        self.interval = interval
+        self._tokens = float(capacity)
+        self._last_refill = now
+
+    def take(self, amount: int, now: float) -> float:
+        # Returns the time at which the amount is available, tokens can go
+        # negative so that consecutive takes queue up behind each other
+        self._refill(now)
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return now
+        return now - self._tokens / self._rate()
+
+    def give_back(self, amount: int):
+        self._tokens += amount
+
+    def limit_to(self, available: int, now: float):
+        self._refill(now)
+        self._tokens = min(self._tokens, available)
+
+    def _rate(self) -> float:
+        return self.capacity / self.interval
+
+    def _refill(self, now: float):
+        elapsed = max(now - self._last_refill, 0)
+        self._tokens = min(self._tokens + elapsed * self._rate(), self.capacity)
+        self._last_refill = now
+
+
+class SlidingWindow:
+    # Counts usage over the last `interval` seconds. Usage is grouped into
+    # WINDOW_BUCKETS buckets so that day long windows stay small, each bucket
+    # is considered used until its end, which errs on the side of caution
+    def __init__(self, limit: int, interval: int, buckets: int = WINDOW_BUCKETS):
+        self.limit = limit
+        self.interval = interval
+        self._resolution = interval / buckets
+        self._usage: Dict[int, int] = {}  # bucket -> amount
+
+    def ready_time(self, amount: int, now: float, not_before: float) -> float:
+        # Earliest time from not_before on at which amount fits in every window
+        # that contains it. Reservations made for the future count as well.
+        self._forget(now)
+        used = sum(self._usage.values())
+        ready = not_before
+        for bucket in sorted(self._usage):
+            if used + amount <= self.limit:
+                break
+            used -= self._usage[bucket]
+            ready = max(ready, self._bucket_end(bucket) + self.interval)
+        return ready
+
+    def record(self, amount: int, ts: float):
+        bucket = int(math.floor(ts / self._resolution))
+        self._usage[bucket] = self._usage.get(bucket, 0) + amount
+
+    def sync(self, used: int, now: float):
+        # The server count can only be higher than ours if requests were made
+        # from somewhere else, so the difference is booked right now
+        missing = used - self.used(now)
+        if missing > 0:
+            self.record(missing, now)
+
+    def used(self, now: float) -> int:
+        self._forget(now)
+        return sum(self._usage.values())
+
+    def headroom(self, now: float) -> int:
+        return self.limit - self.used(now)
+
+    def _bucket_end(self, bucket: int) -> float:
+        return (bucket + 1) * self._resolution
+
+    def _forget(self, now: float):
+        for bucket in [
+            b for b in self._usage if self._bucket_end(b) + self.interval <= now
+        ]:
+            del self._usage[bucket]
+
+
+class RateLimiter:
+    # Tracks every REQUEST_WEIGHT, ORDERS and RAW_REQUESTS limit reported by
+    # exchange_information. Every request reserves its cost before it is sent,
+    # so only the requests that would overflow one of the windows are delayed.
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._paused_until = 0.0
+        self._bucket = None
+        self._windows: Dict[Tuple[str, int], SlidingWindow] = {}
+        self.set_limits(DEFAULT_RATE_LIMITS)
+
+    def set_limits(self, rate_limits: List[dict]):
+        with self._lock:
+            now = self._clock()
+            windows = {}
+            for rate_limit in rate_limits:
+                key = (rate_limit["rateLimitType"], interval_seconds(rate_limit))
+                window = self._windows.get(key)
+                if window is None or window.limit != rate_limit["limit"]:
+                    window = SlidingWindow(rate_limit["limit"], key[1])
+                windows[key] = window
+                logger.info(f"Tracking {rate_limit['limit']} {key[0]} every {key[1]}s")
+            self._windows = windows
+            # The request weight is paced by its shortest window
+            weight_limits = [
+                (interval, window.limit)
+                for (kind, interval), window in windows.items()
+                if kind == constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT
+            ]
+            if len(weight_limits) == 0:
+                self._bucket = None
+                return
+            interval, limit = min(weight_limits)
+            bucket = self._bucket
+            if bucket is None or (bucket.interval, bucket.capacity) != (
+                interval,
+                limit,
+            ):
+                self._bucket = TokenBucket(limit, interval, now)
+
+    def reserve(
+        self, weight: int = 0, orders: int = 0, max_delay: Optional[float] = None
+    ) -> Optional[float]:
+        # Returns the seconds the caller has to wait before sending the request,
+        # or None without reserving anything if that is longer than max_delay
+        costs = {
+            constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT: weight,
+            constants.RATE_LIMIT_TYPE_ORDERS: orders,
+            constants.RATE_LIMIT_TYPE_RAW_REQUESTS: 1,
+        }
+        with self._lock:
+            now = self._clock()
+            ready = max(now, self._paused_until)
+            if weight > 0 and self._bucket is not None:
+                ready = max(ready, self._bucket.take(weight, now))
+            charged = [
+                (window, costs[kind])
+                for (kind, _), window in self._windows.items()
+                if costs.get(kind, 0) > 0
+            ]
+            for window, cost in charged:
+                ready = max(ready, window.ready_time(cost, now, ready))
+            if max_delay is not None and ready - now > max_delay:
+                if weight > 0 and self._bucket is not None:
+                    self._bucket.give_back(weight)
+                return None
+            for window, cost in charged:
+                window.record(cost, ready)
+        delay = ready - now
+        if delay > 0:
+            logger.info(f"Delaying request {delay:.2f}s to respect the rate limits")
+        return delay
+
+    def update(self, headers):
+        # Reconciles the windows with the usage reported by the server
+        with self._lock:
+            now = self._clock()
+            for header in headers:
+                match = USAGE_HEADER.match(header.lower())
+                if match is None:
+                    continue
+                kind = USAGE_HEADER_TYPES[match.group(1)]
+                interval = int(match.group(2)) * USAGE_HEADER_UNITS[match.group(3)]
+                window = self._windows.get((kind, interval))
+                if window is None:
+                    continue
+                used = int(headers[header])
+                window.sync(used, now)
+                if kind == constants.RATE_LIMIT_TYPE_REQUEST_WEIGHT and (
+                    self._bucket is not None and self._bucket.interval == interval
+                ):
+                    self._bucket.limit_to(window.limit - used, now)
+                if used > window.limit * 0.9:
+                    logger.warning(f"{kind} used: {used}, limit: {window.limit}")
+
+    def pause(self, seconds: float):
+        # Blocks every reservation until the server lifts a 429/418 ban
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def headroom(self) -> Dict[Tuple[str, int], int]:
+        # Remaining usage per (rate limit type, interval in seconds) window,
+        # negative when requests are already queued behind a full window
+        with self._lock:
+            now = self._clock()
+            return {key: window.headroom(now) for key, window in self._windows.items()}
@@ -0,0 +1,172 @@
+import glob
+import logging
+import os
+import time
+import numpy as np
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SEGMENT_SUFFIX = ".trades"
+SEGMENT_RECORDS = 2**20  # records per segment file, 66 MiB
+WRITE_RECORDS = 1024  # records kept in memory between writes
+DEFAULT_MAX_BYTES = 2**33  # 8 GiB of segments kept per recorder
+
+KIND_TRADE = 0
+KIND_AGG_TRADE = 1
+
+# Packed, records are read back with the same dtype
+RECORD_DTYPE = np.dtype(
+    [
+        ("received", "i8"),  # receive time in microseconds
+        ("time", "i8"),  # trade time in ms
+        ("event_time", "i8"),  # in ms
+        ("trade_id", "i8"),  # aggregate id of aggregate trades
+        ("price", "f8"),
+        ("quantity", "f8"),
+        ("symbol", "S16"),
+        ("kind", "u1"),
+        ("buyer_is_maker", "?"),
+    ]
+)
+
+
+class StreamRecorder:
+    # Appends the trade and aggregate trade payloads of the streams to segment
+    # files of directory, as fixed width records in receive order. A segment
+    # is named after the receive time of its first record and holds up to
+    # segment_records, then a new one is started. Records are kept in memory
+    # and written WRITE_RECORDS at a time, or on flush. When a segment is
+    # started, the oldest ones of directory are removed until the segments
+    # take at most max_bytes.
+    #
+    # Only trades are recorded, they are all the bots replay and cannot be
+    # looked up again past the recent ones. Closed klines can be downloaded
+    # at any time, see HistoryDownloader, so recording them is not needed,
+    # and book tickers are not used by the bots.
+    def __init__(
+        self,
+        directory: str,
+        segment_records: int = SEGMENT_RECORDS,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._segment_records = segment_records
+        self._max_bytes = max_bytes
+        self._buffer = np.zeros(WRITE_RECORDS, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self._file = None
+        self._written = 0  # records in the current segment
+
+    def record(self, payload: dict, received: Optional[int] = None) -> bool:
+        kind = payload.get("e")
+        if kind == "trade":
+            trade_id, kind = payload["t"], KIND_TRADE
+        elif kind == "aggTrade":
+            trade_id, kind = payload["a"], KIND_AGG_TRADE
+        else:
+            return False
+        if received is None:
+            received = time.time_ns() // 1000
+        self._buffer[self._buffered] = (
+            received,
+            payload["T"],
+            payload["E"],
+            trade_id,
+            float(payload["p"]),
+            float(payload["q"]),
+            payload["s"].encode(),
+            kind,
+            payload["m"],
+        )
+        self._buffered += 1
+        if self._buffered == WRITE_RECORDS:
+            self.flush()
+        return True
+
+    def flush(self):
+        start = 0
+        while start < self._buffered:
+            if self._file is None or self._written >= self._segment_records:
+                self._rotate(int(self._buffer[start]["received"]))
+            end = min(self._buffered, start + self._segment_records - self._written)
+            self._file.write(self._buffer[start:end].tobytes())
+            self._written += end - start
+            start = end
+        if self._file is not None:
+            self._file.flush()
+        self._buffered = 0
+
+    def set_max_bytes(self, max_bytes: Optional[int]):
+        # Applied from the next segment started
+        self._max_bytes = max_bytes
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self, received: int):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self._directory, f"{received:016d}{SEGMENT_SUFFIX}")
+        logger.info(f"Recording trades to {path}")
+        self._file = open(path, "ab")
+        self._written = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        if self._max_bytes is not None:
+            self._prune(path)
+
+    def _prune(self, current: str):
+        # Oldest first, the segment being written is kept
+        paths = sorted(glob.glob(os.path.join(self._directory, f"*{SEGMENT_SUFFIX}")))
+        sizes = {path: os.path.getsize(path) for path in paths}
+        total = sum(sizes.values())
+        for path in paths:
+            if total <= self._max_bytes or path == current:
+                break
+            logger.info(
+                f"Removing {path}, recordings take more than {self._max_bytes}B"
+            )
+            os.remove(path)
+            total -= sizes[path]
+
+
+def segments(directory: str) -> List[str]:
+    # Segment files of directory and its subdirectories, e.g. one per shard,
+    # oldest first
+    paths = glob.glob(
+        os.path.join(directory, "**", f"*{SEGMENT_SUFFIX}"), recursive=True
+    )
+    return sorted(paths, key=os.path.basename)
+
+
+def read_segment(path: str) -> np.ndarray:
+    # Memory mapped, without the partial record left by a write cut short
+    count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(count,))
+
+
+def scan(
+    directory: str,
+    symbol: Optional[str] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Iterator[np.ndarray]:
+    # Records received between start and end, in microseconds, a chunk per
+    # segment. Chunks are views of the mapped segments, copied only to select
+    # a symbol.
+    for path in segments(directory):
+        records = read_segment(path)
+        received = records["received"]
+        first = 0 if start is None else np.searchsorted(received, start)
+        last = len(records) if end is None else np.searchsorted(received, end)
+        records = records[first:last]
+        if symbol is not None:
+            records = records[records["symbol"] == symbol.encode()]
+        if len(records) > 0:
+            yield records
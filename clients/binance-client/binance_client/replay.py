@@ -0,0 +1,607 @@
+import contextlib
+import datetime
+import heapq
+import json
+import logging
+import threading
+import time
+import numpy as np
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from . import constants
+from .coverage import INTERVAL_MS
+from .events import parse_event
+from .klines import KLINE_DTYPE
+from .recorder import KIND_TRADE, scan
+from .rollups import aggregate
+from .store import KlineStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+AWAKE_POLL = 0.1  # seconds between checks that woken threads are still alive
+DAY_MS = 86400000
+KLINES_LIMIT = 500  # klines of a request without limit, as the API
+KLINES_MAX_LIMIT = 1000
+TRADE_FEE = 0.001
+# The columns of the bnndata csvs
+CSV_FIELDS = [
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "quote_volume",
+    "trades",
+]
+
+# A replayed event: (time in seconds, stream name, payload as sent by Binance)
+Event = Tuple[float, str, dict]
+
+
+class SimulatedClock:
+    # Time of a replay, moved forward by the replay only. Threads sleeping on
+    # it are woken in time order, and the replay does not move past the wake
+    # time of a sleeper before it sleeps again, so the jobs of a schedule loop
+    # run at the simulated times they are due however fast the replay goes.
+    # Once closed, e.g. at the end of a replay, the time stays and sleeps take
+    # real time.
+    def __init__(self, start: float = 0.0):
+        self._now = start
+        self._condition = threading.Condition()
+        self._sleepers: Dict[threading.Thread, float] = {}  # -> wake time
+        self._awake: Set[threading.Thread] = set()  # woken, not sleeping yet
+        self._closed = False
+
+    def now(self) -> float:
+        return self._now
+
+    def now_ms(self) -> int:
+        return int(self._now * 1000)
+
+    def next_wake(self) -> Optional[float]:
+        with self._condition:
+            return min(self._sleepers.values(), default=None)
+
+    def sleep(self, seconds: float):
+        thread = threading.current_thread()
+        with self._condition:
+            if not self._closed:
+                self._awake.discard(thread)
+                self._sleepers[thread] = self._now + seconds
+                self._condition.notify_all()
+                while thread in self._sleepers and not self._closed:
+                    self._condition.wait()
+                self._sleepers.pop(thread, None)
+                self._awake.add(thread)
+                return
+        time.sleep(seconds)
+
+    def advance(self, to: float):
+        with self._condition:
+            while True:
+                # The woken threads run until they sleep again or end
+                while not self._closed and any(t.is_alive() for t in self._awake):
+                    self._condition.wait(AWAKE_POLL)
+                self._awake.clear()
+                due = [wake for wake in self._sleepers.values() if wake <= to]
+                if len(due) == 0:
+                    break
+                self._now = max(self._now, min(due))
+                for thread, wake in list(self._sleepers.items()):
+                    if wake <= self._now:
+                        del self._sleepers[thread]
+                        self._awake.add(thread)
+                self._condition.notify_all()
+            self._now = max(self._now, to)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _Namespace:
+    # A module with some of its attributes replaced
+    def __init__(self, module: ModuleType, **attributes):
+        self._module = module
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._module, name)
+
+
+def simulated_datetime(clock: SimulatedClock) -> type:
+    class SimulatedDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(clock.now(), tz)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.now(datetime.timezone.utc).replace(tzinfo=None)
+
+        @classmethod
+        def today(cls):
+            return cls.now()
+
+    return SimulatedDatetime
+
+
+@contextlib.contextmanager
+def simulated_time(clock: SimulatedClock, modules: List[ModuleType]):
+    # Points the datetime and time of the given modules to the clock, e.g. of
+    # schedule and of the modules of a bot: datetime.now(), dtt.now() as
+    # imported by the bots, time.time() and time.sleep()
+    sim_datetime = simulated_datetime(clock)
+    sim_modules = {
+        datetime: _Namespace(datetime, datetime=sim_datetime),
+        time: _Namespace(time, time=clock.now, sleep=clock.sleep, monotonic=clock.now),
+    }
+    replaced = []
+    for module in modules:
+        for name, value in list(vars(module).items()):
+            if value is datetime.datetime:
+                replacement = sim_datetime
+            elif isinstance(value, ModuleType) and value in sim_modules:
+                replacement = sim_modules[value]
+            else:
+                continue
+            replaced.append((module, name, value))
+            setattr(module, name, replacement)
+    try:
+        yield clock
+    finally:
+        for module, name, value in replaced:
+            setattr(module, name, value)
+
+
+def merge(*sources: Iterable[Event]) -> Iterator[Event]:
+    return heapq.merge(*sources, key=lambda event: event[0])
+
+
+def recorded_trades(
+    directory: str, start: Optional[float] = None, end: Optional[float] = None
+) -> Iterator[Event]:
+    # The trades recorded by StreamRecorder, at the times they were received
+    start_us = None if start is None else int(start * 1e6)
+    end_us = None if end is None else int(end * 1e6)
+    chunks = [_trade_events(chunk) for chunk in scan(directory, None, start_us, end_us)]
+    return merge(*chunks)
+
+
+def _trade_events(records: np.ndarray) -> Iterator[Event]:
+    for r in records:
+        symbol = r["symbol"].decode()
+        payload = {
+            "E": int(r["event_time"]),
+            "s": symbol,
+            "p": str(r["price"]),
+            "q": str(r["quantity"]),
+            "T": int(r["time"]),
+            "m": bool(r["buyer_is_maker"]),
+        }
+        if r["kind"] == KIND_TRADE:
+            payload.update({"e": "trade", "t": int(r["trade_id"])})
+            stream = f"{symbol.lower()}@trade"
+        else:
+            payload.update({"e": "aggTrade", "a": int(r["trade_id"])})
+            stream = f"{symbol.lower()}@aggTrade"
+        yield r["received"] / 1e6, stream, payload
+
+
+def stored_klines(
+    store: KlineStore,
+    symbol: str,
+    interval: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Iterator[Event]:
+    # Closed klines of a KlineStore, at their close times
+    return _kline_events(symbol, interval, store.read(symbol, start, end))
+
+
+def csv_klines(
+    path: str, symbol: str, interval: str, fields: Iterable[str] = CSV_FIELDS
+) -> Iterator[Event]:
+    # Closed klines of a headerless csv with the given fields, by default the
+    # ones of bnndata, or those HistoryDownloader wrote, at their close times
+    return _kline_events(symbol, interval, csv_kline_columns(path, fields))
+
+
+def csv_kline_columns(
+    path: str, fields: Iterable[str] = CSV_FIELDS
+) -> Dict[str, np.ndarray]:
+    rows = np.loadtxt(path, delimiter=",", ndmin=2)
+    return {field: rows[:, i] for i, field in enumerate(fields)}
+
+
+def _kline_events(
+    symbol: str, interval: str, columns: Dict[str, np.ndarray]
+) -> Iterator[Event]:
+    open_times = columns["open_time"].astype(np.int64)
+    if "close_time" in columns:
+        close_times = columns["close_time"].astype(np.int64)
+    else:
+        close_times = open_times + INTERVAL_MS[interval] - 1
+    zeros = np.zeros(len(open_times))
+    stream = f"{symbol.lower()}@kline_{interval}"
+    for i in range(len(open_times)):
+        kline = {
+            "t": int(open_times[i]),
+            "T": int(close_times[i]),
+            "s": symbol,
+            "i": interval,
+            "o": str(columns["open"][i]),
+            "h": str(columns["high"][i]),
+            "l": str(columns["low"][i]),
+            "c": str(columns["close"][i]),
+            "v": str(columns.get("volume", zeros)[i]),
+            "q": str(columns.get("quote_volume", zeros)[i]),
+            "n": int(columns.get("trades", zeros)[i]),
+            "x": True,
+        }
+        payload = {"e": "kline", "E": kline["T"] + 1, "s": symbol, "k": kline}
+        yield (kline["T"] + 1) / 1000, stream, payload
+
+
+class ReplayStreamClient(threading.Thread):
+    # Plays a source of events, e.g. recorded_trades or csv_klines, to
+    # on_message as BinanceStreamClient passes messages: of the subscribed
+    # streams only, as combined stream messages or records with events, and in
+    # lists with batch_size or batch_interval, in simulated seconds.
+    #
+    # The clock is moved to the time of every event, at speed times real time,
+    # or as fast as the consumers allow with a speed of 0. It is closed at the
+    # end of the source.
+    #
+    # Only streams are replayed, the REST requests of a bot go to the client
+    # it was given, a ReplayBinanceClient on the same clock to run offline.
+    def __init__(
+        self,
+        streams: List[str],
+        on_message: Callable[[Any], Any],
+        source: Iterable[Event],
+        clock: Optional[SimulatedClock] = None,
+        speed: float = 1.0,
+        events: bool = False,
+        batch_size: int = 0,
+        batch_interval: float = 0,
+    ):
+        threading.Thread.__init__(self)
+        self._streams = set(streams)
+        self._lock = threading.Lock()
+        self._on_message = on_message
+        self._source = source
+        self._clock = clock
+        self._speed = speed
+        self._events = events
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._batch: Optional[list] = [] if batch_size or batch_interval else None
+        self._batch_started = 0.0
+        self._stopped = threading.Event()
+        self._anchor: Optional[Tuple[float, float]] = None  # (real, simulated)
+
+    def run(self):
+        try:
+            for t, stream, payload in self._source:
+                if self._clock is None:
+                    self._clock = SimulatedClock(t)
+                if self._anchor is None:
+                    self._anchor = (time.monotonic(), t)
+                if not self._wait_until(t):
+                    break
+                with self._lock:
+                    if stream not in self._streams:
+                        continue
+                self._emit(t, stream, payload)
+            self._flush()
+        finally:
+            if self._clock is not None:
+                self._clock.close()
+        logger.info("Replay finished")
+
+    def clock(self) -> Optional[SimulatedClock]:
+        return self._clock
+
+    def set_streams(self, streams: List[str]):
+        with self._lock:
+            self._streams = set(streams)
+
+    def subscribe(self, streams: List[str]):
+        with self._lock:
+            self._streams |= set(streams)
+
+    def unsubscribe(self, streams: List[str]):
+        with self._lock:
+            self._streams -= set(streams)
+
+    def subscriptions(self) -> List[str]:
+        with self._lock:
+            return sorted(self._streams)
+
+    def stop(self):
+        logger.info("Shutting down replay...")
+        self._stopped.set()
+
+    def _wait_until(self, t: float) -> bool:
+        # Moves the clock to t, through the wake times of its sleepers on the
+        # way so that they are woken in real time too
+        while True:
+            wake = self._clock.next_wake()
+            step = t if wake is None or wake > t else wake
+            if self._speed > 0:
+                real, simulated = self._anchor
+                delay = real + (step - simulated) / self._speed - time.monotonic()
+                if delay > 0 and self._stopped.wait(delay):
+                    return False
+            elif self._stopped.is_set():
+                return False
+            if (
+                self._batch
+                and self._batch_interval
+                and step >= self._batch_started + self._batch_interval
+            ):
+                self._flush()
+            self._clock.advance(step)
+            if step >= t:
+                return True
+
+    def _emit(self, t: float, stream: str, payload: dict):
+        if self._events:
+            message = parse_event(payload, stream)
+        else:
+            message = json.dumps({"stream": stream, "data": payload})
+        if self._batch is None:
+            self._on_message(message)
+            return
+        if len(self._batch) == 0:
+            self._batch_started = t
+        self._batch.append(message)
+        if self._batch_size and len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._on_message(batch)
+
+
+def _response(content: Any, http_code: int = 200) -> dict:
+    return {"http_code": http_code, "content": content}
+
+
+def _error(code: int, msg: str) -> dict:
+    return _response({"code": code, "msg": msg}, 400)
+
+
+def _buckets(open_times: np.ndarray, interval: str) -> np.ndarray:
+    # Open times of the klines of interval the given ones fall in, months
+    # have no fixed length
+    if interval == constants.KLINE_INTERVAL_MONTHS_1:
+        months = open_times.astype("datetime64[ms]").astype("datetime64[M]")
+        return months.astype("datetime64[ms]").astype(np.int64)
+    period = INTERVAL_MS[interval]
+    return open_times // period * period
+
+
+def _kline_array(columns: Dict[str, np.ndarray], interval: str) -> np.ndarray:
+    # Klines of KLINE_DTYPE from columns of some of its fields, sorted
+    klines = np.zeros(len(columns["open_time"]), dtype=KLINE_DTYPE)
+    for name in KLINE_DTYPE.names:
+        if name in columns:
+            klines[name] = columns[name]
+    if "close_time" not in columns:
+        klines["close_time"] = klines["open_time"] + INTERVAL_MS[interval] - 1
+    return np.sort(klines, order="open_time")
+
+
+class ReplayMarketData:
+    # The market data requests of the bots answered from the klines of a
+    # replay, as the REST API would have at the time of the clock: only the
+    # klines closed by then, aggregated to the interval asked for, and the
+    # 24h statistics of the day before. The exchange information is the one
+    # given, or the symbols of the klines without filters.
+    def __init__(
+        self,
+        clock: SimulatedClock,
+        klines: Dict[str, np.ndarray],
+        interval: str,
+        exchange_info: Optional[dict] = None,
+    ):
+        self._clock = clock
+        self._klines = klines
+        self._interval = interval
+        self._exchange_info = exchange_info
+
+    def exchange_information(self) -> dict:
+        if self._exchange_info is not None:
+            return _response(self._exchange_info)
+        symbols = [
+            {"symbol": symbol, "status": "TRADING", "filters": []}
+            for symbol in sorted(self._klines)
+        ]
+        return _response(
+            {
+                "timezone": "UTC",
+                "serverTime": self._clock.now_ms(),
+                "rateLimits": [],
+                "exchangeFilters": [],
+                "symbols": symbols,
+            }
+        )
+
+    def kline_candlestick_data(
+        self,
+        symbol: str,
+        interval: str,
+        start_time: Optional[int],
+        end_time: Optional[int],
+        limit: Optional[int],
+        as_array: bool = False,
+    ) -> dict:
+        if symbol not in self._klines:
+            return _error(-1121, "Invalid symbol.")
+        if interval != constants.KLINE_INTERVAL_MONTHS_1 and (
+            interval not in INTERVAL_MS
+            or INTERVAL_MS[interval] < INTERVAL_MS[self._interval]
+        ):
+            return _error(-1120, f"Only intervals of {self._interval} or more.")
+        klines = self._closed(symbol)
+        if interval != self._interval:
+            columns = {name: klines[name] for name in KLINE_DTYPE.names}
+            klines = aggregate(columns, _buckets(klines["open_time"], interval))
+        if start_time is not None:
+            klines = klines[klines["open_time"] >= start_time]
+        if end_time is not None:
+            klines = klines[klines["open_time"] <= end_time]
+        limit = min(limit or KLINES_LIMIT, KLINES_MAX_LIMIT)
+        klines = klines[:limit] if start_time is not None else klines[-limit:]
+        if as_array:
+            return _response(klines)
+        return _response(
+            [
+                [
+                    int(k["open_time"]),
+                    str(k["open"]),
+                    str(k["high"]),
+                    str(k["low"]),
+                    str(k["close"]),
+                    str(k["volume"]),
+                    int(k["close_time"]),
+                    str(k["quote_volume"]),
+                    int(k["trades"]),
+                    str(k["taker_buy_base_volume"]),
+                    str(k["taker_buy_quote_volume"]),
+                    "0",
+                ]
+                for k in klines
+            ]
+        )
+
+    def twentyfourhour_ticker_price_change_statistics(
+        self, symbol: Optional[str] = None
+    ) -> dict:
+        now = self._clock.now_ms()
+        statistics = []
+        for pair in sorted(self._klines) if symbol is None else [symbol]:
+            if pair not in self._klines:
+                return _error(-1121, "Invalid symbol.")
+            klines = self._closed(pair)
+            day = klines[klines["open_time"] >= now - DAY_MS]
+            if len(day) == 0 or day["open"][0] <= 0:
+                continue
+            first, last = float(day["open"][0]), float(day["close"][-1])
+            statistics.append(
+                {
+                    "symbol": pair,
+                    "priceChange": str(last - first),
+                    "priceChangePercent": str(round((last / first - 1) * 100, 3)),
+                    "openPrice": str(first),
+                    "lastPrice": str(last),
+                    "highPrice": str(day["high"].max()),
+                    "lowPrice": str(day["low"].min()),
+                    "volume": str(day["volume"].sum()),
+                    "quoteVolume": str(day["quote_volume"].sum()),
+                    "openTime": int(day["open_time"][0]),
+                    "closeTime": int(day["close_time"][-1]),
+                    "count": int(day["trades"].sum()),
+                }
+            )
+        if symbol is not None:
+            return _response(statistics[0] if statistics else {})
+        return _response(statistics)
+
+    def _closed(self, symbol: str) -> np.ndarray:
+        klines = self._klines[symbol]
+        return klines[: np.searchsorted(klines["close_time"], self._clock.now_ms())]
+
+
+class ReplaySpotAccountTrade:
+    # The account of a replay: the balances given, and test orders accepted
+    def __init__(self, balances: Dict[str, float]):
+        self._balances = balances
+
+    def account_information(self, recv_window: int = 5000) -> dict:
+        balances = [
+            {"asset": asset, "free": f"{free:.8f}", "locked": "0.00000000"}
+            for asset, free in self._balances.items()
+        ]
+        return _response({"balances": balances})
+
+    def test_new_order(self, symbol: str, side: str, order_type: str, **params):
+        return _response({})
+
+
+class ReplayWallet:
+    def __init__(self, symbols: List[str], fee: float):
+        self._symbols = symbols
+        self._fee = fee
+
+    def trade_fee(self, symbol: Optional[str] = None, recv_window: int = 5000):
+        fees = [
+            {"symbol": s, "maker": self._fee, "taker": self._fee}
+            for s in self._symbols
+            if symbol is None or s == symbol
+        ]
+        return _response({"tradeFee": fees, "success": True})
+
+
+class ReplayBinanceClient:
+    # Stands in for the BinanceClient of a bot to run it offline, see
+    # ReplayStreamClient: the REST requests the bots make are answered from
+    # the replay at the time of clock, the one of the replay too.
+    #
+    # klines are the ones of the symbols to trade, by symbol, e.g. read from
+    # a KlineStore or with csv_kline_columns, closed klines of interval. The
+    # targets of the bots are picked from them, as the 24h statistics of the
+    # REST API would pick them at the simulated time. balances are the free
+    # balances by asset, the exchange_info the response of
+    # exchange_information to use, e.g. a saved one with the rules of the
+    # assets in balances. Orders are not simulated, test orders are accepted.
+    def __init__(
+        self,
+        clock: SimulatedClock,
+        klines: Dict[str, Dict[str, np.ndarray]],
+        interval: str,
+        balances: Optional[Dict[str, float]] = None,
+        exchange_info: Optional[dict] = None,
+        fee: float = TRADE_FEE,
+    ):
+        arrays = {
+            symbol: _kline_array(columns, interval)
+            for symbol, columns in klines.items()
+        }
+        self.market_data = ReplayMarketData(clock, arrays, interval, exchange_info)
+        self.spot_account_trade = ReplaySpotAccountTrade(dict(balances or {}))
+        self.wallet = ReplayWallet(sorted(arrays), fee)
+
+    def asynchronous(self) -> "AsyncReplayBinanceClient":
+        return AsyncReplayBinanceClient(self)
+
+
+class _Coroutines:
+    # The methods of a client as coroutines
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self._client, name)
+
+        async def request(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return request
+
+
+class AsyncReplayBinanceClient:
+    # Stands in for an AsyncBinanceClient, with the requests of binance
+    def __init__(self, binance: ReplayBinanceClient):
+        self.market_data = _Coroutines(binance.market_data)
+        self.spot_account_trade = _Coroutines(binance.spot_account_trade)
+        self.wallet = _Coroutines(binance.wallet)
+
+    async def close(self):
+        pass
@@ -0,0 +1,82 @@
+import random
+import time
+from typing import Optional
+from . import constants
+
+# Statuses for which the request was surely not processed or the server is in
+# trouble: rate limited, banned, and the transient 5xx errors
+RETRYABLE_STATUSES = (418, 429, 500, 502, 503, 504)
+RATE_LIMIT_STATUSES = (418, 429)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 10,
+        deadline: float = 60,
+        attempt_timeout: float = 10,
+        retry_statuses: tuple = RETRYABLE_STATUSES,
+        retry_sent: bool = True,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline  # seconds for all the attempts together
+        self.attempt_timeout = attempt_timeout
+        self.retry_statuses = retry_statuses
+        # Whether to retry when the request reached the server but there is
+        # no response, i.e. it may or may not have been processed
+        self.retry_sent = retry_sent
+
+    def next_delay(
+        self, attempt: int, code: Optional[int] = None, sent: bool = True
+    ) -> Optional[float]:
+        # Returns the seconds to wait before the next attempt, or None to give up
+        if attempt >= self.max_attempts:
+            return None
+        if code is None:
+            if not sent:
+                return 0.0  # never reached the server, fail over right away
+            if not self.retry_sent:
+                return None
+            return self._backoff(attempt)
+        if code not in self.retry_statuses:
+            return None
+        if code in RATE_LIMIT_STATUSES:
+            return 0.0  # the rate limiter already waits for Retry-After
+        return self._backoff(attempt)
+
+    def timeout(self, deadline: float) -> float:
+        # Timeout of a single attempt, never past the overall deadline
+        return max(min(self.attempt_timeout, deadline - time.monotonic()), 0.1)
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+RETRY_POLICIES = {
+    constants.RETRY_POLICY_IDEMPOTENT: RetryPolicy(),
+    # Placing an order or a withdrawal twice is worse than not placing it: only
+    # requests that never reached the server are sent again
+    constants.RETRY_POLICY_NON_IDEMPOTENT: RetryPolicy(
+        max_attempts=3, deadline=10, retry_statuses=(), retry_sent=False
+    ),
+}
+
+
+def retry_policy(endpoint_config: dict) -> RetryPolicy:
+    # The "retry" entry of an endpoint is either a policy name or a RetryPolicy,
+    # without it only POST requests are considered non idempotent
+    policy = endpoint_config.get("retry")
+    if policy is None:
+        policy = (
+            constants.RETRY_POLICY_NON_IDEMPOTENT
+            if endpoint_config["method"] == "POST"
+            else constants.RETRY_POLICY_IDEMPOTENT
+        )
+    if isinstance(policy, RetryPolicy):
+        return policy
+    return RETRY_POLICIES[policy]
@@ -0,0 +1,96 @@
+import numpy as np
+from typing import Dict, List
+from .events import Trade
+
+DEFAULT_CAPACITY = 2**18
+
+TRADE_DTYPE = np.dtype(
+    [
+        ("time", "i8"),  # event time in ms
+        ("price", "f8"),
+        ("quantity", "f8"),
+        ("symbol", "i4"),  # index in symbols()
+    ]
+)
+
+
+class TradeRing:
+    # Fixed capacity buffer of trades for a single producer thread, e.g. the
+    # stream client, and a single consumer thread. Each side only writes its
+    # own counter, the producer head and the consumer tail, so no lock is
+    # needed: a slot is written before head moves past it and read before tail
+    # does. When full, new trades are dropped and counted in overflows.
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._buffer = np.zeros(capacity, dtype=TRADE_DTYPE)
+        self._capacity = capacity
+        self._head = 0  # trades pushed, written by the producer only
+        self._tail = 0  # trades drained, written by the consumer only
+        self._symbols: List[str] = []
+        self._symbol_ids: Dict[str, int] = {}
+        self.overflows = 0
+
+    def push(self, trade: Trade) -> bool:
+        if self._head - self._tail >= self._capacity:
+            self.overflows += 1
+            return False
+        self._buffer[self._head % self._capacity] = (
+            trade.event_time,
+            trade.price,
+            trade.quantity,
+            self._symbol_id(trade.symbol),
+        )
+        self._head += 1
+        return True
+
+    def push_many(self, trades: List[Trade]) -> int:
+        # Pushes a batch with a single copy, returns how many fit
+        count = min(len(trades), self._capacity - (self._head - self._tail))
+        self.overflows += len(trades) - count
+        if count == 0:
+            return 0
+        rows = np.array(
+            [
+                (t.event_time, t.price, t.quantity, self._symbol_id(t.symbol))
+                for t in trades[:count]
+            ],
+            dtype=TRADE_DTYPE,
+        )
+        start = self._head % self._capacity
+        first = min(count, self._capacity - start)
+        end = start + first
+        self._buffer[start:end] = rows[:first]
+        self._buffer[: count - first] = rows[first:]
+        self._head += count
+        return count
+
+    def drain(self, max_trades: int = 0) -> np.ndarray:
+        # Copies out and releases the trades pushed so far, all of them or up
+        # to max_trades, oldest first
+        head = self._head
+        count = head - self._tail
+        if max_trades > 0:
+            count = min(count, max_trades)
+        start = self._tail % self._capacity
+        end = start + count
+        if end <= self._capacity:
+            trades = self._buffer[start:end].copy()
+        else:
+            trades = np.concatenate(
+                [self._buffer[start:], self._buffer[: end - self._capacity]]
+            )
+        self._tail += count
+        return trades
+
+    def _symbol_id(self, symbol: str) -> int:
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self._symbol_ids[symbol] = len(self._symbols)
+            self._symbols.append(symbol)
+        return symbol_id
+
+    def symbols(self) -> List[str]:
+        # Names of the symbol ids of the drained trades
+        return list(self._symbols)
+
+    def __len__(self) -> int:
+        return self._head - self._tail
@@ -0,0 +1,141 @@
+import logging
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from . import constants
+from .klines import KLINE_DTYPE
+from .store import KlineStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Every level divides a day, so the buckets of any multiple of a level
+# counted from midnight are made of whole buckets of that level
+LEVELS = {
+    constants.KLINE_INTERVAL_MINUTES_1: 1,
+    constants.KLINE_INTERVAL_MINUTES_5: 5,
+    constants.KLINE_INTERVAL_MINUTES_15: 15,
+    constants.KLINE_INTERVAL_HOURS_1: 60,
+    constants.KLINE_INTERVAL_HOURS_4: 240,
+    constants.KLINE_INTERVAL_DAYS_1: 1440,
+}
+MINUTE = 60000
+
+
+def rollup(klines: Dict[str, np.ndarray], minutes: int) -> np.ndarray:
+    # Aggregates klines sorted by open time into buckets of the given minutes
+    # aligned to the epoch, each opening at the start of its bucket
+    period = minutes * MINUTE
+    return aggregate(klines, klines["open_time"] // period * period)
+
+
+def aggregate(klines: Dict[str, np.ndarray], buckets: np.ndarray) -> np.ndarray:
+    # Aggregates klines sorted by open time into the buckets given for their
+    # open times, e.g. the months they open in
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    rolled = np.empty(len(starts), dtype=[(c, KLINE_DTYPE[c]) for c in klines])
+    if len(starts) == 0:
+        return rolled
+    for column, values in klines.items():
+        if column == "open_time":
+            rolled[column] = buckets[starts]
+        elif column == "open":
+            rolled[column] = values[starts]
+        elif column in ("close", "close_time"):
+            rolled[column] = values[ends]
+        elif column == "high":
+            rolled[column] = np.maximum.reduceat(values, starts)
+        elif column == "low":
+            rolled[column] = np.minimum.reduceat(values, starts)
+        else:  # volumes and trades
+            rolled[column] = np.add.reduceat(values, starts)
+    return rolled
+
+
+class RollupPyramid:
+    # Klines at several resolutions, a KlineStore per level in
+    # root/<interval>, the layout HistoryDownloader(columnar=True) writes. The
+    # finest level with data is the base, each coarser level is aggregated from
+    # the previous one and updated incrementally from its last bucket on.
+    def __init__(self, root: str):
+        self._root = root
+        self._stores: Dict[str, KlineStore] = {}
+
+    @staticmethod
+    def is_pyramid(path: str) -> bool:
+        return any(KlineStore.is_store(os.path.join(path, level)) for level in LEVELS)
+
+    def store(self, level: str) -> KlineStore:
+        if level not in self._stores:
+            self._stores[level] = KlineStore(
+                os.path.join(self._root, level), LEVELS[level] * MINUTE
+            )
+        return self._stores[level]
+
+    def levels(self) -> List[str]:
+        # Levels with data, finest first
+        return [
+            level
+            for level in LEVELS
+            if KlineStore.is_store(os.path.join(self._root, level))
+        ]
+
+    def symbols(self) -> List[str]:
+        levels = self.levels()
+        return self.store(levels[0]).symbols() if len(levels) > 0 else []
+
+    def update(self, symbols: Optional[List[str]] = None):
+        levels = self.levels()
+        if len(levels) == 0:
+            return
+        base = levels[0]
+        coarser = [level for level in LEVELS if LEVELS[level] > LEVELS[base]]
+        if symbols is None:
+            symbols = self.store(base).symbols()
+        for symbol in symbols:
+            source = base
+            for level in coarser:
+                self._update_level(symbol, source, level)
+                source = level
+
+    def level_for(self, minutes: int) -> Optional[str]:
+        # Coarsest level with data that buckets of the given minutes are made of
+        candidates = [level for level in self.levels() if minutes % LEVELS[level] == 0]
+        return candidates[-1] if len(candidates) > 0 else None
+
+    def read(
+        self,
+        symbol: str,
+        minutes: int,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+    ) -> Dict[str, np.ndarray]:
+        # Klines of the coarsest level that can be aggregated into buckets of
+        # the given minutes
+        level = self.level_for(minutes)
+        if level is None:
+            raise ValueError(f"No level divides {minutes} minutes")
+        return self.store(level).read(symbol, start, end, columns)
+
+    def ranges(self, symbol: str, minutes: int) -> List[Tuple[int, int]]:
+        # Ranges without missing klines at the level read serves, a bucket
+        # counts as present when any of the klines it aggregates is
+        level = self.level_for(minutes)
+        if level is None:
+            raise ValueError(f"No level divides {minutes} minutes")
+        return self.store(level).ranges(symbol)
+
+    def _update_level(self, symbol: str, source: str, level: str):
+        partitions = self.store(level).partitions(symbol).values()
+        # The last bucket may have been incomplete, it is aggregated again
+        start = max((p["last_open_time"] for p in partitions), default=None)
+        klines = self.store(source).read(symbol, start=start)
+        if len(klines["open_time"]) == 0:
+            return
+        rolled = rollup(klines, LEVELS[level])
+        self.store(level).write(symbol, rolled)
+        logger.debug(
+            f"Rolled {len(rolled)} {level} klines of {symbol} up from {source}"
+        )
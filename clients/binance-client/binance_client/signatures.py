@@ -1,8 +1,29 @@
 import hmac
 import hashlib
+from urllib.parse import urlencode
 
 
 def sign(secret_key: str, total_params: str) -> str:
     return hmac.new(
         secret_key.encode("utf-8"), total_params.encode("utf-8"), hashlib.sha256
     ).hexdigest()
+
+
+class Signer:
+    # The HMAC is keyed once, every signature is computed on a copy of the
+    # keyed state instead of hashing the secret again
+    def __init__(self, secret_key: str):
+        self._keyed = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha256)
+
+    def sign(self, total_params: str) -> str:
+        mac = self._keyed.copy()
+        mac.update(total_params.encode("utf-8"))
+        return mac.hexdigest()
+
+    def signed_query(self, params: dict) -> str:
+        # Encodes the params the way requests does, None values are dropped,
+        # and appends their signature. The result is sent as is.
+        query = urlencode(
+            [(k, v) for k, v in params.items() if v is not None], doseq=True
+        )
+        return f"{query}&signature={self.sign(query)}"
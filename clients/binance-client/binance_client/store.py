@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .coverage import Coverage
+from .klines import KLINE_DTYPE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+INDEX_FILE = "index.json"
+
+
+def month_of(open_times: np.ndarray) -> np.ndarray:
+    return open_times.astype("datetime64[ms]").astype("datetime64[M]")
+
+
+class KlineStore:
+    # Klines of one interval stored by column, one .npy file per field,
+    # partitioned by symbol and month: root/SYMBOL/YYYY-MM.N/field.npy
+    # Columns are memory mapped when read, so only the partitions and the
+    # columns asked for are touched. index.json keeps the rows and the first
+    # and last open times of every partition, and which version N of the
+    # partition is current: a partition is rewritten into a new version and
+    # the index is replaced afterwards, so readers never see a partial write.
+    #
+    # The index also keeps the Coverage of every symbol, updated on each write,
+    # so that gaps are found without reading the klines. It needs the period of
+    # the klines in ms, when not given it is the shortest step between the open
+    # times of the first write.
+    def __init__(self, root: str, period: Optional[int] = None):
+        self._root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._index = self._read_index()
+        if period is not None:
+            self._index["period"] = period
+
+    @staticmethod
+    def is_store(path: str) -> bool:
+        return os.path.exists(os.path.join(path, INDEX_FILE))
+
+    def symbols(self) -> List[str]:
+        return sorted(self._index["symbols"])
+
+    def partitions(self, symbol: str) -> Dict[str, dict]:
+        # month -> {"rows", "first_open_time", "last_open_time", "version"}
+        return dict(self._index["symbols"].get(symbol, {}))
+
+    def columns(self) -> List[str]:
+        return list(self._index["columns"])
+
+    def period(self) -> Optional[int]:
+        return self._index.get("period")
+
+    def coverage(self, symbol: str) -> Optional[Coverage]:
+        # None while the period of the klines is unknown
+        with self._lock:
+            coverage = self._coverage(symbol)
+        if coverage is None:
+            return None
+        return Coverage.from_dict(coverage.period, coverage.to_dict())
+
+    def ranges(self, symbol: str) -> List[Tuple[int, int]]:
+        # [start, end) ranges of open times without missing klines
+        coverage = self.coverage(symbol)
+        if coverage is not None:
+            return [(start, end) for start, end in coverage.ranges]
+        partitions = self.partitions(symbol).values()
+        if len(partitions) == 0:
+            return []
+        # A single kline so far
+        return [
+            (
+                min(p["first_open_time"] for p in partitions),
+                max(p["last_open_time"] for p in partitions) + 1,
+            )
+        ]
+
+    def gaps(
+        self, symbol: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        # [start, end) ranges of open times missing and not checked, see Coverage
+        coverage = self.coverage(symbol)
+        if coverage is None:
+            raise ValueError(f"The period of the klines in {self._root} is unknown")
+        return coverage.gaps(start, end)
+
+    def check(self, symbol: str, start: int, end: int):
+        # Records that there are no klines in [start, end) besides the stored ones
+        with self._lock:
+            coverage = self._coverage(symbol)
+            if coverage is None:
+                raise ValueError(f"The period of the klines in {self._root} is unknown")
+            coverage.check(start, end)
+            self._index["coverage"][symbol] = coverage.to_dict()
+            self._write_index()
+
+    def write(self, symbol: str, klines: np.ndarray):
+        # Merges the klines, a structured array with an open_time field, into
+        # their partitions. Klines already stored are replaced.
+        if len(klines) == 0:
+            return
+        with self._lock:
+            columns = self._index["columns"] or list(klines.dtype.names)
+            if list(klines.dtype.names) != columns:
+                raise ValueError(f"Expected klines with fields {columns}")
+            self._index["columns"] = columns
+            if self._index.get("period") is None and len(klines) > 1:
+                steps = np.diff(np.unique(klines["open_time"]))
+                self._index["period"] = int(steps.min()) if len(steps) > 0 else None
+            coverage = self._coverage(symbol)
+            partitions = self._index["symbols"].setdefault(symbol, {})
+            months = month_of(klines["open_time"])
+            replaced = []
+            for month in np.unique(months):
+                key = str(month)
+                merged = self._merge(
+                    symbol, key, partitions.get(key), klines[months == month]
+                )
+                version = partitions[key]["version"] + 1 if key in partitions else 0
+                self._write_partition(symbol, key, version, merged)
+                if key in partitions:
+                    replaced.append(self._partition_dir(symbol, key, partitions[key]))
+                partitions[key] = {
+                    "rows": len(merged),
+                    "first_open_time": int(merged["open_time"][0]),
+                    "last_open_time": int(merged["open_time"][-1]),
+                    "version": version,
+                }
+            if coverage is not None:
+                duplicates = coverage.add(klines["open_time"])
+                if duplicates > 0:
+                    logger.debug(f"Rewrote {duplicates} klines of {symbol}")
+                self._index["coverage"][symbol] = coverage.to_dict()
+            self._write_index()
+            for path in replaced:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def read(
+        self,
+        symbol: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+    ) -> Dict[str, np.ndarray]:
+        # Columns of the klines with start <= open_time < end. Reading a single
+        # partition returns read only memory mapped arrays without copying.
+        columns = columns or self.columns()
+        chunks = {column: [] for column in columns}
+        for month, partition in sorted(self.partitions(symbol).items()):
+            if start is not None and partition["last_open_time"] < start:
+                continue
+            if end is not None and partition["first_open_time"] >= end:
+                continue
+            path = self._partition_dir(symbol, month, partition)
+            open_times = self._load(path, "open_time")
+            first = 0 if start is None else np.searchsorted(open_times, start)
+            last = len(open_times) if end is None else np.searchsorted(open_times, end)
+            for column in columns:
+                chunks[column].append(self._load(path, column)[first:last])
+        return {
+            column: self._concatenate(column, arrays)
+            for column, arrays in chunks.items()
+        }
+
+    def _coverage(self, symbol: str) -> Optional[Coverage]:
+        # Stores written before the coverage existed are covered from the open
+        # times of their partitions the first time
+        period = self._index.get("period")
+        if period is None:
+            return None
+        coverages = self._index.setdefault("coverage", {})
+        if symbol in coverages:
+            return Coverage.from_dict(period, coverages[symbol])
+        coverage = Coverage(period)
+        for month, partition in sorted(self._index["symbols"].get(symbol, {}).items()):
+            path = self._partition_dir(symbol, month, partition)
+            coverage.add(self._load(path, "open_time"))
+        return coverage
+
+    def _concatenate(self, column: str, arrays: List[np.ndarray]) -> np.ndarray:
+        if len(arrays) == 0:
+            return np.empty(0, dtype=KLINE_DTYPE[column])
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays)
+
+    def _merge(
+        self, symbol: str, month: str, partition: Optional[dict], klines: np.ndarray
+    ) -> np.ndarray:
+        if partition is not None:
+            path = self._partition_dir(symbol, month, partition)
+            stored = np.empty(partition["rows"], dtype=klines.dtype)
+            for column in klines.dtype.names:
+                stored[column] = self._load(path, column)
+            klines = np.concatenate([stored, klines])
+        # Sorted by open time, the last written kline wins
+        reverse = klines[::-1]
+        _, first = np.unique(reverse["open_time"], return_index=True)
+        return reverse[first]
+
+    def _partition_dir(self, symbol: str, month: str, partition: dict) -> str:
+        return os.path.join(self._root, symbol, f"{month}.{partition['version']}")
+
+    def _write_partition(
+        self, symbol: str, month: str, version: int, klines: np.ndarray
+    ):
+        path = self._partition_dir(symbol, month, {"version": version})
+        os.makedirs(path, exist_ok=True)
+        for column in klines.dtype.names:
+            np.save(
+                os.path.join(path, f"{column}.npy"),
+                np.ascontiguousarray(klines[column]),
+            )
+
+    def _load(self, path: str, column: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self._root, INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"columns": [], "symbols": {}}
+
+    def _write_index(self):
+        path = os.path.join(self._root, INDEX_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self._index, f)
+        os.replace(f"{path}.tmp", path)
@@ -1,69 +1,566 @@
 import asyncio
+import orjson
+import random
+import time
 import websockets
 import threading
 
-# import orjson as json
-import json
-from typing import List, Callable, Any
+from typing import Dict, List, Callable, Any, Optional, Set, Tuple
+from .client import MarketDataClient
 from .constants import WEBSOCKET_BASE_ENDPOINT, WEBSOCKET_BASE_TEST_ENDPOINT
+from .events import parse_event
+from .recorder import StreamRecorder
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+_END = object()  # queued once the connection is closed for good
 
-class BinanceStreamClient(threading.Thread):
+# Binance drops connections sending more than 5 messages per second
+CONTROL_MESSAGES_PER_SECOND = 5
+ACK_TIMEOUT = 10  # seconds to wait for the response to a request
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# Binance closes connections after 24 hours, they are renewed before
+CONNECTION_LIFETIME = 23 * 3600
+TRADES_PER_LOOKUP = 1000  # maximum allowed by the API
+MAX_LOOKUPS = 10  # per gap, older missing trades are given up
+
+
+class AsyncStreamClient:
+    # Keeps a single connection open for its whole life. The streams are
+    # changed with set_streams, which sends SUBSCRIBE and UNSUBSCRIBE requests
+    # for the difference with the current ones instead of reconnecting, so the
+    # streams kept are never interrupted. The requests are tracked by id until
+    # Binance responds, a request without response is sent again.
+    #
+    # A lost connection is opened again with backoff and the streams are
+    # subscribed again, connections are also renewed before Binance closes
+    # them. With market_data, the trades missed meanwhile are found from the
+    # trade ids and looked up through the REST API, then passed to on_message
+    # as trade stream messages before the newer ones.
+    #
+    # Messages come as in combined streams, {"stream": name, "data": payload},
+    # whatever the number of streams. With events, on_message receives the
+    # payloads as records instead, see events.py, decoded once here.
+    #
+    # With batch_size or batch_interval, on_message receives lists of messages
+    # instead, once batch_size messages are ready or batch_interval seconds
+    # after the first one, whichever comes first.
+    #
+    # With a recorder, the trades passed to on_message are also recorded, see
+    # StreamRecorder. It is flushed when a connection ends and closed by its
+    # owner.
+    #
+    # Runs on the event loop of the caller. Without on_message, the messages
+    # are iterated instead, until stopped:
+    #
+    #     async with AsyncStreamClient(streams, events=True) as stream:
+    #         async for event in stream:
+    #             ...
+    #
+    # Iterating also connects, without async with the iteration only ends
+    # once stop is called. See BinanceStreamClient to run it in a thread.
     def __init__(
         self,
         streams: List[str],
-        on_message: Callable[[Any], Any],
+        on_message: Optional[Callable[[Any], Any]] = None,
         test_net: bool = False,
+        base_endpoint: Optional[str] = None,
+        market_data: Optional[MarketDataClient] = None,
+        events: bool = False,
+        batch_size: int = 0,
+        batch_interval: float = 0,
+        recorder: Optional[StreamRecorder] = None,
     ):
-        threading.Thread.__init__(self)
         self._test_net = test_net
-        self._streams = streams
+        self._base_endpoint = base_endpoint
+        self._market_data = market_data
+        self._events = events
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._batch: Optional[list] = [] if batch_size or batch_interval else None
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._recorder = recorder
+        self._streams = set(streams)  # the ones wanted
+        self._subscribed: Set[str] = set()
+        self._pending: Dict[int, Tuple[str, List[str], float]] = {}
+        self._next_id = 1
+        self._last_request = 0.0
+        self._lock = threading.Lock()
         self._on_message = on_message
+        self._queue: Optional[asyncio.Queue] = None
+        if on_message is None:
+            self._queue = asyncio.Queue()
+        self._task: Optional[asyncio.Future] = None
         self._should_terminate = False
-        self._event_loop = asyncio.new_event_loop()
+        self._renewing = False
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ws = None
+        self._changed: Optional[asyncio.Event] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._closing: Optional[asyncio.Future] = None
+        # symbol -> (id, time) of the last trade passed to on_message
+        self._last_trades: Dict[str, Tuple[int, int]] = {}
+        # symbol -> (stream, payload, message) received while looking up a gap
+        self._backfilling: Dict[str, List[Tuple[str, dict, Any]]] = {}
+        self._backfills: Set[asyncio.Future] = set()
+
+    async def connect_forever(self):
+        self._event_loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        attempt = 0
+        while not self._should_terminate:
+            connected = time.monotonic()
+            try:
+                await self.connect_and_subscribe()
+            except Exception as e:
+                logger.error(f"Error when connecting to streams: {e}")
+            if self._should_terminate:
+                break
+            if self._renewing:
+                self._renewing = False
+                continue
+            # A connection that lasted resets the backoff
+            if time.monotonic() - connected > RECONNECT_MAX_DELAY:
+                attempt = 0
+            attempt += 1
+            delay = random.uniform(
+                0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2**attempt)
+            )
+            logger.info(f"Reconnecting to streams in {delay:.1f} seconds")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        for backfill in self._backfills:
+            backfill.cancel()
+        await asyncio.gather(*self._backfills, return_exceptions=True)
+        self._flush()
+        if self._recorder is not None:
+            self._recorder.flush()
+        if self._queue is not None:
+            self._queue.put_nowait(_END)
 
     async def connect_and_subscribe(self):
-        async with websockets.connect(self._build_connection_string(), ssl=True) as ws:
-            await ws.send(self._build_subscription_string())
-            while not self._should_terminate:
-                try:
-                    something = await ws.recv()
-                    self._on_message(something)
-                except Exception as e:
-                    logger.error(f"Error when subscribing to streams: {e}")
-                    self._should_terminate = True
-            await ws.send(self._build_unsubscription_string())
-            self.stop()
+        async with websockets.connect(self._build_connection_string()) as ws:
+            self._ws = ws
+            self._changed = asyncio.Event()
+            with self._lock:
+                self._subscribed = set()
+            self._pending = {}
+            if self._should_terminate:  # stopped while connecting
+                self._start_closing()
+            renewal = self._event_loop.call_later(CONNECTION_LIFETIME, self._renew)
+            await self._send_request("SET_PROPERTY", ["combined", True])
+            sender = asyncio.ensure_future(self._send_changes())
+            try:
+                # Received until closed, also while closing so that the close
+                # handshake is not stuck behind unread messages
+                while True:
+                    try:
+                        something = await ws.recv()
+                    except Exception as e:
+                        if not self._should_terminate and not self._renewing:
+                            logger.error(f"Error when receiving from streams: {e}")
+                        break
+                    if self._should_terminate:
+                        continue
+                    self._handle_message(something)
+            finally:
+                renewal.cancel()
+                sender.cancel()
+                self._flush()
+                if self._recorder is not None:
+                    self._recorder.flush()
+                await asyncio.gather(sender, return_exceptions=True)
+                if self._closing is not None:
+                    await asyncio.gather(self._closing, return_exceptions=True)
+                    self._closing = None
+                self._ws = None
 
-    def run(self):
-        self._event_loop.run_until_complete(self.connect_and_subscribe())
+    async def __aenter__(self) -> "AsyncStreamClient":
+        self._start()
+        return self
+
+    async def __aexit__(self, *args):
+        self.stop()
+        await self._task
+
+    def __aiter__(self) -> "AsyncStreamClient":
+        if self._queue is None:
+            raise TypeError("Messages are passed to on_message")
+        self._start()
+        return self
+
+    async def __anext__(self) -> Any:
+        message = await self._queue.get()
+        if message is _END:
+            self._queue.put_nowait(_END)  # for any other iteration
+            raise StopAsyncIteration
+        return message
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.connect_forever())
+
+    def set_streams(self, streams: List[str]):
+        # Thread safe, the streams are changed once Binance acknowledges it
+        with self._lock:
+            self._streams = set(streams)
+        self._notify_change()
+
+    def subscribe(self, streams: List[str]):
+        with self._lock:
+            self._streams |= set(streams)
+        self._notify_change()
+
+    def unsubscribe(self, streams: List[str]):
+        with self._lock:
+            self._streams -= set(streams)
+        self._notify_change()
+
+    def subscriptions(self) -> List[str]:
+        # Streams acknowledged by Binance
+        with self._lock:
+            return sorted(self._subscribed)
+
+    def _notify_change(self):
+        if self._changed is not None and self._event_loop.is_running():
+            self._event_loop.call_soon_threadsafe(self._changed.set)
+
+    async def _send_changes(self):
+        self._changed.set()  # the initial streams
+        while True:
+            # Not wait_for, which can swallow the cancellation when closing
+            expiry = self._event_loop.call_later(ACK_TIMEOUT, self._changed.set)
+            try:
+                await self._changed.wait()
+            finally:
+                expiry.cancel()
+            self._changed.clear()
+            self._expire_requests()
+            subscribe, unsubscribe = self._diff()
+            if len(unsubscribe) > 0:
+                await self._send_request("UNSUBSCRIBE", unsubscribe)
+            if len(subscribe) > 0:
+                await self._send_request("SUBSCRIBE", subscribe)
+
+    def _diff(self) -> Tuple[List[str], List[str]]:
+        # Streams to subscribe and unsubscribe, besides the ones requested
+        # already. Requests are answered in order, so a stream both subscribed
+        # and unsubscribed while a request is pending ends up as wanted.
+        with self._lock:
+            wanted = set(self._streams)
+            subscribed = set(self._subscribed)
+        pending = {"SUBSCRIBE": set(), "UNSUBSCRIBE": set()}
+        for method, params, _ in self._pending.values():
+            if method in pending:
+                pending[method] |= set(params)
+        subscribing = (subscribed | pending["SUBSCRIBE"]) - pending["UNSUBSCRIBE"]
+        return sorted(wanted - subscribing), sorted(subscribing - wanted)
+
+    def _expire_requests(self):
+        now = time.monotonic()
+        for request_id, (method, params, sent) in list(self._pending.items()):
+            if now - sent > ACK_TIMEOUT:
+                logger.warning(f"No response to {method} {params}, sending again")
+                del self._pending[request_id]
+
+    async def _send_request(self, method: str, params: list):
+        wait = self._last_request + 1 / CONTROL_MESSAGES_PER_SECOND - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        request_id = self._next_id
+        self._next_id += 1
+        self._pending[request_id] = (method, params, time.monotonic())
+        self._last_request = time.monotonic()
+        logger.info(f"Sending {method} {params}")
+        await self._ws.send(
+            orjson.dumps(
+                {"method": method, "params": params, "id": request_id}
+            ).decode()
+        )
+
+    def _handle_message(self, msg):
+        # Decoded only when needed: for the responses, the records, to look up
+        # missed trades and to record them
+        raw = not self._events and self._market_data is None and self._recorder is None
+        if raw and msg.startswith('{"stream"'):
+            self._output(msg)
+            return
+        try:
+            m = orjson.loads(msg)
+        except ValueError as e:
+            logger.error(f"Error when decoding {msg} - {e}")
+            return
+        if isinstance(m, dict) and "id" in m and ("result" in m or "error" in m):
+            self._handle_response(m)
+            return
+        stream = m.get("stream") if isinstance(m, dict) else None
+        payload = m["data"] if stream is not None else m
+        if (
+            self._market_data is not None
+            and isinstance(payload, dict)
+            and payload.get("e") == "trade"
+        ):
+            self._handle_trade(stream, payload, msg)
+            return
+        self._emit(stream, payload, msg)
+
+    def _handle_response(self, m: dict):
+        request = self._pending.pop(m["id"], None)
+        if request is None:
+            return  # expired, sent again already
+        method, params, _ = request
+        if "error" in m:
+            logger.error(f"{method} {params} failed: {m['error']}")
+            if method == "SUBSCRIBE":
+                with self._lock:
+                    self._streams -= set(params)  # not retried
+            return
+        with self._lock:
+            if method == "SUBSCRIBE":
+                self._subscribed |= set(params)
+            elif method == "UNSUBSCRIBE":
+                self._subscribed -= set(params)
+        if method == "UNSUBSCRIBE":
+            # Trades missed while not subscribed are not looked up
+            for stream in params:
+                if stream.endswith("@trade"):
+                    self._last_trades.pop(stream.split("@")[0].upper(), None)
+        self._changed.set()
+
+    def _emit(self, stream: Optional[str], payload: Any, msg=None):
+        if self._recorder is not None and isinstance(payload, dict):
+            self._recorder.record(payload)
+        if self._events:
+            self._output(parse_event(payload, stream))
+        elif msg is not None:
+            self._output(msg)
+        else:
+            self._output(orjson.dumps({"stream": stream, "data": payload}).decode())
+
+    def _output(self, message):
+        if self._batch is None:
+            self._pass(message)
+            return
+        self._batch.append(message)
+        if self._batch_size and len(self._batch) >= self._batch_size:
+            self._flush()
+        elif self._batch_interval and self._flush_timer is None:
+            self._flush_timer = self._event_loop.call_later(
+                self._batch_interval, self._flush
+            )
+
+    def _flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._pass(batch)
+
+    def _pass(self, message):
+        if self._on_message is not None:
+            self._on_message(message)
+        else:
+            self._queue.put_nowait(message)
+
+    def _handle_trade(self, stream: Optional[str], trade: dict, msg):
+        symbol = trade["s"]
+        if symbol in self._backfilling:
+            self._backfilling[symbol].append((stream, trade, msg))
+            return
+        last = self._last_trades.get(symbol)
+        if last is not None and trade["t"] > last[0] + 1:
+            logger.warning(f"Missed {symbol} trades {last[0] + 1} to {trade['t'] - 1}")
+            self._backfilling[symbol] = [(stream, trade, msg)]
+            backfill = asyncio.ensure_future(self._backfill(symbol, last, trade["t"]))
+            self._backfills.add(backfill)
+            backfill.add_done_callback(self._backfills.discard)
+            return
+        self._deliver(stream, trade, msg)
+
+    def _deliver(self, stream: Optional[str], trade: dict, msg=None):
+        last = self._last_trades.get(trade["s"])
+        if last is not None and trade["t"] <= last[0]:
+            return  # passed already, e.g. both looked up and received
+        self._last_trades[trade["s"]] = (trade["t"], trade["T"])
+        self._emit(stream, trade, msg)
+
+    async def _backfill(self, symbol: str, last: Tuple[int, int], until_id: int):
+        try:
+            trades = await self._event_loop.run_in_executor(
+                None, self._lookup_trades, symbol, last, until_id
+            )
+        except Exception as e:
+            logger.error(f"Error when looking up {symbol} trades: {e}")
+            trades = []
+        logger.info(f"Looked up {len(trades)} missed {symbol} trades")
+        stream = f"{symbol.lower()}@trade"
+        for trade in trades:
+            self._deliver(stream, trade)
+        for stream, trade, msg in self._backfilling.pop(symbol):
+            self._deliver(stream, trade, msg)
+
+    def _lookup_trades(
+        self, symbol: str, last: Tuple[int, int], until_id: int
+    ) -> List[dict]:
+        # Trades after last and before until_id as trade stream payloads. The
+        # historical trades need an API key, without it the aggregate trades
+        # are used, a trade per aggregate with the id of its last trade.
+        trades = []
+        from_id = last[0] + 1
+        for _ in range(MAX_LOOKUPS):
+            if from_id >= until_id:
+                return trades
+            r = self._market_data.old_trade_lookup(
+                symbol=symbol, limit=TRADES_PER_LOOKUP, from_id=from_id
+            )
+            if r["http_code"] != 200:
+                logger.warning(f"Historical trades unavailable: {r['content']}")
+                return trades + self._lookup_aggregate_trades(
+                    symbol, from_id, last[1], until_id
+                )
+            page = [t for t in r["content"] if t["id"] < until_id]
+            trades.extend(
+                {
+                    "e": "trade",
+                    "E": t["time"],
+                    "s": symbol,
+                    "t": t["id"],
+                    "p": t["price"],
+                    "q": t["qty"],
+                    "T": t["time"],
+                    "m": t["isBuyerMaker"],
+                    "M": t["isBestMatch"],
+                }
+                for t in page
+            )
+            if len(page) < TRADES_PER_LOOKUP:
+                return trades
+            from_id = page[-1]["id"] + 1
+        logger.warning(f"Gave up on {symbol} trades from {from_id} to {until_id}")
+        return trades
+
+    def _lookup_aggregate_trades(
+        self, symbol: str, from_id: int, start_time: int, until_id: int
+    ) -> List[dict]:
+        trades = []
+        params = {"start_time": start_time}
+        for _ in range(MAX_LOOKUPS):
+            r = self._market_data.compressed_aggregate_trades_list(
+                symbol=symbol, limit=TRADES_PER_LOOKUP, **params
+            )
+            if r["http_code"] != 200 or len(r["content"]) == 0:
+                return trades
+            for a in r["content"]:
+                if a["f"] >= until_id:
+                    return trades
+                if a["l"] >= from_id and a["l"] < until_id:
+                    trades.append(
+                        {
+                            "e": "trade",
+                            "E": a["T"],
+                            "s": symbol,
+                            "t": a["l"],
+                            "p": a["p"],
+                            "q": a["q"],
+                            "T": a["T"],
+                            "m": a["m"],
+                            "M": a["M"],
+                        }
+                    )
+            params = {"from_id": r["content"][-1]["a"] + 1}
+        return trades
 
     def _build_connection_string(self):
-        logger.info(f"Subscribing to streams {self._streams}")
-        base = (
+        logger.info(f"Subscribing to streams {sorted(self._streams)}")
+        base = self._base_endpoint or (
             WEBSOCKET_BASE_ENDPOINT
             if not self._test_net
             else WEBSOCKET_BASE_TEST_ENDPOINT
         )
-        if len(self._streams) == 1:
-            con_string = f"{base}/ws/{self._streams[0]}"
-        else:
-            con_string = f"{base}/stream?streams={'/'.join(self._streams)}"
-        return con_string
+        return f"{base}/ws"
 
-    def _build_unsubscription_string(self):
-        return json.dumps({"method": "UNSUBSCRIBE", "params": self._streams, "id": 1})
+    async def _close(self):
+        with self._lock:
+            subscribed = sorted(self._subscribed)
+        try:
+            if len(subscribed) > 0 and not self._renewing:
+                await self._send_request("UNSUBSCRIBE", subscribed)
+        finally:
+            await self._ws.close()
 
-    def _build_subscription_string(self):
-        return json.dumps({"method": "SUBSCRIBE", "params": self._streams, "id": 1})
+    def _renew(self):
+        logger.info("Renewing the streams connection")
+        self._renewing = True
+        self._start_closing()
 
     def stop(self):
         logger.info("Shutting down streams client...")
         self._should_terminate = True
+        if self._event_loop is not None and self._event_loop.is_running():
+            self._event_loop.call_soon_threadsafe(self._start_closing)
+
+    def _start_closing(self):
+        if self._stopped is not None and self._should_terminate:
+            self._stopped.set()
+        if self._ws is not None and self._closing is None:
+            self._closing = asyncio.ensure_future(self._close())
+
+
+class BinanceStreamClient(threading.Thread):
+    # An AsyncStreamClient on an event loop of its own in a thread, passing
+    # the messages to on_message there. Its methods are thread safe.
+    def __init__(
+        self,
+        streams: List[str],
+        on_message: Callable[[Any], Any],
+        test_net: bool = False,
+        base_endpoint: Optional[str] = None,
+        market_data: Optional[MarketDataClient] = None,
+        events: bool = False,
+        batch_size: int = 0,
+        batch_interval: float = 0,
+        recorder: Optional[StreamRecorder] = None,
+    ):
+        threading.Thread.__init__(self)
+        self._event_loop = asyncio.new_event_loop()
+        self._client = AsyncStreamClient(
+            streams,
+            on_message,
+            test_net=test_net,
+            base_endpoint=base_endpoint,
+            market_data=market_data,
+            events=events,
+            batch_size=batch_size,
+            batch_interval=batch_interval,
+            recorder=recorder,
+        )
+
+    def run(self):
+        try:
+            self._event_loop.run_until_complete(self._client.connect_forever())
+        finally:
+            self._event_loop.close()
+
+    def set_streams(self, streams: List[str]):
+        self._client.set_streams(streams)
+
+    def subscribe(self, streams: List[str]):
+        self._client.subscribe(streams)
+
+    def unsubscribe(self, streams: List[str]):
+        self._client.unsubscribe(streams)
+
+    def subscriptions(self) -> List[str]:
+        return self._client.subscriptions()
+
+    def stop(self):
+        self._client.stop()
 
 
 def something(msg):
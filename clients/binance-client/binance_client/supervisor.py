@@ -0,0 +1,328 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, List, Optional
+from .client import MarketDataClient
+from .recorder import DEFAULT_MAX_BYTES, StreamRecorder
+from .stream import BinanceStreamClient
+from .transport import Transport
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MAX_STREAMS_PER_CONNECTION = 1024  # limit of Binance
+DEFAULT_STREAMS_PER_SHARD = 200
+DELIVERY_POLL = 0.5  # seconds between checks that the shards are still running
+
+
+def run_shard(
+    streams: List[str],
+    events: Connection,
+    control: Connection,
+    test_net: bool,
+    base_endpoint: Optional[str],
+    keys_file: Optional[str],
+    batch_size: int,
+    batch_interval: float,
+    record_directory: Optional[str],
+    record_max_bytes: Optional[int],
+):
+    # Body of a worker process: a BinanceStreamClient sending its records
+    # through events, changed by the commands received on control
+    market_data = None
+    if keys_file is not None:
+        market_data = MarketDataClient(Transport(keys_file, test_net))
+    recorder = None
+    if record_directory is not None:
+        recorder = StreamRecorder(record_directory, max_bytes=record_max_bytes)
+    client = BinanceStreamClient(
+        streams,
+        events.send,
+        test_net=test_net,
+        base_endpoint=base_endpoint,
+        market_data=market_data,
+        events=True,
+        batch_size=batch_size,
+        batch_interval=batch_interval,
+        recorder=recorder,
+    )
+    client.start()
+    try:
+        while True:
+            command, argument = control.recv()
+            if command == "stop":
+                break
+            if command == "max_bytes":
+                if recorder is not None:
+                    recorder.set_max_bytes(argument)
+                continue
+            client.set_streams(argument)
+    except EOFError:
+        pass  # the supervisor is gone
+    finally:
+        client.stop()
+        client.join()
+        if recorder is not None:
+            recorder.close()
+        events.close()
+
+
+class StreamSupervisor:
+    # Spreads streams over several connections, each one a BinanceStreamClient,
+    # so that the number of streams is not bound by the limit per connection.
+    # Without a number of shards, there is one per streams_per_shard streams,
+    # and set_streams adds shards when the streams outgrow them, shards are
+    # never removed. A stream goes to the same shard as long as the number of
+    # shards does not change, set_streams only changes the subscriptions of
+    # the shards whose streams changed.
+    #
+    # on_message receives the payloads as records, see events.py, always from
+    # the same thread, so it can feed a single producer buffer such as a
+    # TradeRing whatever the number of shards. Without processes, the shards
+    # queue their records for that thread. With processes, every shard runs in
+    # a worker process that receives and decodes its messages, and sends the
+    # records to that thread through a pipe, so the connections do not compete
+    # for the GIL with the caller.
+    #
+    # With a market_data client, e.g. the one of the BinanceClient of the
+    # caller, the shards look up the trades missed when reconnecting, sharing
+    # its rate limits. Worker processes cannot share it, they create a client
+    # of their own from keys_file, as the shards do without market_data. With
+    # batch_size or batch_interval they pass lists of records, see
+    # BinanceStreamClient. Batches also take a single send through the pipes.
+    # With a record_directory, every shard records its trades to a directory
+    # of its own in it, all read together by recorder.scan. The oldest
+    # recordings are removed past record_max_bytes, split evenly between the
+    # shards, again when shards are added.
+    def __init__(
+        self,
+        streams: List[str],
+        on_message: Callable[[Any], Any],
+        shards: Optional[int] = None,
+        processes: bool = False,
+        test_net: bool = False,
+        base_endpoint: Optional[str] = None,
+        keys_file: Optional[str] = None,
+        batch_size: int = 0,
+        batch_interval: float = 0,
+        record_directory: Optional[str] = None,
+        record_max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+        market_data: Optional[MarketDataClient] = None,
+        streams_per_shard: int = DEFAULT_STREAMS_PER_SHARD,
+    ):
+        self._streams_per_shard = streams_per_shard
+        self._grow = shards is None
+        if shards is None:
+            shards = self._needed_shards(len(streams))
+        self._shards = shards
+        self._processes = processes
+        self._on_message = on_message
+        self._test_net = test_net
+        self._base_endpoint = base_endpoint
+        self._keys_file = keys_file
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._record_directory = record_directory
+        self._record_max_bytes = record_max_bytes
+        self._market_data = market_data
+        self._streams = self._split(streams)
+        self._clients: List[BinanceStreamClient] = []
+        self._recorders: List[StreamRecorder] = []
+        self._workers: List[multiprocessing.Process] = []
+        self._controls: List[Connection] = []
+        self._receiver: Optional[threading.Thread] = None
+        self._queue = queue.SimpleQueue()  # records of the shards, without processes
+        # Pipes of the workers added once started, and a pipe to tell _receive
+        self._added_events = queue.SimpleQueue()
+        self._wakeup: Optional[Connection] = None
+        self._woken: Optional[Connection] = None
+        self._started = False
+
+    def start(self):
+        logger.info(f"Starting {self._shards} stream shards")
+        self._started = True
+        if not self._processes:
+            if self._market_data is None and self._keys_file is not None:
+                self._market_data = MarketDataClient(
+                    Transport(self._keys_file, self._test_net)
+                )
+            for shard, streams in enumerate(self._streams):
+                self._start_client(shard, streams)
+            self._receiver = threading.Thread(target=self._deliver)
+            self._receiver.start()
+            return
+        self._woken, self._wakeup = multiprocessing.Pipe(duplex=False)
+        events = [
+            self._start_worker(shard, streams)
+            for shard, streams in enumerate(self._streams)
+        ]
+        self._receiver = threading.Thread(target=self._receive, args=(events,))
+        self._receiver.start()
+
+    def set_streams(self, streams: List[str]):
+        started = len(self._streams)
+        if self._grow:
+            self._shards = max(self._needed_shards(len(streams)), self._shards)
+        split = self._split(streams)
+        for shard, (old, new) in enumerate(zip(self._streams, split)):
+            if set(old) == set(new):
+                continue
+            if self._processes:
+                self._controls[shard].send(("set_streams", new))
+            else:
+                self._clients[shard].set_streams(new)
+        self._streams = split
+        if not self._started or self._shards == started:
+            return
+        logger.info(f"Adding {self._shards - started} stream shards")
+        if self._record_directory is not None:
+            for shard in range(started):
+                if self._processes:
+                    self._controls[shard].send(("max_bytes", self._shard_max_bytes()))
+                else:
+                    self._recorders[shard].set_max_bytes(self._shard_max_bytes())
+        for shard in range(started, self._shards):
+            if self._processes:
+                self._added_events.put(self._start_worker(shard, split[shard]))
+                self._wakeup.send(None)
+            else:
+                self._start_client(shard, split[shard])
+
+    def shards(self) -> List[List[str]]:
+        return [list(streams) for streams in self._streams]
+
+    def is_alive(self) -> bool:
+        if self._processes:
+            return any(worker.is_alive() for worker in self._workers)
+        return any(client.is_alive() for client in self._clients)
+
+    def stop(self):
+        logger.info("Shutting down stream shards...")
+        for client in self._clients:
+            client.stop()
+        for control in self._controls:
+            try:
+                control.send(("stop", None))
+            except OSError:
+                pass  # the worker is gone
+
+    def join(self):
+        for client in self._clients:
+            client.join()
+        for recorder in self._recorders:
+            recorder.close()
+        for worker in self._workers:
+            worker.join()
+        if self._receiver is not None:
+            self._receiver.join()
+        if self._wakeup is not None:
+            self._wakeup.close()
+            self._woken.close()
+
+    def _start_client(self, shard: int, streams: List[str]):
+        recorder = None
+        if self._record_directory is not None:
+            recorder = StreamRecorder(
+                self._shard_directory(shard), max_bytes=self._shard_max_bytes()
+            )
+            self._recorders.append(recorder)
+        client = BinanceStreamClient(
+            streams,
+            self._queue.put,
+            test_net=self._test_net,
+            base_endpoint=self._base_endpoint,
+            market_data=self._market_data,
+            events=True,
+            batch_size=self._batch_size,
+            batch_interval=self._batch_interval,
+            recorder=recorder,
+        )
+        client.start()
+        self._clients.append(client)
+
+    def _start_worker(self, shard: int, streams: List[str]) -> Connection:
+        # Spawned, forking a process with running threads is not safe
+        context = multiprocessing.get_context("spawn")
+        events_out, events_in = context.Pipe(duplex=False)
+        control_out, control_in = context.Pipe(duplex=False)
+        worker = context.Process(
+            target=run_shard,
+            args=(
+                streams,
+                events_in,
+                control_out,
+                self._test_net,
+                self._base_endpoint,
+                self._keys_file,
+                self._batch_size,
+                self._batch_interval,
+                self._shard_directory(shard),
+                self._shard_max_bytes(),
+            ),
+            daemon=True,
+        )
+        worker.start()
+        events_in.close()
+        control_out.close()
+        self._controls.append(control_in)
+        self._workers.append(worker)
+        return events_out
+
+    def _needed_shards(self, streams: int) -> int:
+        return max(-(-streams // self._streams_per_shard), 1)
+
+    def _shard_directory(self, shard: int) -> Optional[str]:
+        if self._record_directory is None:
+            return None
+        return os.path.join(self._record_directory, f"shard-{shard}")
+
+    def _shard_max_bytes(self) -> Optional[int]:
+        if self._record_max_bytes is None:
+            return None
+        return self._record_max_bytes // self._shards
+
+    def _split(self, streams: List[str]) -> List[List[str]]:
+        # A stable hash, the one of str changes with every process
+        split: List[List[str]] = [[] for _ in range(self._shards)]
+        for stream in streams:
+            split[zlib.crc32(stream.encode()) % self._shards].append(stream)
+        for shard, shard_streams in enumerate(split):
+            if len(shard_streams) > MAX_STREAMS_PER_CONNECTION:
+                logger.warning(
+                    f"Shard {shard} has {len(shard_streams)} streams, more than "
+                    f"the {MAX_STREAMS_PER_CONNECTION} allowed per connection"
+                )
+        return split
+
+    def _deliver(self):
+        # Until every shard stopped and its last records are delivered
+        while True:
+            try:
+                event = self._queue.get(timeout=DELIVERY_POLL)
+            except queue.Empty:
+                if any(client.is_alive() for client in self._clients):
+                    continue
+                if self._queue.empty():
+                    return
+                event = self._queue.get()
+            self._on_message(event)
+
+    def _receive(self, events: List[Connection]):
+        # Until every worker closed its pipe, also the ones of the shards added
+        pending: Dict[Connection, bool] = {conn: True for conn in events}
+        while len(pending) > 0:
+            for conn in wait(list(pending) + [self._woken]):
+                if conn is self._woken:
+                    conn.recv()
+                    pending[self._added_events.get()] = True
+                    continue
+                try:
+                    event = conn.recv()
+                except EOFError:
+                    del pending[conn]
+                    continue
+                self._on_message(event)
@@ -0,0 +1,55 @@
+import json
+import logging
+from requests import Session
+from requests.adapters import HTTPAdapter
+from typing import Optional
+from .cache import ResponseCache
+from .clock import ServerClock
+from .endpoint_pool import EndpointPool, default_hosts
+from .rate_limits import RateLimiter
+from .signatures import Signer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_POOL_SIZE = 10  # keep-alive connections kept per host
+
+
+class Transport:
+    # Everything the sub-clients of a BinanceClient have in common: the
+    # credentials, the keep-alive connection pool, the hosts to reach and the
+    # rate limits and cache they share. It is created once and injected into
+    # every sub-client so that they all reuse the same connections.
+    def __init__(
+        self,
+        keys_file: str,
+        test_net: bool = False,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        rate_limiter: Optional[RateLimiter] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        cache: Optional[ResponseCache] = None,
+        server_clock: Optional[ServerClock] = None,
+    ):
+        with open(keys_file) as f:
+            keys = json.load(f)
+            accessor = "REAL" if not test_net else "TEST"
+            self.api_key = keys[accessor]["API_KEY"]
+            self.secret_key = keys[accessor]["SECRET_KEY"]
+        self.signer = Signer(self.secret_key)
+        self.test_net = test_net
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.endpoint_pool = endpoint_pool or EndpointPool(default_hosts(test_net))
+        self.cache = cache or ResponseCache()
+        self.server_clock = server_clock or ServerClock()
+        self.session = self._create_session()
+
+    def _create_session(self) -> Session:
+        session = Session()
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
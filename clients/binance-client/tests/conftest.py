@@ -0,0 +1,31 @@
+import json
+import pytest
+
+
+class FakeClock:
+    # Moved by setting now
+    def __init__(self, now: float = 6000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def keys_file(tmp_path) -> str:
+    # Credentials of both networks, requests are signed with "secret"
+    path = tmp_path / "keys.json"
+    path.write_text(
+        json.dumps(
+            {
+                "REAL": {"API_KEY": "key", "SECRET_KEY": "secret"},
+                "TEST": {"API_KEY": "test-key", "SECRET_KEY": "test-secret"},
+            }
+        )
+    )
+    return str(path)
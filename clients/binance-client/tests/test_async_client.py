@@ -0,0 +1,154 @@
+import asyncio
+import time
+from aiohttp import web
+from binance_client.async_client import AsyncBinanceClient
+from binance_client.endpoint_pool import EndpointPool
+from binance_client.signatures import sign
+from binance_client.transport import Transport
+
+
+async def serve_and_gather(keys_file):
+    async def klines(request):
+        await asyncio.sleep(0.2)
+        return web.json_response(
+            [[0, request.query["symbol"]]], headers={"x-mbx-used-weight-1m": "10"}
+        )
+
+    async def exchange_info(request):
+        return web.json_response(
+            {
+                "rateLimits": [
+                    {
+                        "rateLimitType": "REQUEST_WEIGHT",
+                        "interval": "MINUTE",
+                        "intervalNum": 1,
+                        "limit": 1200,
+                    }
+                ]
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get("/api/v3/klines", klines)
+    app.router.add_get("/api/v3/exchangeInfo", exchange_info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    binance = AsyncBinanceClient(keys_file, cache_dir=None)
+    # The first host refuses connections, every request has to fail over
+    pool = EndpointPool(["http://127.0.0.1:1", f"http://127.0.0.1:{port}"])
+    binance._transport.endpoint_pool = pool
+    loop = asyncio.get_event_loop()
+    try:
+        async with binance:
+            start = loop.time()
+            results = await asyncio.gather(
+                *[
+                    binance.market_data.kline_candlestick_data(
+                        symbol=f"S{i}BTC",
+                        interval="1m",
+                        start_time=None,
+                        end_time=None,
+                        limit=None,
+                    )
+                    for i in range(20)
+                ]
+            )
+            elapsed = loop.time() - start
+    finally:
+        await runner.cleanup()
+    return binance, pool, results, elapsed
+
+
+async def serve_signed(keys_file, run):
+    # Rejects the signed requests received after their recvWindow, as Binance
+    async def account(request):
+        timestamp = int(request.query["timestamp"])
+        if time.time() * 1000 - timestamp > int(request.query["recvWindow"]):
+            return web.json_response({"code": -1021, "msg": "Outside"}, status=400)
+        return web.json_response({"balances": []})
+
+    async def test_order(request):
+        # Signed over the query string as sent
+        query, signature = request.raw_path.split("?", 1)[1].split("&signature=")
+        if sign("secret", query) != signature:
+            return web.json_response({"code": -1022, "msg": "Invalid"}, status=400)
+        return web.json_response({"clientOrderId": request.query["newClientOrderId"]})
+
+    async def server_time(request):
+        return web.json_response({"serverTime": int(time.time() * 1000)})
+
+    app = web.Application()
+    app.router.add_get("/api/v3/account", account)
+    app.router.add_post("/api/v3/order/test", test_order)
+    app.router.add_get("/api/v3/time", server_time)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    binance = AsyncBinanceClient(keys_file, cache_dir=None)
+    binance._transport.endpoint_pool = EndpointPool([f"http://127.0.0.1:{port}"])
+    try:
+        return await run(binance)
+    finally:
+        await binance.close()
+        await runner.cleanup()
+
+
+class TestAsyncBinanceClient:
+    def test_gather_runs_requests_concurrently(self, keys_file):
+        binance, pool, results, elapsed = asyncio.run(serve_and_gather(keys_file))
+        assert [r["content"][0][1] for r in results] == [f"S{i}BTC" for i in range(20)]
+        assert all(r["http_code"] == 200 for r in results)
+        assert elapsed < 2
+        # 20 klines, the exchange information and its failed attempt
+        assert binance.rate_limits_headroom()[("REQUEST_WEIGHT", 60)] == 1200 - 22
+        health = pool.stats()
+        assert health["http://127.0.0.1:1"]["consecutive_failures"] == 1
+        assert all(
+            stats["latency"] is not None
+            for host, stats in health.items()
+            if host != "http://127.0.0.1:1"
+        )
+
+    def test_limits_are_shared_with_the_given_transport(self, keys_file):
+        shared = Transport(keys_file)
+        binance = AsyncBinanceClient(keys_file, shared=shared)
+        transport = binance._transport
+        assert transport.rate_limiter is shared.rate_limiter
+        assert transport.endpoint_pool is shared.endpoint_pool
+        assert transport.cache is shared.cache
+        assert transport.server_clock is shared.server_clock
+        assert transport.session is not shared.session
+        shared.close()
+
+    def test_signed_requests_are_stamped_when_sent(self, keys_file):
+        async def run(binance):
+            first = await binance.spot_account_trade.account_information()
+            # Delayed past its recvWindow by the rate limiter
+            binance._transport.rate_limiter.pause(1.5)
+            second = await binance.spot_account_trade.account_information(
+                recv_window=1000
+            )
+            return first, second, binance._transport.server_clock.needs_sync()
+
+        first, second, needs_sync = asyncio.run(serve_signed(keys_file, run))
+        assert first["http_code"] == 200
+        assert second == {"http_code": 200, "content": {"balances": []}}
+        assert not needs_sync
+
+    def test_signed_queries_are_sent_as_signed(self, keys_file):
+        async def run(binance):
+            return await binance.spot_account_trade.test_new_order(
+                symbol="AAABTC",
+                side="BUY",
+                order_type="MARKET",
+                quantity=1,
+                new_client_order_id="my:order/1",
+            )
+
+        result = asyncio.run(serve_signed(keys_file, run))
+        assert result == {"http_code": 200, "content": {"clientOrderId": "my:order/1"}}
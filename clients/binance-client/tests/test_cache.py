@@ -0,0 +1,49 @@
+from binance_client.cache import ResponseCache, cache_key
+from binance_client.client import MarketDataClient
+from binance_client.transport import Transport
+
+
+class TestResponseCache:
+    def test_entries_expire_after_their_ttl(self, clock):
+        cache = ResponseCache(clock=clock)
+        key = cache_key("real", "exchange_information", {})
+        cache.put(key, {"http_code": 200, "content": {}}, ttl=10)
+        assert cache.get(key) == {"http_code": 200, "content": {}}
+        clock.now += 10
+        assert cache.get(key) is None
+
+    def test_entries_survive_a_restart(self, tmp_path, clock):
+        key = cache_key("real", "exchange_information", {})
+        ResponseCache(str(tmp_path), clock=clock).put(
+            key, {"http_code": 200, "content": {"rateLimits": []}}, ttl=60
+        )
+        cache = ResponseCache(str(tmp_path), clock=clock)
+        assert cache.get(key)["content"] == {"rateLimits": []}
+        cache.clear()
+        assert ResponseCache(str(tmp_path), clock=clock).get(key) is None
+
+    def test_entries_are_not_changed_through_results(self):
+        cache = ResponseCache()
+        key = cache_key("real", "exchange_information", {})
+        result = {"http_code": 200, "content": {"symbols": []}}
+        cache.put(key, result, ttl=10)
+        result["content"]["symbols"].append("BBBBTC")
+        cache.get(key)["content"]["symbols"].append("AAABTC")
+        assert cache.get(key)["content"] == {"symbols": []}
+
+    def test_hits_are_parsed(self, keys_file):
+        client = MarketDataClient(Transport(keys_file))
+        key = cache_key("real", "exchange_information", {})
+        client._transport.cache.put(
+            key, {"http_code": 200, "content": {"symbols": ["AAABTC"]}}, ttl=10
+        )
+        result = client._forge_request_and_send(
+            "exchange_information", {}, parser=lambda content: content["symbols"]
+        )
+        assert result == {"http_code": 200, "content": ["AAABTC"]}
+
+    def test_keys_ignore_param_order_and_missing_params(self):
+        assert cache_key("real", "e", {"a": 1, "b": 2, "c": None}) == cache_key(
+            "real", "e", {"b": 2, "a": 1}
+        )
+        assert cache_key("real", "e", {}) != cache_key("test", "e", {})
@@ -0,0 +1,27 @@
+from binance_client.clock import ServerClock
+
+
+class TestServerClock:
+    def test_offset_comes_from_the_shortest_round_trip(self, clock):
+        server_clock = ServerClock(clock=clock)
+        server_clock.update(
+            [
+                (6000.0, 6002.5, 6001.0),  # slow sample, 2s offset
+                (6001.0, 6003.1, 6001.2),  # 2s offset
+            ]
+        )
+        assert abs(server_clock.offset - 2.0) < 1e-9
+        assert abs(server_clock.round_trip - 0.2) < 1e-9
+        assert server_clock.now_ms() == 6002000
+
+    def test_clock_is_refreshed_periodically(self, clock):
+        server_clock = ServerClock(clock=clock, refresh_interval=60)
+        assert server_clock.needs_sync()
+        server_clock.update([(6000.0, 6000.0, 6000.0)])
+        assert not server_clock.needs_sync()
+        clock.now += 61
+        assert server_clock.needs_sync()
+        server_clock.update([])  # a failed sync keeps the offset
+        assert not server_clock.needs_sync()
+        server_clock.invalidate()
+        assert server_clock.needs_sync()
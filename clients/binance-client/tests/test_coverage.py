@@ -0,0 +1,53 @@
+import numpy as np
+from binance_client.coverage import Coverage
+from binance_client.store import KlineStore
+
+DTYPE = np.dtype([("open_time", "i8"), ("close", "f8")])
+MINUTE = 60000
+
+
+def klines(open_times: list) -> np.ndarray:
+    array = np.zeros(len(open_times), dtype=DTYPE)
+    array["open_time"] = np.array(open_times) * MINUTE
+    return array
+
+
+class TestCoverage:
+    def test_ranges_gaps_and_duplicates(self):
+        coverage = Coverage(MINUTE)
+        assert coverage.add(np.array([0, 1, 2, 5, 6]) * MINUTE) == 0
+        assert coverage.add(np.array([6, 7, 7, 10]) * MINUTE) == 2
+        assert coverage.ranges == [
+            [0, 3 * MINUTE],
+            [5 * MINUTE, 8 * MINUTE],
+            [10 * MINUTE, 11 * MINUTE],
+        ]
+        assert coverage.duplicates == 2
+        assert coverage.gaps() == [(3 * MINUTE, 5 * MINUTE), (8 * MINUTE, 10 * MINUTE)]
+        coverage.check(3 * MINUTE, 4 * MINUTE)
+        assert coverage.gaps(end=13 * MINUTE) == [
+            (4 * MINUTE, 5 * MINUTE),
+            (8 * MINUTE, 10 * MINUTE),
+            (11 * MINUTE, 13 * MINUTE),
+        ]
+        coverage.add(np.array([3, 4]) * MINUTE)
+        assert coverage.ranges[0] == [0, 8 * MINUTE]
+
+
+class TestStoreCoverage:
+    def test_coverage_is_kept_as_klines_are_written(self, tmp_path):
+        store = KlineStore(str(tmp_path))
+        store.write("AAABTC", klines([0, 1, 2, 8, 9]))
+        store.write("AAABTC", klines([2, 3]))
+        store = KlineStore(str(tmp_path))
+        assert store.period() == MINUTE
+        assert store.ranges("AAABTC") == [(0, 4 * MINUTE), (8 * MINUTE, 10 * MINUTE)]
+        assert store.gaps("AAABTC") == [(4 * MINUTE, 8 * MINUTE)]
+        assert store.coverage("AAABTC").duplicates == 1
+
+    def test_stores_without_coverage_are_covered_from_their_klines(self, tmp_path):
+        KlineStore(str(tmp_path), MINUTE).write("AAABTC", klines([0, 1, 5]))
+        index = tmp_path / "index.json"
+        index.write_text(index.read_text().replace('"coverage"', '"unused"'))
+        store = KlineStore(str(tmp_path))
+        assert store.gaps("AAABTC") == [(2 * MINUTE, 5 * MINUTE)]
@@ -0,0 +1,46 @@
+from binance_client.endpoint_pool import EndpointPool
+
+HOSTS = ["https://a", "https://b", "https://c"]
+
+
+def measured_pool(clock, latencies):
+    # Every host picked once and measured, in order
+    pool = EndpointPool(HOSTS, clock=clock)
+    for latency in latencies:
+        host, _ = pool.pick()
+        pool.report_success(host, latency)
+    return pool
+
+
+class TestEndpointPool:
+    def test_unmeasured_hosts_go_first_then_the_fastest(self, clock):
+        pool = measured_pool(clock, [0.3, 0.1, 0.2])
+        assert pool.pick() == ("https://b", 0.0)
+        pool.report_success("https://b", 0.6)  # EWMA: 0.1 + 0.2 * 0.5
+        assert pool.stats()["https://b"]["latency"] == 0.2
+        assert pool.pick() == ("https://b", 0.0)  # ties keep the configured order
+        pool.report_success("https://b", 0.6)
+        assert pool.pick() == ("https://c", 0.0)
+
+    def test_errors_weigh_on_the_score(self, clock):
+        pool = measured_pool(clock, [0.1, 0.15, 0.2])
+        pool.report_failure("https://a")
+        clock.now += 1  # past the cooldown
+        # 0.1 * (1 + 10 * 0.2) is slower than b
+        assert pool.pick() == ("https://b", 0.0)
+        assert pool.stats()["https://a"]["error_rate"] == 0.2
+
+    def test_failing_hosts_cool_down_and_fail_over(self, clock):
+        pool = measured_pool(clock, [0.1, 0.2, 0.3])
+        pool.report_failure("https://a")
+        assert pool.pick() == ("https://b", 0.0)
+        pool.report_failure("https://b")
+        pool.report_failure("https://c")
+        pool.report_failure("https://a")  # cooling down for 1s now
+        host, wait = pool.pick()
+        assert host == "https://b" and wait == 0.5
+        clock.now += 0.5
+        assert pool.pick()[0] in ("https://b", "https://c")
+        pool.report_success("https://a", 0.1)
+        assert pool.stats()["https://a"]["consecutive_failures"] == 0
+        assert pool.stats()["https://a"]["down_until"] == 0.0
@@ -0,0 +1,37 @@
+import json
+from binance_client.events import AggTrade, BookTicker, Depth, Kline, Trade, parse_event
+
+
+class TestParseEvent:
+    def test_payloads_become_records_with_numbers(self):
+        trade = {"e": "trade", "E": 2, "s": "BNBBTC", "t": 12345, "p": "0.001"}
+        trade.update({"q": "100", "b": 88, "a": 50, "T": 1, "m": True, "M": True})
+        assert parse_event(trade) == Trade("BNBBTC", 12345, 0.001, 100.0, 1, 2, True)
+        agg = {"e": "aggTrade", "E": 2, "s": "BNBBTC", "a": 7, "p": "0.5", "q": "2"}
+        agg.update({"f": 100, "l": 105, "T": 1, "m": False, "M": True})
+        assert parse_event(agg) == AggTrade(
+            "BNBBTC", 7, 0.5, 2.0, 100, 105, 1, 2, False
+        )
+        kline = json.loads(
+            '{"e":"kline","E":3,"s":"BNBBTC","k":{"t":0,"T":59999,"s":"BNBBTC",'
+            '"i":"1m","f":100,"L":200,"o":"1","c":"2","h":"3","l":"0.5","v":"10",'
+            '"n":100,"x":false,"q":"1.5","V":"5","Q":"0.5","B":"0"}}'
+        )
+        assert parse_event(kline) == Kline(
+            "BNBBTC", "1m", 0, 59999, 1.0, 3.0, 0.5, 2.0, 10.0, 1.5, 100, False, 3
+        )
+
+    def test_book_and_depth_payloads(self):
+        ticker = {"u": 400, "s": "BNBUSDT", "b": "25.3", "B": "31", "a": "25.4"}
+        ticker["A"] = "40"
+        assert parse_event(ticker) == BookTicker("BNBUSDT", 400, 25.3, 31.0, 25.4, 40)
+        update = {"e": "depthUpdate", "E": 1, "s": "BNBBTC", "U": 157, "u": 160}
+        update.update({"b": [["0.0024", "10"]], "a": [["0.0026", "100"]]})
+        assert parse_event(update) == Depth(
+            "BNBBTC", 157, 160, [(0.0024, 10.0)], [(0.0026, 100.0)], 1
+        )
+        partial = {"lastUpdateId": 160, "bids": [["0.0024", "10"]], "asks": []}
+        assert parse_event(partial, "bnbbtc@depth5") == Depth(
+            "BNBBTC", None, 160, [(0.0024, 10.0)], [], None
+        )
+        assert parse_event({"e": "24hrTicker", "s": "BNBBTC"})["s"] == "BNBBTC"
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from aiohttp import web
+from binance_client.async_client import AsyncBinanceClient
+from binance_client.endpoint_pool import EndpointPool
+from binance_client.history import HistoryDownloader
+from binance_client.store import KlineStore
+
+MINUTE = 60000
+KLINES = 2500
+FIRST_OPEN = 1600000000000
+
+
+def kline(i: int) -> list:
+    open_time = FIRST_OPEN + i * MINUTE
+    return [open_time, str(i), str(i), str(i), str(i), "1.5", open_time + MINUTE - 1]
+
+
+async def serve_and_download(
+    keys_file,
+    out_dir,
+    pages_before_failing,
+    sync=None,
+    columnar=False,
+    start_time=1,
+    backfill=False,
+    missing=(),
+    open_last=False,
+):
+    served = {"pages": 0}
+
+    async def klines(request):
+        if served["pages"] == pages_before_failing:
+            return web.json_response(
+                {"code": -1121, "msg": "Invalid symbol."}, status=400
+            )
+        served["pages"] += 1
+        start = int(request.query["startTime"])
+        end = int(request.query["endTime"])
+        first = max(
+            -(-(start - FIRST_OPEN) // MINUTE), 0
+        )  # first open at or after start
+        last = min(
+            (end - FIRST_OPEN) // MINUTE,
+            KLINES - 1,
+            first + int(request.query["limit"]) - 1,
+        )
+        data = [
+            kline(i) + ["0", 0, "0", "0", "0"]
+            for i in range(first, last + 1)
+            if i not in missing
+        ]
+        if open_last and last == KLINES - 1:
+            # Still open, closing in a minute
+            data[-1][4] = "open"
+            data[-1][6] = int(time.time() * 1000) + MINUTE
+        return web.json_response(data)
+
+    async def exchange_info(request):
+        return web.json_response({"rateLimits": []})
+
+    app = web.Application()
+    app.router.add_get("/api/v3/klines", klines)
+    app.router.add_get("/api/v3/exchangeInfo", exchange_info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    binance = AsyncBinanceClient(keys_file, cache_dir=None)
+    binance._transport.endpoint_pool = EndpointPool([f"http://127.0.0.1:{port}"])
+    try:
+        async with binance:
+            downloader = HistoryDownloader(
+                binance, out_dir, fields=["open_time", "close"], columnar=columnar
+            )
+            end_time = FIRST_OPEN + KLINES * MINUTE
+            if backfill:
+                return await downloader.backfill(["AAABTC"], ["1m"], FIRST_OPEN)
+            if sync is not None:
+                written = await downloader.sync(sync, ["1m"], end_time=end_time)
+                return written, downloader.index()
+            return await downloader.download(["AAABTC"], ["1m"], start_time, end_time)
+    finally:
+        await runner.cleanup()
+
+
+class TestHistoryDownloader:
+    def test_interrupted_downloads_resume(self, tmp_path, keys_file):
+        out_dir = str(tmp_path / "klines")
+        first = asyncio.run(serve_and_download(keys_file, out_dir, 2))
+        assert first == {("AAABTC", "1m"): 2000}
+        second = asyncio.run(serve_and_download(keys_file, out_dir, 100))
+        assert second == {("AAABTC", "1m"): 500}
+        rows = (tmp_path / "klines" / "AAABTC_1m.csv").read_text().splitlines()
+        assert len(rows) == KLINES
+        assert rows[0] == f"{FIRST_OPEN},0"
+        assert rows[-1] == f"{FIRST_OPEN + (KLINES - 1) * MINUTE},{KLINES - 1}"
+        third = asyncio.run(serve_and_download(keys_file, out_dir, 100))
+        assert third == {("AAABTC", "1m"): 0}
+
+    def test_open_klines_are_not_written(self, tmp_path, keys_file):
+        out_dir = str(tmp_path / "klines")
+        first = asyncio.run(serve_and_download(keys_file, out_dir, 100, open_last=True))
+        assert first == {("AAABTC", "1m"): KLINES - 1}
+        path = tmp_path / "klines" / "AAABTC_1m.csv"
+        rows = path.read_text().splitlines()
+        assert rows[-1] == f"{FIRST_OPEN + (KLINES - 2) * MINUTE},{KLINES - 2}"
+        second = asyncio.run(serve_and_download(keys_file, out_dir, 100))
+        assert second == {("AAABTC", "1m"): 1}
+        rows = path.read_text().splitlines()
+        assert rows[-1] == f"{FIRST_OPEN + (KLINES - 1) * MINUTE},{KLINES - 1}"
+
+    def test_sync_appends_new_klines_and_tracks_listings(self, tmp_path, keys_file):
+        out_dir = tmp_path / "klines"
+        out_dir.mkdir()
+        # Written before the index existed, in no particular order
+        legacy = [f"{FIRST_OPEN + i * MINUTE},{i}" for i in (5, 6, 0, 1)]
+        (out_dir / "AAABTC_1m.csv").write_text("\n".join(legacy) + "\n")
+        asyncio.run(serve_and_download(keys_file, str(out_dir), 100, ["ZZZBTC"]))
+        written, index = asyncio.run(
+            serve_and_download(keys_file, str(out_dir), 100, ["AAABTC", "BBBBTC"])
+        )
+        assert written == {("AAABTC", "1m"): KLINES - 7, ("BBBBTC", "1m"): KLINES}
+        assert index[("ZZZBTC", "1m")]["delisted"]
+        assert not index[("AAABTC", "1m")]["delisted"]
+        last_open_time = FIRST_OPEN + (KLINES - 1) * MINUTE
+        assert index[("AAABTC", "1m")]["last_open_time"] == last_open_time
+        rows = (out_dir / "AAABTC_1m.csv").read_text().splitlines()
+        assert rows[:5] == legacy + [f"{FIRST_OPEN + 7 * MINUTE},7"]
+
+    def test_sync_replaces_the_last_kline(self, tmp_path, keys_file):
+        out_dir = tmp_path / "klines"
+        out_dir.mkdir()
+        # The last kline written while still open, before open klines were skipped
+        written_open = [f"{FIRST_OPEN + i * MINUTE},{i}" for i in range(4)]
+        written_open.append(f"{FIRST_OPEN + 4 * MINUTE},open")
+        path = out_dir / "AAABTC_1m.csv"
+        path.write_text("\n".join(written_open) + "\n")
+        written, index = asyncio.run(
+            serve_and_download(keys_file, str(out_dir), 100, ["AAABTC"], open_last=True)
+        )
+        assert written == {("AAABTC", "1m"): KLINES - 5}
+        rows = path.read_text().splitlines()
+        assert rows[4] == f"{FIRST_OPEN + 4 * MINUTE},4"
+        assert len(rows) == KLINES - 1
+        written, index = asyncio.run(
+            serve_and_download(keys_file, str(out_dir), 100, ["AAABTC"])
+        )
+        assert written == {("AAABTC", "1m"): 2}
+        rows = path.read_text().splitlines()
+        assert len(rows) == KLINES
+        assert rows[-1] == f"{FIRST_OPEN + (KLINES - 1) * MINUTE},{KLINES - 1}"
+        last_open_time = FIRST_OPEN + (KLINES - 1) * MINUTE
+        assert index[("AAABTC", "1m")]["last_open_time"] == last_open_time
+
+    def test_columnar_downloads_resume(self, tmp_path, keys_file):
+        out_dir = str(tmp_path / "store")
+        asyncio.run(serve_and_download(keys_file, out_dir, 1, columnar=True))
+        written = asyncio.run(
+            serve_and_download(keys_file, out_dir, 100, columnar=True)
+        )
+        assert written == {("AAABTC", "1m"): KLINES - 1000}
+        klines = KlineStore(str(tmp_path / "store" / "1m")).read("AAABTC")
+        assert list(klines) == ["open_time", "close"]
+        assert len(klines["open_time"]) == KLINES
+        assert klines["close"][-1] == KLINES - 1
+
+    def test_backfill_fetches_only_the_missing_klines(self, tmp_path, keys_file):
+        out_dir = str(tmp_path / "store")
+        later = FIRST_OPEN + 1500 * MINUTE
+        asyncio.run(
+            serve_and_download(
+                keys_file, out_dir, 100, columnar=True, start_time=later, missing=[2000]
+            )
+        )
+        store = KlineStore(str(tmp_path / "store" / "1m"))
+        assert store.ranges("AAABTC") == [
+            (later, FIRST_OPEN + 2000 * MINUTE),
+            (FIRST_OPEN + 2001 * MINUTE, FIRST_OPEN + KLINES * MINUTE),
+        ]
+        # Downloaded already, the exchange has no kline 2000
+        assert store.gaps("AAABTC") == []
+        assert store.gaps("AAABTC", FIRST_OPEN) == [(FIRST_OPEN, later)]
+        written = asyncio.run(
+            serve_and_download(keys_file, out_dir, 1, columnar=True, backfill=True)
+        )
+        assert written == {("AAABTC", "1m"): 1000}  # a page before failing
+        written = asyncio.run(
+            serve_and_download(keys_file, out_dir, 100, columnar=True, backfill=True)
+        )
+        assert written == {("AAABTC", "1m"): 500}
+        store = KlineStore(str(tmp_path / "store" / "1m"))
+        assert store.gaps("AAABTC", FIRST_OPEN) == []
+        assert store.coverage("AAABTC").duplicates == 0
@@ -0,0 +1,77 @@
+import numpy as np
+from binance_client.events import Kline
+from binance_client.kline_cache import KlineCache
+from binance_client.klines import KLINE_DTYPE
+
+MINUTE = 60000
+
+
+def kline(i: int, close: float, closed: bool) -> Kline:
+    open_time = i * MINUTE
+    return Kline(
+        "AAABTC",
+        "1m",
+        open_time,
+        open_time + MINUTE - 1,
+        1.0,
+        close,
+        0.5,
+        close,
+        10.0,
+        1.0,
+        5,
+        closed,
+        open_time + 1,
+    )
+
+
+class TestKlineCache:
+    def test_open_kline_is_updated_until_closed(self):
+        cache = KlineCache(capacity=2)
+        cache.update(kline(0, 1.0, True))
+        cache.update(kline(1, 1.1, False))
+        cache.update(kline(1, 1.2, False))
+        assert list(cache.klines("AAABTC", "1m", include_open=True)["close"]) == [
+            1.0,
+            1.2,
+        ]
+        cache.update(kline(1, 1.3, True))
+        cache.update(kline(1, 1.4, False))  # late, closed already
+        cache.update(kline(2, 1.5, True))
+        klines = cache.klines("AAABTC", "1m", include_open=True)
+        assert list(klines["open_time"]) == [MINUTE, 2 * MINUTE]
+        assert list(klines["close"]) == [1.3, 1.5]
+        assert len(cache.klines("BBBBTC", "1m")) == 0
+
+    def test_seeded_klines_come_before_the_streamed_ones(self):
+        cache = KlineCache(capacity=3)
+        cache.update(kline(3, 2.0, True))
+        seeded = np.zeros(4, dtype=KLINE_DTYPE)
+        seeded["open_time"] = np.arange(4) * MINUTE
+        seeded["close_time"] = seeded["open_time"] + MINUTE - 1
+        seeded["close"] = [1.0, 1.1, 1.2, 1.3]
+        cache.seed("AAABTC", "1m", seeded, now_ms=4 * MINUTE)
+        klines = cache.klines("AAABTC", "1m")
+        assert list(klines["close"]) == [1.1, 1.2, 2.0]
+        cache.discard("AAABTC")
+        assert len(cache.klines("AAABTC", "1m")) == 0
+
+    def test_missed_closes_are_filled_from_rest(self):
+        cache = KlineCache(capacity=10)
+        cache.update(kline(0, 1.0, True))
+        cache.update(kline(1, 1.1, True))
+        cache.update(kline(2, 1.2, False))  # its close is missed
+        cache.update(kline(4, 1.4, False))
+        assert cache.gaps() == [("AAABTC", "1m", 2 * MINUTE, 3 * MINUTE)]
+        fetched = np.zeros(3, dtype=KLINE_DTYPE)
+        fetched["open_time"] = np.arange(2, 5) * MINUTE
+        fetched["close_time"] = fetched["open_time"] + MINUTE - 1
+        fetched["close"] = [1.25, 1.3, 1.35]
+        cache.fill("AAABTC", "1m", fetched, now_ms=4 * MINUTE + 10)
+        assert cache.gaps() == []
+        klines = cache.klines("AAABTC", "1m", include_open=True)
+        assert list(klines["open_time"]) == [i * MINUTE for i in range(5)]
+        assert list(klines["close"]) == [1.0, 1.1, 1.25, 1.3, 1.4]
+        cache.update(kline(4, 1.45, True))
+        cache.update(kline(5, 1.5, False))
+        assert cache.gaps() == []
@@ -0,0 +1,25 @@
+import orjson
+from binance_client.klines import KLINE_DTYPE, parse_klines
+
+# Example from the Binance API documentation
+KLINES = orjson.loads(
+    b"""[[1499040000000, "0.01634790", "0.80000000", "0.01575800", "0.01577100",
+    "148976.11427815", 1499644799999, "2434.19055334", 308, "1756.87402397",
+    "28.46694368", "17928899.62484339"]]"""
+)
+
+
+class TestParseKlines:
+    def test_fields_get_their_dtype(self):
+        klines = parse_klines(KLINES * 3)
+        assert klines.dtype == KLINE_DTYPE
+        assert len(klines) == 3
+        assert klines["open_time"][0] == 1499040000000
+        assert klines["high"][0] == 0.8
+        assert klines["trades"][2] == 308
+        assert klines["taker_buy_quote_volume"][1] == 28.46694368
+
+    def test_no_klines(self):
+        klines = parse_klines([])
+        assert klines.dtype == KLINE_DTYPE
+        assert len(klines) == 0
@@ -0,0 +1,82 @@
+from binance_client.rate_limits import RateLimiter
+
+WEIGHT_1M = ("REQUEST_WEIGHT", 60)
+ORDERS_10S = ("ORDERS", 10)
+RAW_5M = ("RAW_REQUESTS", 300)
+
+
+def limiter(clock, weight=100, orders=5):
+    rate_limiter = RateLimiter(clock=clock)
+    rate_limiter.set_limits(
+        [
+            {
+                "rateLimitType": "REQUEST_WEIGHT",
+                "interval": "MINUTE",
+                "intervalNum": 1,
+                "limit": weight,
+            },
+            {
+                "rateLimitType": "ORDERS",
+                "interval": "SECOND",
+                "intervalNum": 10,
+                "limit": orders,
+            },
+            {
+                "rateLimitType": "RAW_REQUESTS",
+                "interval": "MINUTE",
+                "intervalNum": 5,
+                "limit": 1000,
+            },
+        ]
+    )
+    return rate_limiter
+
+
+class TestRateLimiter:
+    def test_requests_within_the_limits_are_not_delayed(self, clock):
+        rate_limiter = limiter(clock)
+        assert all(rate_limiter.reserve(weight=10) == 0 for _ in range(10))
+        assert rate_limiter.headroom()[WEIGHT_1M] == 0
+        assert rate_limiter.headroom()[RAW_5M] == 990
+
+    def test_only_overflowing_requests_are_delayed(self, clock):
+        rate_limiter = limiter(clock)
+        assert rate_limiter.reserve(weight=100) == 0
+        delay = rate_limiter.reserve(weight=10)
+        assert 60 <= delay <= 61
+        assert rate_limiter.reserve(weight=0) == 0
+        clock.now += delay
+        assert rate_limiter.headroom()[WEIGHT_1M] == 90
+
+    def test_orders_are_paced_against_the_order_window(self, clock):
+        rate_limiter = limiter(clock)
+        delays = [rate_limiter.reserve(weight=1, orders=1) for _ in range(6)]
+        assert delays[:5] == [0] * 5
+        assert 10 <= delays[5] < 10.2
+        assert rate_limiter.headroom()[ORDERS_10S] == -1  # reserved ahead
+        clock.now += delays[5]
+        assert rate_limiter.headroom()[ORDERS_10S] == 4
+
+    def test_server_reported_usage_is_booked(self, clock):
+        rate_limiter = limiter(clock)
+        rate_limiter.update(
+            {"x-mbx-used-weight-1m": "95", "X-MBX-ORDER-COUNT-10S": "5", "Date": "x"}
+        )
+        assert rate_limiter.headroom()[WEIGHT_1M] == 5
+        assert rate_limiter.headroom()[ORDERS_10S] == 0
+        assert rate_limiter.reserve(weight=10) > 0
+        assert rate_limiter.reserve(orders=1) > 0
+
+    def test_pause_blocks_every_reservation(self, clock):
+        rate_limiter = limiter(clock)
+        rate_limiter.pause(5)
+        assert rate_limiter.reserve(weight=1) == 5
+
+    def test_reservations_past_max_delay_are_not_booked(self, clock):
+        rate_limiter = limiter(clock)
+        assert rate_limiter.reserve(weight=100) == 0
+        assert rate_limiter.reserve(weight=10, max_delay=30) is None
+        assert rate_limiter.reserve(weight=10, max_delay=30) is None
+        assert rate_limiter.headroom()[WEIGHT_1M] == 0
+        assert rate_limiter.headroom()[RAW_5M] == 999
+        assert 60 <= rate_limiter.reserve(weight=10) <= 61
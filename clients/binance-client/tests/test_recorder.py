@@ -0,0 +1,54 @@
+import os
+from binance_client import recorder
+from binance_client.recorder import StreamRecorder
+
+
+def trade(i: int, symbol: str) -> dict:
+    return {
+        "e": "trade",
+        "E": i,
+        "s": symbol,
+        "t": i,
+        "p": str(i),
+        "q": "1",
+        "T": i,
+        "m": False,
+    }
+
+
+class TestStreamRecorder:
+    def test_segments_are_scanned_by_symbol_and_time(self, tmp_path):
+        directory = str(tmp_path)
+        rec = StreamRecorder(os.path.join(directory, "shard-0"), segment_records=4)
+        for i in range(10):
+            rec.record(trade(i, "AAABTC" if i % 2 == 0 else "BBBBTC"), received=i)
+        assert not rec.record({"e": "kline", "s": "AAABTC"}, received=10)
+        rec.close()
+        assert len(recorder.segments(directory)) == 3  # 4, 4 and 2 records
+
+        chunks = list(recorder.scan(directory))
+        assert [len(c) for c in chunks] == [4, 4, 2]
+        aaa = list(recorder.scan(directory, symbol="AAABTC", start=3, end=8))
+        assert [list(c["trade_id"]) for c in aaa] == [[4, 6]]
+        assert aaa[0]["price"][1] == 6.0
+
+    def test_partial_records_are_ignored(self, tmp_path):
+        directory = str(tmp_path)
+        rec = StreamRecorder(directory)
+        rec.record(trade(1, "AAABTC"), received=1)
+        rec.close()
+        path = recorder.segments(directory)[0]
+        with open(path, "ab") as f:
+            f.write(b"\0" * 10)  # a write cut short
+        assert list(recorder.read_segment(path)["trade_id"]) == [1]
+
+    def test_oldest_segments_are_removed_past_max_bytes(self, tmp_path):
+        directory = str(tmp_path)
+        max_bytes = 7 * recorder.RECORD_DTYPE.itemsize
+        rec = StreamRecorder(directory, segment_records=4, max_bytes=max_bytes)
+        for i in range(12):
+            rec.record(trade(i, "AAABTC"), received=i)
+        rec.close()
+        assert len(recorder.segments(directory)) == 2
+        chunks = list(recorder.scan(directory))
+        assert [list(c["trade_id"]) for c in chunks] == [[4, 5, 6, 7], [8, 9, 10, 11]]
@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import threading
+import time
+import types
+import numpy as np
+from binance_client.events import Trade
+from binance_client.recorder import StreamRecorder
+from binance_client.replay import (
+    ReplayBinanceClient,
+    ReplayStreamClient,
+    SimulatedClock,
+    csv_klines,
+    recorded_trades,
+    simulated_time,
+)
+
+START = 1600000000  # seconds
+HOUR = 3600
+
+
+def record_trades(directory: str):
+    # A trade of each symbol every 10 seconds for 5 minutes
+    recorder = StreamRecorder(directory)
+    for i in range(30):
+        for symbol in ["AAABTC", "BBBBTC"]:
+            recorder.record(
+                {
+                    "e": "trade",
+                    "E": (START + i * 10) * 1000,
+                    "s": symbol,
+                    "t": i,
+                    "p": "1.5",
+                    "q": "2",
+                    "T": (START + i * 10) * 1000,
+                    "m": True,
+                },
+                received=(START + i * 10) * 10**6,
+            )
+    recorder.close()
+
+
+def hourly_klines() -> dict:
+    # 3 days of hourly klines, AAABTC rising and BBBBTC falling from 100
+    open_times = (START - START % HOUR + np.arange(72) * HOUR) * 1000
+    klines = {}
+    for symbol, step in [("AAABTC", 1.0), ("BBBBTC", -1.0)]:
+        closes = 100 + step * np.arange(1, 73)
+        klines[symbol] = {
+            "open_time": open_times,
+            "open": closes - step,
+            "high": np.maximum(closes, closes - step),
+            "low": np.minimum(closes, closes - step),
+            "close": closes,
+            "volume": np.ones(72),
+        }
+    return klines
+
+
+class TestReplayStreamClient:
+    def test_schedule_loop_follows_the_replay(self, tmp_path):
+        record_trades(str(tmp_path))
+        clock = SimulatedClock(START)
+        received = []
+        crunched = []  # (simulated time, trades received by then)
+
+        def loop():
+            for _ in range(4):
+                clock.sleep(60)
+                crunched.append((clock.now(), len(received)))
+
+        looper = threading.Thread(target=loop)
+        looper.start()
+        while clock.next_wake() is None:
+            time.sleep(0.01)
+        replay = ReplayStreamClient(
+            ["aaabtc@trade"],
+            received.extend,
+            recorded_trades(str(tmp_path)),
+            clock=clock,
+            speed=0,
+            events=True,
+            batch_size=4,
+            batch_interval=20,
+        )
+        replay.start()
+        replay.join()
+        looper.join()
+        assert len(received) == 30
+        assert all(isinstance(t, Trade) and t.symbol == "AAABTC" for t in received)
+        assert [t.trade_id for t in received] == list(range(30))
+        assert [now - START for now, _ in crunched] == [60, 120, 180, 240]
+        # Passed in batches of 20 simulated seconds at most, the trades at 0,
+        # 10, 20, 30, 40 and 50 seconds are passed once 60 seconds are due
+        assert [count for _, count in crunched] == [6, 12, 18, 24]
+
+    def test_klines_are_replayed_at_close_times(self, tmp_path):
+        path = tmp_path / "AAABTC.csv"
+        open_time = START * 1000
+        # As in bnndata
+        path.write_text(
+            f"{open_time},1,2,0.5,1.5,10,15,3\n{open_time + 60000},1.5,3,1,2,20,40,5\n"
+        )
+        received = []
+        replay = ReplayStreamClient(
+            ["aaabtc@kline_1m"],
+            received.append,
+            csv_klines(str(path), "AAABTC", "1m"),
+            speed=0,
+            events=True,
+        )
+        replay.start()
+        replay.join()
+        assert [k.close for k in received] == [1.5, 2.0]
+        assert [k.trades for k in received] == [3, 5]
+        assert all(k.closed for k in received)
+        assert replay.clock().now() == START + 120
+
+
+class TestSimulatedTime:
+    def test_modules_read_the_clock(self):
+        bot = types.ModuleType("bot")
+        bot.dtt = datetime.datetime
+        bot.time = time
+        clock = SimulatedClock(START)
+        with simulated_time(clock, [bot]):
+            assert bot.dtt.now().timestamp() == START
+            assert bot.time.time() == START
+            clock.advance(START + 90)
+            assert bot.dtt.now().timestamp() == START + 90
+        assert bot.dtt is datetime.datetime and bot.time is time
+
+
+class TestReplayBinanceClient:
+    def test_klines_are_the_ones_closed_by_the_clock(self):
+        first = START - START % HOUR
+        clock = SimulatedClock(first + 48 * HOUR)
+        binance = ReplayBinanceClient(clock, hourly_klines(), "1h")
+        market_data = binance.market_data
+        r = market_data.kline_candlestick_data("AAABTC", "1h", None, None, 10, True)
+        assert len(r["content"]) == 10
+        assert r["content"]["close_time"][-1] == (first + 48 * HOUR) * 1000 - 1
+        clock.advance(first + 49 * HOUR)
+        days = market_data.kline_candlestick_data("AAABTC", "1d", None, None, None)
+        assert [int(kline[0]) % 86400000 for kline in days["content"]] == [0] * 3
+        assert float(days["content"][-1][2]) == 149.0  # high of the last kline
+        month = market_data.kline_candlestick_data("AAABTC", "1M", None, None, None)
+        assert len(month["content"]) == 1
+        assert month["content"][0][0] == 1598918400000  # 2020-09-01
+        refused = market_data.kline_candlestick_data("AAABTC", "1m", None, None, None)
+        assert refused["http_code"] == 400
+
+    def test_growers_are_the_ones_of_the_simulated_day(self):
+        first = START - START % HOUR
+        clock = SimulatedClock(first + 36 * HOUR)
+        binance = ReplayBinanceClient(clock, hourly_klines(), "1h")
+        statistics = binance.market_data.twentyfourhour_ticker_price_change_statistics()
+        changes = {s["symbol"]: s for s in statistics["content"]}
+        # The klines opened from 12 to 36 hours
+        assert changes["AAABTC"]["openPrice"] == "112.0"
+        assert changes["AAABTC"]["lastPrice"] == "136.0"
+        assert float(changes["BBBBTC"]["priceChangePercent"]) < 0
+        symbols = binance.market_data.exchange_information()["content"]["symbols"]
+        assert [symbol["symbol"] for symbol in symbols] == ["AAABTC", "BBBBTC"]
+
+    def test_account_and_async_requests(self):
+        clock = SimulatedClock(START)
+        binance = ReplayBinanceClient(
+            clock, hourly_klines(), "1h", balances={"BTC": 0.5}
+        )
+        account = binance.spot_account_trade.account_information()["content"]
+        assert account["balances"] == [
+            {"asset": "BTC", "free": "0.50000000", "locked": "0.00000000"}
+        ]
+        order = binance.spot_account_trade.test_new_order(
+            symbol="AAABTC", side="BUY", order_type="MARKET", quantity=1
+        )
+        assert order == {"http_code": 200, "content": {}}
+
+        async def request():
+            async_binance = binance.asynchronous()
+            try:
+                return await async_binance.market_data.kline_candlestick_data(
+                    symbol="AAABTC",
+                    interval="1h",
+                    start_time=None,
+                    end_time=None,
+                    limit=500,
+                    as_array=True,
+                )
+            finally:
+                await async_binance.close()
+
+        r = asyncio.run(request())
+        assert len(r["content"]) == 0  # no kline closed yet
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from binance_client import constants
+from binance_client.client import MarketDataClient, SpotAccountTradeClient
+from binance_client.endpoint_pool import EndpointPool
+from binance_client.endpoints import endpoints_config
+from binance_client.retry import RetryPolicy, retry_policy
+from binance_client.transport import Transport
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Fails the first request of every path with a 503
+    seen = set()
+
+    def _respond(self):
+        path = self.path.split("?")[0]
+        code = 200 if path in self.seen or path == "/api/v3/time" else 503
+        self.seen.add(path)
+        body = json.dumps({"path": path, "serverTime": time.time() * 1000}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+def serve():
+    server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class TestRetryPolicy:
+    def test_attempts_are_bounded(self):
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.next_delay(1, code=503) is not None
+        assert policy.next_delay(3, code=503) is None
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=5)
+        delays = [policy.next_delay(8, code=500) for _ in range(100)]
+        assert all(0 <= d <= 5 for d in delays)
+        assert len(set(delays)) > 1
+
+    def test_client_errors_are_not_retried(self):
+        assert RetryPolicy().next_delay(1, code=400) is None
+        assert RetryPolicy().next_delay(1, code=429) == 0
+
+    def test_non_idempotent_requests_only_retry_unsent(self):
+        policy = retry_policy(endpoints_config["spot_account_trade"]["new_order"])
+        assert policy.next_delay(1, code=503) is None
+        assert policy.next_delay(1, sent=True) is None
+        assert policy.next_delay(1, sent=False) == 0
+
+    def test_policy_defaults_on_method(self):
+        assert retry_policy({"method": "GET"}) is retry_policy(
+            {"method": "DELETE", "retry": constants.RETRY_POLICY_IDEMPOTENT}
+        )
+
+
+class TestSend:
+    def test_transient_errors_are_retried(self, keys_file):
+        server, host = serve()
+        try:
+            client = MarketDataClient(
+                Transport(keys_file, endpoint_pool=EndpointPool([host]))
+            )
+            res = client.test_connectivity()
+            assert res["http_code"] == 200
+        finally:
+            server.shutdown()
+
+    def test_orders_are_never_sent_twice(self, keys_file):
+        server, host = serve()
+        try:
+            client = SpotAccountTradeClient(
+                Transport(keys_file, endpoint_pool=EndpointPool([host]))
+            )
+            res = client.new_order(
+                symbol="BTCUSDT", side="BUY", order_type="MARKET", quantity=1
+            )
+            assert res["http_code"] == 503
+        finally:
+            server.shutdown()
@@ -0,0 +1,54 @@
+import threading
+import numpy as np
+from binance_client.events import Trade
+from binance_client.ring import TradeRing
+
+
+def trade(i: int, symbol: str = "AAABTC") -> Trade:
+    return Trade(symbol, i, float(i), 1.0, i, i, False)
+
+
+class TestTradeRing:
+    def test_drains_in_order_across_the_wrap(self):
+        ring = TradeRing(capacity=4)
+        for i in range(3):
+            ring.push(trade(i))
+        assert list(ring.drain(max_trades=2)["time"]) == [0, 1]
+        for i in range(3, 6):
+            ring.push(trade(i, "BBBBTC"))
+        assert not ring.push(trade(6))  # full
+        assert ring.overflows == 1
+        drained = ring.drain()
+        assert list(drained["price"]) == [2.0, 3.0, 4.0, 5.0]
+        symbols = ring.symbols()
+        assert [symbols[i] for i in drained["symbol"]] == ["AAABTC"] + ["BBBBTC"] * 3
+        assert len(ring) == 0 and len(ring.drain()) == 0
+
+    def test_push_many_wraps_and_counts_overflows(self):
+        ring = TradeRing(capacity=4)
+        ring.push(trade(0))
+        ring.drain()
+        assert ring.push_many([trade(i, "BBBBTC") for i in range(1, 6)]) == 4
+        assert ring.overflows == 1
+        drained = ring.drain()
+        assert list(drained["time"]) == [1, 2, 3, 4]
+        assert ring.symbols() == ["AAABTC", "BBBBTC"]
+        assert set(drained["symbol"]) == {1}
+        assert ring.push_many([]) == 0
+
+    def test_concurrent_producer_and_consumer(self):
+        ring = TradeRing(capacity=64)
+        pushed = 5000
+        drained = []
+
+        def produce():
+            for i in range(pushed):
+                while not ring.push(trade(i)):
+                    pass
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        while producer.is_alive() or len(ring) > 0:
+            drained.append(ring.drain()["time"])
+        producer.join()
+        assert np.array_equal(np.concatenate(drained), np.arange(pushed))
@@ -0,0 +1,81 @@
+import numpy as np
+from binance_client.rollups import RollupPyramid, rollup
+from binance_client.store import KlineStore
+
+DTYPE = np.dtype(
+    [
+        ("open_time", "i8"),
+        ("open", "f8"),
+        ("high", "f8"),
+        ("low", "f8"),
+        ("close", "f8"),
+        ("volume", "f8"),
+        ("trades", "i8"),
+    ]
+)
+DAY = 1609459200000  # 2021-01-01
+QUARTER = 15 * 60000
+
+
+def klines(first: int, count: int) -> np.ndarray:
+    rng = np.random.default_rng(first)
+    array = np.zeros(count, dtype=DTYPE)
+    array["open_time"] = first + np.arange(count) * QUARTER
+    array["open"] = rng.random(count)
+    array["close"] = rng.random(count)
+    array["high"] = 1 + rng.random(count)
+    array["low"] = -rng.random(count)
+    array["volume"] = rng.random(count)
+    array["trades"] = rng.integers(0, 100, count)
+    return array
+
+
+def columns(array: np.ndarray) -> dict:
+    return {name: array[name] for name in array.dtype.names}
+
+
+class TestRollup:
+    def test_buckets_aggregate_their_klines(self):
+        base = klines(DAY + QUARTER, 8)  # starts in the middle of an hour
+        hours = rollup(columns(base), 60)
+        assert list(hours["open_time"]) == [DAY, DAY + 3600000, DAY + 7200000]
+        assert hours["open"][0] == base["open"][0]
+        assert hours["close"][1] == base["close"][6]
+        assert hours["high"][1] == base["high"][3:7].max()
+        assert hours["low"][2] == base["low"][7]
+        assert hours["trades"][1] == base["trades"][3:7].sum()
+        assert np.isclose(hours["volume"].sum(), base["volume"].sum())
+
+
+class TestRollupPyramid:
+    def test_incremental_updates_match_a_full_build(self, tmp_path):
+        data = klines(DAY, 96 * 3)
+        incremental = RollupPyramid(str(tmp_path / "incremental"))
+        incremental.store("15m").write("AAABTC", data[:150])
+        incremental.update()
+        incremental.store("15m").write("AAABTC", data[150:])
+        incremental.update()
+        full = RollupPyramid(str(tmp_path / "full"))
+        full.store("15m").write("AAABTC", data)
+        full.update()
+        assert incremental.levels() == ["15m", "1h", "4h", "1d"]
+        for level in ("1h", "4h", "1d"):
+            expected = full.store(level).read("AAABTC")
+            got = incremental.store(level).read("AAABTC")
+            for name in DTYPE.names:
+                assert np.array_equal(got[name], expected[name]), (level, name)
+        assert len(full.store("1d").read("AAABTC")["open_time"]) == 3
+
+    def test_reads_use_the_coarsest_dividing_level(self, tmp_path):
+        pyramid = RollupPyramid(str(tmp_path))
+        pyramid.store("15m").write("AAABTC", klines(DAY, 96))
+        pyramid.update()
+        assert pyramid.level_for(15 * 484) == "1h"
+        assert pyramid.level_for(45) == "15m"
+        assert pyramid.level_for(120) == "1h"
+        assert pyramid.level_for(2880) == "1d"
+        assert pyramid.level_for(5) is None
+        assert len(pyramid.read("AAABTC", 480)["open_time"]) == 6
+        assert RollupPyramid.is_pyramid(str(tmp_path))
+        assert not RollupPyramid.is_pyramid(str(tmp_path / "15m"))
+        assert KlineStore.is_store(str(tmp_path / "4h"))
@@ -0,0 +1,33 @@
+from binance_client.signatures import Signer, sign
+
+# Example from the Binance API documentation
+SECRET_KEY = "NhqPtmdSJYdKjVHjA7PZj4Mge3R5YNiP1e3UZjInClVN65XAbvqqM6A7H5fATj0j"
+QUERY = (
+    "symbol=LTCBTC&side=BUY&type=LIMIT&timeInForce=GTC&quantity=1&price=0.1"
+    "&recvWindow=5000&timestamp=1499827319559"
+)
+SIGNATURE = "c8db56825ae71d6d79447849e617115f4a920fa2acdcab2b053c4b2838bd6b71"
+
+
+class TestSigner:
+    def test_signatures_match_the_documentation(self):
+        signer = Signer(SECRET_KEY)
+        assert sign(SECRET_KEY, QUERY) == SIGNATURE
+        assert signer.sign(QUERY) == SIGNATURE
+        assert signer.sign(QUERY) == SIGNATURE  # the keyed state is not consumed
+
+    def test_signed_query_is_ready_to_send(self):
+        params = {
+            "symbol": "LTCBTC",
+            "side": "BUY",
+            "type": "LIMIT",
+            "timeInForce": "GTC",
+            "quantity": 1,
+            "price": 0.1,
+            "stopPrice": None,
+            "recvWindow": 5000,
+            "timestamp": 1499827319559,
+        }
+        assert Signer(SECRET_KEY).signed_query(params) == (
+            f"{QUERY}&signature={SIGNATURE}"
+        )
@@ -0,0 +1,46 @@
+import numpy as np
+from binance_client.store import KlineStore
+
+DTYPE = np.dtype([("open_time", "i8"), ("close", "f8"), ("trades", "i8")])
+JAN = 1609459200000  # 2021-01-01
+FEB = 1612137600000  # 2021-02-01
+HOUR = 3600000
+
+
+def klines(first: int, count: int, close: float = 1.0) -> np.ndarray:
+    array = np.zeros(count, dtype=DTYPE)
+    array["open_time"] = first + np.arange(count) * HOUR
+    array["close"] = close
+    array["trades"] = np.arange(count)
+    return array
+
+
+class TestKlineStore:
+    def test_klines_are_partitioned_by_month(self, tmp_path):
+        store = KlineStore(str(tmp_path))
+        store.write("AAABTC", klines(FEB - 2 * HOUR, 4))
+        assert store.symbols() == ["AAABTC"]
+        partitions = store.partitions("AAABTC")
+        assert sorted(partitions) == ["2021-01", "2021-02"]
+        assert partitions["2021-02"]["first_open_time"] == FEB
+        assert partitions["2021-02"]["rows"] == 2
+
+    def test_rewritten_klines_replace_the_stored_ones(self, tmp_path):
+        store = KlineStore(str(tmp_path))
+        store.write("AAABTC", klines(JAN, 10))
+        store.write("AAABTC", klines(JAN + 5 * HOUR, 10, close=2.0))
+        read = KlineStore(str(tmp_path)).read("AAABTC")
+        assert len(read["open_time"]) == 15
+        assert np.all(np.diff(read["open_time"]) == HOUR)
+        assert read["close"][4] == 1.0 and read["close"][5] == 2.0
+        assert len(list((tmp_path / "AAABTC").iterdir())) == 1  # old version removed
+
+    def test_reads_touch_only_the_requested_range_and_columns(self, tmp_path):
+        store = KlineStore(str(tmp_path))
+        store.write("AAABTC", klines(JAN, 24 * 45))
+        read = store.read("AAABTC", start=FEB, end=FEB + 3 * HOUR, columns=["close"])
+        assert list(read) == ["close"]
+        assert len(read["close"]) == 3
+        assert isinstance(read["close"], np.memmap)  # single partition, no copy
+        assert len(store.read("AAABTC", start=FEB * 2)["open_time"]) == 0
+        assert len(store.read("BBBBTC")["close"]) == 0
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import threading
+import websockets
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+from binance_client import stream
+from binance_client.client import MarketDataClient
+from binance_client.endpoint_pool import EndpointPool
+from binance_client.stream import AsyncStreamClient, BinanceStreamClient
+from binance_client.transport import Transport
+
+LAST_TRADE = 9
+
+
+def trade(i: int) -> dict:
+    return {"e": "trade", "E": i, "s": "AAABTC", "t": i, "p": "1", "q": "1", "T": i}
+
+
+class TradesHandler(BaseHTTPRequestHandler):
+    # Historical trades from fromId on, the last one sent live is LAST_TRADE
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        first = int(query["fromId"][0])
+        trades = [
+            {
+                "id": i,
+                "price": "1",
+                "qty": "1",
+                "time": i,
+                "isBuyerMaker": False,
+                "isBestMatch": True,
+            }
+            for i in range(first, LAST_TRADE + 1)
+        ]
+        body = json.dumps(trades).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def serve_streams(run):
+    # A stream server acknowledging every request and sending a trade of
+    # every subscribed stream each 10 ms
+    state = {"requests": [], "connections": 0, "subscribed": set()}
+
+    async def handler(ws, *args):
+        state["connections"] += 1
+
+        async def trades():
+            while True:
+                for name in sorted(state["subscribed"]):
+                    await ws.send(json.dumps({"stream": name, "data": {"t": 1}}))
+                await asyncio.sleep(0.01)
+
+        sender = asyncio.ensure_future(trades())
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                state["requests"].append(request)
+                if request["method"] == "SUBSCRIBE":
+                    state["subscribed"] |= set(request["params"])
+                elif request["method"] == "UNSUBSCRIBE":
+                    state["subscribed"] -= set(request["params"])
+                await ws.send(json.dumps({"result": None, "id": request["id"]}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+
+    server = await websockets.serve(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        await run(f"ws://127.0.0.1:{port}", state)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+class TestBinanceStreamClient:
+    def test_streams_change_without_reconnecting(self):
+        received = []
+
+        async def run(endpoint, state):
+            client = BinanceStreamClient(
+                ["aaabtc@trade"], received.append, base_endpoint=endpoint
+            )
+            client.start()
+            try:
+                await wait_for(lambda: client.subscriptions() == ["aaabtc@trade"])
+                client.set_streams(["aaabtc@trade", "bbbbtc@trade"])
+                await wait_for(lambda: len(client.subscriptions()) == 2)
+                client.set_streams(["bbbbtc@trade"])
+                await wait_for(lambda: client.subscriptions() == ["bbbbtc@trade"])
+                await wait_for(lambda: "bbbbtc" in received[-1])
+            finally:
+                client.stop()
+                await asyncio.get_running_loop().run_in_executor(None, client.join)
+            requests = [(r["method"], r["params"]) for r in state["requests"]]
+            assert requests[:4] == [
+                ("SET_PROPERTY", ["combined", True]),
+                ("SUBSCRIBE", ["aaabtc@trade"]),
+                ("SUBSCRIBE", ["bbbbtc@trade"]),
+                ("UNSUBSCRIBE", ["aaabtc@trade"]),
+            ]
+            assert len({r["id"] for r in state["requests"]}) == len(requests)
+            assert state["connections"] == 1
+            assert not any('"result"' in message for message in received)
+
+        asyncio.run(serve_streams(run))
+
+    def test_messages_are_batched(self):
+        received = []
+
+        async def run(endpoint, state):
+            client = BinanceStreamClient(
+                ["aaabtc@trade", "bbbbtc@trade"],
+                received.append,
+                base_endpoint=endpoint,
+                batch_size=4,
+                batch_interval=0.05,
+            )
+            client.start()
+            try:
+                await wait_for(lambda: len(received) >= 3)
+            finally:
+                client.stop()
+                await asyncio.get_running_loop().run_in_executor(None, client.join)
+            assert all(isinstance(batch, list) for batch in received)
+            assert all(0 < len(batch) <= 4 for batch in received)
+            assert any("bbbbtc" in message for message in received[-1])
+
+        asyncio.run(serve_streams(run))
+
+    def test_missed_trades_are_looked_up_after_reconnecting(
+        self, keys_file, monkeypatch
+    ):
+        monkeypatch.setattr(stream, "RECONNECT_BASE_DELAY", 0.01)
+        rest = HTTPServer(("127.0.0.1", 0), TradesHandler)
+        threading.Thread(target=rest.serve_forever, daemon=True).start()
+        host = f"http://127.0.0.1:{rest.server_address[1]}"
+        market_data = MarketDataClient(
+            Transport(keys_file, endpoint_pool=EndpointPool([host]))
+        )
+        connections = []
+        received = []
+
+        async def handler(ws, *args):
+            connections.append(ws)
+            async for message in ws:
+                request = json.loads(message)
+                await ws.send(json.dumps({"result": None, "id": request["id"]}))
+                if request["method"] != "SUBSCRIBE":
+                    continue
+                # The first connection is lost after trade 3, trades 4 to 7
+                # are missed until the second one
+                trades = [1, 2, 3] if len(connections) == 1 else [8, 9]
+                for i in trades:
+                    data = {"stream": "aaabtc@trade", "data": trade(i)}
+                    await ws.send(json.dumps(data, separators=(",", ":")))
+                if len(connections) == 1:
+                    await ws.close()
+
+        async def run():
+            server = await websockets.serve(handler, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            client = BinanceStreamClient(
+                ["aaabtc@trade"],
+                received.append,
+                base_endpoint=f"ws://127.0.0.1:{port}",
+                market_data=market_data,
+            )
+            client.start()
+            try:
+                await wait_for(lambda: len(received) == LAST_TRADE)
+            finally:
+                client.stop()
+                await asyncio.get_running_loop().run_in_executor(None, client.join)
+                server.close()
+                await server.wait_closed()
+
+        try:
+            asyncio.run(run())
+        finally:
+            market_data._transport.close()
+            rest.shutdown()
+            rest.server_close()
+        trade_ids = [json.loads(message)["data"]["t"] for message in received]
+        assert trade_ids == list(range(1, LAST_TRADE + 1))
+        assert len(connections) == 2
+
+
+class TestAsyncStreamClient:
+    def test_messages_are_iterated_until_stopped(self):
+        received = []
+
+        async def run(endpoint, state):
+            async with AsyncStreamClient(
+                ["aaabtc@trade"], base_endpoint=endpoint
+            ) as stream:
+                async for message in stream:
+                    received.append(message)
+                    if len(received) == 3:
+                        stream.stop()
+            assert len(received) >= 3
+            assert all("aaabtc" in message for message in received)
+            assert state["requests"][-1]["method"] == "UNSUBSCRIBE"
+
+        asyncio.run(serve_streams(run))
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import threading
+import websockets
+from binance_client.client import MarketDataClient
+from binance_client.ring import TradeRing
+from binance_client.supervisor import StreamSupervisor
+from binance_client.transport import Transport
+
+STREAMS = [f"{symbol}btc@trade" for symbol in ("aaa", "fff", "ggg", "hhh", "eee")]
+
+
+async def serve_trades(run):
+    # Sends a trade for every stream subscribed
+    subscriptions = []
+
+    async def handler(ws, *args):
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                await ws.send(json.dumps({"result": None, "id": request["id"]}))
+                if request["method"] != "SUBSCRIBE":
+                    continue
+                subscriptions.append(request["params"])
+                for stream in request["params"]:
+                    symbol = stream.split("@")[0].upper()
+                    data = {"e": "trade", "E": 2, "s": symbol, "t": 1, "p": "0.5"}
+                    data.update({"q": "3", "T": 1, "m": True})
+                    await ws.send(json.dumps({"stream": stream, "data": data}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    server = await websockets.serve(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        await run(f"ws://127.0.0.1:{port}")
+    finally:
+        server.close()
+        await server.wait_closed()
+    return subscriptions
+
+
+async def wait_for(condition, timeout=30):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+def supervise(processes: bool):
+    received = []
+    shards = []
+
+    async def run(endpoint):
+        supervisor = StreamSupervisor(
+            STREAMS[:4],
+            received.append,
+            shards=3,
+            processes=processes,
+            base_endpoint=endpoint,
+        )
+        supervisor.start()
+        try:
+            await wait_for(lambda: len(received) == 4)
+            supervisor.set_streams(STREAMS)
+            await wait_for(lambda: len(received) == 5)
+        finally:
+            supervisor.stop()
+            await asyncio.get_running_loop().run_in_executor(None, supervisor.join)
+        shards.extend(supervisor.shards())
+
+    subscriptions = asyncio.run(serve_trades(run))
+    assert sorted(sum(shards, [])) == sorted(STREAMS)
+    return received, subscriptions, shards
+
+
+def grow(processes: bool, tmp_path):
+    received = []
+    supervisors = []
+
+    async def run(endpoint):
+        supervisor = StreamSupervisor(
+            STREAMS[:2],
+            received.append,
+            processes=processes,
+            base_endpoint=endpoint,
+            record_directory=str(tmp_path),
+            record_max_bytes=3000,
+            streams_per_shard=2,
+        )
+        supervisors.append(supervisor)
+        supervisor.start()
+        try:
+            await wait_for(lambda: len(received) == 2)
+            assert len(supervisor.shards()) == 1
+            supervisor.set_streams(STREAMS)
+            await wait_for(lambda: len({event.symbol for event in received}) == 5)
+        finally:
+            supervisor.stop()
+            await asyncio.get_running_loop().run_in_executor(None, supervisor.join)
+
+    asyncio.run(serve_trades(run))
+    shards = supervisors[0].shards()
+    assert len(shards) == 3
+    assert sorted(sum(shards, [])) == sorted(STREAMS)
+    assert sorted(os.listdir(tmp_path)) == ["shard-0", "shard-1", "shard-2"]
+    return supervisors[0]
+
+
+class TestStreamSupervisor:
+    def test_streams_are_sharded_over_connections(self):
+        received, subscriptions, shards = supervise(processes=False)
+        assert sorted(event.symbol for event in received) == [
+            "AAABTC",
+            "EEEBTC",
+            "FFFBTC",
+            "GGGBTC",
+            "HHHBTC",
+        ]
+        # A subscription per shard with streams, then only the new stream
+        assert sorted(sum(subscriptions[:-1], [])) == sorted(STREAMS[:4])
+        assert len(subscriptions) - 1 == 3
+        assert subscriptions[-1] == ["eeebtc@trade"]
+
+    def test_shards_can_run_in_processes(self):
+        received, subscriptions, _ = supervise(processes=True)
+        assert len(received) == 5
+        assert subscriptions[-1] == ["eeebtc@trade"]
+
+    def test_shards_are_added_as_the_streams_grow(self, tmp_path):
+        supervisor = grow(processes=False, tmp_path=tmp_path)
+        # The recording budget is split again between the shards
+        assert [recorder._max_bytes for recorder in supervisor._recorders] == [1000] * 3
+
+    def test_workers_are_added_as_the_streams_grow(self, tmp_path):
+        grow(processes=True, tmp_path=tmp_path)
+
+    def test_shards_feed_a_single_producer_ring(self, keys_file):
+        market_data = MarketDataClient(Transport(keys_file))
+        ring = TradeRing(capacity=16)
+        threads = set()
+
+        def on_message(trade):
+            threads.add(threading.get_ident())
+            ring.push(trade)
+
+        async def run(endpoint):
+            supervisor = StreamSupervisor(
+                STREAMS,
+                on_message,
+                shards=2,
+                base_endpoint=endpoint,
+                market_data=market_data,
+            )
+            supervisor.start()
+            try:
+                assert all(len(streams) > 0 for streams in supervisor.shards())
+                # The lookups of every shard share the limits of the caller
+                assert all(
+                    shard._client._market_data is market_data
+                    for shard in supervisor._clients
+                )
+                await wait_for(lambda: len(ring) == len(STREAMS))
+            finally:
+                supervisor.stop()
+                await asyncio.get_running_loop().run_in_executor(None, supervisor.join)
+
+        asyncio.run(serve_trades(run))
+        assert len(threads) == 1
+        assert threading.get_ident() not in threads
+        symbols = ring.symbols()
+        drained = ring.drain()
+        assert sorted(symbols[i] for i in drained["symbol"]) == sorted(
+            stream.split("@")[0].upper() for stream in STREAMS
+        )
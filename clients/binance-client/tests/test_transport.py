@@ -0,0 +1,25 @@
+from binance_client.client import MarketDataClient, WalletClient
+from binance_client.transport import Transport
+
+
+class TestTransport:
+    def test_credentials_of_the_network(self, keys_file):
+        assert Transport(keys_file).api_key == "key"
+        test = Transport(keys_file, test_net=True)
+        assert (test.api_key, test.secret_key) == ("test-key", "test-secret")
+        assert len(test.endpoint_pool.stats()) == 1
+
+    def test_sub_clients_share_everything(self, keys_file):
+        transport = Transport(keys_file, pool_size=3)
+        wallet = WalletClient(transport)
+        market_data = MarketDataClient(transport)
+        assert wallet._transport is market_data._transport
+        adapter = transport.session.get_adapter("https://api.binance.com")
+        assert adapter is transport.session.get_adapter("http://127.0.0.1")
+        assert adapter._pool_maxsize == 3
+        # A reservation of one sub-client counts for the others
+        headroom = transport.rate_limiter.headroom()
+        market_data._transport.rate_limiter.reserve(weight=10)
+        after = wallet._transport.rate_limiter.headroom()
+        assert after[("REQUEST_WEIGHT", 60)] == headroom[("REQUEST_WEIGHT", 60)] - 10
+        transport.close()
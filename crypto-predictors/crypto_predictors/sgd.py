@@ -12,6 +12,30 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 TIMEZONE = "Europe/Berlin"
+# Stored kline field -> training column, in the order of the csvs
+STORE_COLUMNS = {
+    "open_time": "ts",
+    "open": "open",
+    "high": "high",
+    "low": "low",
+    "close": "close",
+    "volume": "volume",
+    "quote_volume": "quote_volume",
+    "trades": "number_of_trades",
+}
+
+STORE_INDEX = "index.json"  # of a binance_client KlineStore
+
+
+def _is_store(path: str) -> bool:
+    return os.path.exists(os.path.join(path, STORE_INDEX))
+
+
+def _is_pyramid(path: str) -> bool:
+    # A RollupPyramid is a KlineStore per level
+    return os.path.isdir(path) and any(
+        _is_store(os.path.join(path, name)) for name in os.listdir(path)
+    )
 
 
 class SGDPredictor:
@@ -32,25 +56,7 @@ class SGDPredictor:
         self._train()
 
     def _train(self):
-        for pair_csv in os.listdir(self._train_data_path):
-            pair_path = self._train_data_path + pair_csv
-            # df = pd.read_csv(pair_path, sep=",", names=["ts", "price", "vol"])
-            df = pd.read_csv(
-                pair_path,
-                sep=",",
-                names=[
-                    "ts",
-                    "open",
-                    "high",
-                    "low",
-                    "close",
-                    "volume",
-                    "quote_volume",
-                    "number_of_trades",
-                ],
-            )
-            if df.empty:
-                continue
+        for pair, df in self._training_data():
             df["datetime"] = pd.to_datetime(df["ts"], unit="ms")
             df = df.set_index("datetime")
             ts_df = df[["ts"]].resample(self._batch_size).first()
@@ -91,6 +97,8 @@ class SGDPredictor:
                 -self._future_periods
             )
             resampled_df = resampled_df.dropna()
+            if resampled_df.empty:
+                continue  # fewer batches than the lags and targets need
             # TRAINING
             features = [
                 "open",
@@ -109,9 +117,56 @@ class SGDPredictor:
                 except Exception as e:
                     logger.info(f"Exception when training: {e}")
                     print(e)
-                    print(f"PAIR: {pair_csv}, FEATURES:\n{features_df.head(20)}")
+                    print(f"PAIR: {pair}, FEATURES:\n{features_df.head(20)}")
         logger.info("SGD Model training complete.")
 
+    def _training_data(self):
+        # Yields (pair, klines dataframe) from a RollupPyramid, a KlineStore or a
+        # folder of csvs. A pyramid serves the coarsest klines that the batches
+        # are made of, so that resampling them is cheap. Stored klines come in
+        # one frame per range without missing klines, so that the lag features
+        # never reach across a gap.
+        # binance_client is not a dependency of this package, it is only
+        # imported to read its stores, a folder of csvs does not need it
+        columns = list(STORE_COLUMNS)
+        if _is_pyramid(self._train_data_path):
+            from binance_client.rollups import RollupPyramid
+
+            pyramid = RollupPyramid(self._train_data_path)
+            minutes = int(pd.Timedelta(self._batch_size).total_seconds() // 60)
+            yield from self._store_frames(
+                pyramid.symbols(),
+                lambda pair: pyramid.ranges(pair, minutes),
+                lambda pair, start, end: pyramid.read(
+                    pair, minutes, start, end, columns=columns
+                ),
+            )
+            return
+        if _is_store(self._train_data_path):
+            from binance_client.store import KlineStore
+
+            store = KlineStore(self._train_data_path)
+            yield from self._store_frames(
+                store.symbols(),
+                store.ranges,
+                lambda pair, start, end: store.read(pair, start, end, columns=columns),
+            )
+            return
+        for pair_csv in os.listdir(self._train_data_path):
+            pair_path = self._train_data_path + pair_csv
+            # df = pd.read_csv(pair_path, sep=",", names=["ts", "price", "vol"])
+            df = pd.read_csv(pair_path, sep=",", names=list(STORE_COLUMNS.values()))
+            if not df.empty:
+                yield pair_csv, df
+
+    def _store_frames(self, pairs, ranges, read):
+        for pair in pairs:
+            for start, end in ranges(pair):
+                klines = read(pair, start, end)
+                df = pd.DataFrame({STORE_COLUMNS[c]: klines[c] for c in klines})
+                if not df.empty:
+                    yield pair, df
+
     def predict(
         self, df: pd.DataFrame, max_price: float, max_quote_vol: float, max_not: int
     ):
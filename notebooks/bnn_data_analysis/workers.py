@@ -1,4 +1,5 @@
 import pandas as pd
+from binance_client.store import KlineStore
 
 features = [
     "ts",
@@ -13,6 +14,7 @@ features = [
 ]
 
 data_folder = "../../bnndata"
+store_folder = "../../bnnstore/15m"
 
 
 def csv_to_df(csv):
@@ -21,6 +23,16 @@ def csv_to_df(csv):
     return df
 
 
+def store_to_df(pair):
+    klines = KlineStore(store_folder).read(pair)
+    df = pd.DataFrame({"ts": klines["open_time"]})
+    for feature in features[1:-2]:
+        df[feature] = klines[feature]
+    df["number_of_trades"] = klines["trades"]
+    df["pair"] = pair
+    return df
+
+
 def group_df_by_pair(pair, bnn_data):
     pass
 